@@ -0,0 +1,160 @@
+"""
+TruthShield — Admission Control for Inference
+
+Under a burst, every click used to queue behind the model until the
+browser gave up minutes later. The engine now decides up front whether it
+can still finish a generation in time:
+
+    queue full      — max_depth generations already admitted and unfinished
+    over the SLO    — estimated wait beyond slo_s seconds
+
+The estimated wait is the expected output of the admitted work plus this
+request, divided by recent throughput. Expected output is the token budget
+times the observed fill ratio, because stop criteria usually end a
+generation before max_tokens. Throughput is tokens completed per second
+while the engine had work, so batching gains are included. Before the
+first completions there is no estimate and only the depth bound applies.
+
+A reservation ends when its generation does, however it ends (finished,
+failed, cancelled or timed out). A reservation whose CancelToken has fired
+stops counting right away, even while the runtime is still unwinding it,
+e.g. waiting for the model lock.
+
+Refused work raises Overloaded immediately. The UI then either reports it
+or degrades to the simulation/PATIENT_MCQS fast path (--overload-policy).
+Cache hits and requests that join an identical in-flight generation add no
+work, so they are never refused.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import METRICS
+
+QUEUE_FULL = "queue_full"
+OVER_SLO = "slo"
+
+
+class Overloaded(RuntimeError):
+    """Raised instead of queueing a generation the engine could not finish within its SLO."""
+
+    def __init__(self, reason: str = QUEUE_FULL, estimated_wait_s: float = None):
+        self.reason = reason
+        self.estimated_wait_s = estimated_wait_s
+        if reason == OVER_SLO and estimated_wait_s is not None:
+            message = f"Estimated wait {estimated_wait_s:.0f}s exceeds the SLO"
+        else:
+            message = "Inference queue is full"
+        super().__init__(message)
+
+
+class _Ticket:
+    def __init__(self, budget: int, cancel=None):
+        self.budget = budget
+        self.cancel = cancel
+        # Tokens actually generated; set by the caller once the text is known
+        self.tokens = None
+
+
+class AdmissionController:
+    """Bounded admission with a throughput-based wait estimate (0 disables a bound)."""
+
+    def __init__(self, max_depth: int = 0, slo_s: float = 0.0, window: int = 32):
+        self.max_depth = max_depth
+        self.slo_s = slo_s
+        self._lock = threading.Lock()
+        self._outstanding = set()
+        # (tokens generated, token budget, busy seconds attributed) per completion
+        self._samples = deque(maxlen=window)
+        # Start of the busy time not yet attributed to a completion; None while idle
+        self._busy_mark = None
+
+    def configure(self, max_depth: int = None, slo_s: float = None):
+        if max_depth is not None:
+            self.max_depth = max(0, int(max_depth))
+        if slo_s is not None:
+            self.slo_s = max(0.0, float(slo_s))
+
+    def depth(self) -> int:
+        with self._lock:
+            self._prune()
+            return len(self._outstanding)
+
+    def tokens_per_s(self):
+        """Recent throughput while busy, or None before the first completion."""
+        with self._lock:
+            return self._rate()
+
+    def estimate_wait_s(self, max_tokens: int = 0):
+        """Seconds until a new request with this budget would finish, or None without data."""
+        with self._lock:
+            self._prune()
+            return self._estimate(max_tokens)
+
+    def _rate(self):
+        busy = sum(s[2] for s in self._samples)
+        tokens = sum(s[0] for s in self._samples)
+        return tokens / busy if busy > 0 and tokens > 0 else None
+
+    def _estimate(self, max_tokens):
+        rate = self._rate()
+        if rate is None:
+            return None
+        budget = sum(s[1] for s in self._samples)
+        fill = min(1.0, sum(s[0] for s in self._samples) / budget) if budget else 1.0
+        pending = sum(t.budget for t in self._outstanding) + max_tokens
+        return pending * fill / rate
+
+    @contextmanager
+    def admit(self, max_tokens: int, cancel=None):
+        """Holds an admission slot for one generation; raises Overloaded if it cannot be served in time.
+
+        Set ticket.tokens to the generated token count before leaving the block
+        so the completion feeds the throughput estimate. The slot is released
+        when the block exits by any route, or as soon as cancel (a CancelToken) fires.
+        """
+        ticket = self._admit(max_tokens, cancel)
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def _admit(self, max_tokens, cancel):
+        with self._lock:
+            self._prune()
+            if self.max_depth and len(self._outstanding) >= self.max_depth:
+                METRICS.incr("admission_rejected_queue_full")
+                raise Overloaded(QUEUE_FULL, self._estimate(max_tokens))
+            estimate = self._estimate(max_tokens)
+            if estimate is not None:
+                METRICS.observe("admission_estimated_wait_s", estimate)
+                if self.slo_s and estimate > self.slo_s:
+                    METRICS.incr("admission_rejected_slo")
+                    raise Overloaded(OVER_SLO, estimate)
+            ticket = _Ticket(max_tokens, cancel)
+            if not self._outstanding:
+                self._busy_mark = time.time()
+            self._outstanding.add(ticket)
+            METRICS.incr("admission_admitted")
+            return ticket
+
+    def _prune(self):
+        """Drops reservations whose CancelToken fired; that work will not finish. Call under lock."""
+        for ticket in [t for t in self._outstanding if t.cancel is not None and t.cancel.reason is not None]:
+            self._outstanding.discard(ticket)
+            METRICS.incr("admission_released_cancelled")
+        if not self._outstanding:
+            self._busy_mark = None
+
+    def _release(self, ticket):
+        now = time.time()
+        with self._lock:
+            self._outstanding.discard(ticket)
+            if ticket.tokens is not None and self._busy_mark is not None:
+                # Busy time since the previous completion produced these tokens
+                self._samples.append((ticket.tokens, ticket.budget, now - self._busy_mark))
+                self._busy_mark = now
+            if not self._outstanding:
+                self._busy_mark = None
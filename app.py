@@ -9,6 +9,7 @@ all hospital departments. Runs 100% offline using MedGemma-4B-instruct
 Usage:
     python main.py
     python main.py --model-path ./models/medgemma-4b-awq
+    python app.py --engine-url http://127.0.0.1:8765
 """
 
 import argparse
@@ -29,6 +30,9 @@ from prompts import (
 from scenarios import SCENARIOS, get_scenario_list, get_scenario
 from integration import generate_fhir_bundle, generate_api_curl_sample
 from questions import PATIENT_MCQS
+from engine_client import RemoteEngine
+from cpu_topology import add_topology_arguments, configure_from_args, pin_inference_thread, pin_server_thread
+from session_store import SESSIONS
 import huggingface_hub
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -56,8 +60,6 @@ class ClinicalAIEngine:
         self.model_name = "None (Simulation Active)"
         self.device = "cpu"
         self.load_error: str = ""
-        # Track personalized questions for the final honesty report
-        self.current_personalized_qs = []
 
     def detect_local_models(self):
         """Scans ./models/ for compatible transformers models."""
@@ -143,9 +145,7 @@ class ClinicalAIEngine:
         inputs = self.tokenizer(input_text, return_tensors="pt").to(self.model.device)
         
         import torch
-        # Extreme CPU optimization: Use all cores
-        torch.set_num_threads(os.cpu_count() or 4)
-        
+        # Thread counts and core pinning are set once at startup (cpu_topology.configure_from_args)
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs, max_new_tokens=max_tokens, 
@@ -815,7 +815,7 @@ def create_app():
         # ─── Event Handlers ──────────────────────────────────────────
         
         # 1. Patient Portal Submission
-        def _handle_story_submission(story):
+        def _handle_story_submission(story, request: gr.Request):
             if not story.strip():
                 return ["""<div style="color:var(--c-red);font-weight:600;margin-top:10px;">⚠️ Please enter your story before proceeding.</div>""", gr.update()] + [gr.update() for _ in range(10)] + [gr.update(), gr.update()]
             
@@ -829,7 +829,8 @@ def create_app():
                 else:
                     updates.append(gr.update(visible=False))
             
-            AI_ENGINE.current_personalized_qs = new_qs
+            # Per browser session: concurrent patients each keep their own survey
+            SESSIONS.set(request.session_hash, "personalized_qs", new_qs)
             
             status_html = """<div style="color:var(--c-primary);font-weight:600;margin-top:10px;">✨ Story Processed. MedGemma has generated a 10-point diagnostic survey below.</div>"""
             # We don't know the department for manual entry unless AI predicts it, let's keep it 'General Medicine'
@@ -842,16 +843,18 @@ def create_app():
             outputs=[patient_status, mcq_survey_group] + mcq_components + [patient_initial_actions, department_display]
         )
 
-        def _submit_patient_data(survey, *mcqs):
+        # gr.Request comes first: Gradio inserts it at its parameter index, which *mcqs would shift
+        def _submit_patient_data(request: gr.Request, survey, *mcqs):
             if not survey.strip():
                 return """<div style="color:var(--c-red);font-weight:600;margin-top:10px;">⚠️ Please enter some text before submitting.</div>""", gr.update()
             
             # Combine MCQ data for the clinician's hidden textbox
+            personalized_qs = SESSIONS.get(request.session_hash, "personalized_qs", [])
             mcq_summary = "\n\n--- STRUCTURED CLINICAL SURVEY ---\n"
             for i, val in enumerate(mcqs):
                 # Use personalized question if available, otherwise fallback to static
-                if AI_ENGINE.current_personalized_qs and i < len(AI_ENGINE.current_personalized_qs):
-                    q = AI_ENGINE.current_personalized_qs[i][0]
+                if personalized_qs and i < len(personalized_qs):
+                    q = personalized_qs[i][0]
                 else:
                     q = PATIENT_MCQS[i]["question"]
                 mcq_summary += f"{i+1}. {q} → {val if val else 'No answer'}\n"
@@ -865,7 +868,8 @@ def create_app():
             outputs=[patient_status, survey_input]
         )
         
-        def _clear_patient_portal():
+        def _clear_patient_portal(request: gr.Request):
+            SESSIONS.drop(request.session_hash)
             return (
                 ["", ""] + 
                 [None] * 5 + 
@@ -995,9 +999,20 @@ def main():
     parser.add_argument("--model-path", type=str, default=None, help="Path to AWQ-quantized MedGemma model")
     parser.add_argument("--port", type=int, default=7860, help="Server port (default: 7860)")
     parser.add_argument("--share", action="store_true", help="Create public Gradio link")
+    parser.add_argument("--engine-url", type=str, default=None, help="Use a running inference_server.py (e.g. http://127.0.0.1:8765) instead of loading MedGemma in this process")
+    add_topology_arguments(parser)
     args = parser.parse_args()
 
-    if args.model_path:
+    global AI_ENGINE
+    if not args.engine_url:
+        # Before torch creates its thread pools; the model loads on the inference cores
+        configure_from_args(args)
+        pin_inference_thread()
+    if args.engine_url:
+        # Thin client: the shared daemon owns the weights
+        AI_ENGINE = RemoteEngine(args.engine_url)
+        print(f"[TruthShield] Using inference server at {args.engine_url} ({AI_ENGINE.state})")
+    elif args.model_path:
         load_model(args.model_path)
     else:
         # Auto-detect and load any synchronized model
@@ -1009,6 +1024,8 @@ def main():
             print(f"[TruthShield] No local weights found: {msg}")
             print("[TruthShield] Starting in Simulation Mode. Use 'Model Management' to sync MedGemma.\n")
 
+    # Gradio/uvicorn threads spawned from here on inherit the server cores
+    pin_server_thread()
     app = create_app()
     # Note: server_name set to "localhost" per user security preference for offline use
     print(f"\n[TruthShield] Server starting at http://localhost:{args.port}\n")
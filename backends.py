@@ -0,0 +1,796 @@
+"""
+TruthShield — Pluggable Inference Backends
+
+ClinicalAIEngine delegates load / generate / stream / token counting to one
+of these runtimes:
+
+    transformers — AutoModelForCausalLM + generate() (batching, prefix KV cache,
+                   draft-model and prompt-lookup speculative decoding)
+    onnx         — exported decoder-with-past graph on ONNX Runtime (CPU EP),
+                   driven through the same generate() API via optimum
+    llama_cpp    — GGUF weights through llama-cpp-python; much higher tokens/s on
+                   CPU-only edge boxes
+
+All heavy imports are lazy so the UI-only build keeps working without them.
+"""
+
+import glob
+import os
+import queue
+import threading
+
+from batching import RowBudgetStop, RowStreamer
+from cpu_topology import get_topology, pin_inference_thread
+from metrics import METRICS
+from cancellation import CancelStop, CancelToken, GenerationCancelled
+from prefix_cache import PrefixKVCache, SpeculativePrefill, common_prefix_len
+from priority import PriorityLock, current_priority, priority_scope
+from speculative import ForwardCounter, record_speculation, resolve_model_dir
+from stopping import TextStopChecker, TokenTextStop, record_early_stop
+
+# Prompt-lookup decoding: candidate span length and n-gram size matched against the prompt
+PROMPT_LOOKUP_TOKENS = 10
+PROMPT_LOOKUP_NGRAM = 3
+
+# Greedy decoding with a fixed repetition penalty on every backend
+REPETITION_PENALTY = 1.1
+
+
+def find_gguf(model_path: str):
+    """Returns the GGUF file for a path (the file itself, or the best candidate in a directory)."""
+    if not model_path:
+        return None
+    if os.path.isfile(model_path) and model_path.endswith(".gguf"):
+        return model_path
+    candidates = sorted(glob.glob(os.path.join(model_path, "*.gguf")))
+    if not candidates:
+        return None
+    # Prefer a quantized file over the f16 intermediate produced by setup_model.py
+    quantized = [c for c in candidates if "f16" not in os.path.basename(c).lower()]
+    return (quantized or candidates)[0]
+
+
+def find_onnx(model_path: str):
+    """Returns (onnx_dir, file_name) for the exported decoder, preferring quantized then optimized graphs."""
+    if not model_path:
+        return None, None
+    onnx_dir = model_path if glob.glob(os.path.join(model_path, "*.onnx")) else os.path.join(model_path, "onnx")
+    if not os.path.isdir(onnx_dir):
+        return None, None
+    names = [os.path.basename(f) for f in glob.glob(os.path.join(onnx_dir, "*.onnx"))]
+    for preferred in ("_quantized.onnx", "_optimized.onnx", "model.onnx"):
+        matches = sorted(n for n in names if n.endswith(preferred))
+        if matches:
+            return onnx_dir, matches[0]
+    return (onnx_dir, sorted(names)[0]) if names else (None, None)
+
+
+def detect_backend(model_path: str) -> str:
+    """Picks the runtime a weights directory is meant for (GGUF, then ONNX, then transformers)."""
+    if find_onnx(model_path)[0] and not find_gguf(model_path):
+        try:
+            import onnxruntime  # noqa: F401
+            import optimum.onnxruntime  # noqa: F401
+            return "onnx"
+        except ImportError:
+            pass
+    if find_gguf(model_path):
+        try:
+            import llama_cpp  # noqa: F401
+            return "llama_cpp"
+        except ImportError:
+            if os.path.exists(os.path.join(model_path, "config.json")):
+                print("[TruthShield] GGUF weights found but llama-cpp-python is missing; using transformers.")
+                return "transformers"
+            return "llama_cpp"
+    return "transformers"
+
+
+def _report(progress, percent: int, message: str):
+    if progress is not None:
+        progress(percent, message)
+
+
+def create_backend(name: str, **options):
+    """Instantiates a runtime; options a runtime does not understand are ignored."""
+    if name == "transformers":
+        return TransformersBackend(**options)
+    if name == "onnx":
+        return OnnxRuntimeBackend()
+    if name == "llama_cpp":
+        return LlamaCppBackend()
+    raise ValueError(f"Unknown inference backend: {name}")
+
+
+class InferenceBackend:
+    """Interface implemented by every inference runtime."""
+
+    name = "base"
+    supports_batching = False
+
+    def __init__(self):
+        self.device = "cpu"
+        # Which weights file/format was actually loaded; part of the result-cache identity
+        self.variant = ""
+        # Serializes every generate call on this runtime, most urgent waiter first (see priority.py)
+        self.lock = PriorityLock()
+
+    def load(self, model_path: str, draft_model_path: str = None, progress=None):
+        """Loads weights; progress(percent, message), when given, is called at each stage."""
+        raise NotImplementedError
+
+    def render_prompt(self, prompt_text: str, system_msg: str) -> str:
+        """Chat-template text for one system/user exchange."""
+        raise NotImplementedError
+
+    def count_tokens(self, text: str) -> int:
+        raise NotImplementedError
+
+    def generate(self, input_text: str, max_tokens: int, prefix_text: str = None, decoding: str = "auto",
+                 grammar: str = None, stop=None, cancel=None) -> str:
+        """grammar: optional output constraint spec, e.g. "mcq:10" (see constrained.py).
+        stop: optional stopping-criterion specs, e.g. ["summary_line"] (see stopping.py).
+        cancel: optional CancelToken checked every decode step; raises GenerationCancelled.
+        """
+        raise NotImplementedError
+
+    def stream(self, input_text: str, max_tokens: int, prefix_text: str = None, decoding: str = "auto",
+               grammar: str = None, stop=None, cancel=None):
+        """Yields text increments; the default emits the full result at once."""
+        yield self.generate(
+            input_text, max_tokens, prefix_text=prefix_text, decoding=decoding, grammar=grammar, stop=stop,
+            cancel=cancel,
+        )
+
+    def generate_batch(self, requests):
+        """Serves a scheduler batch; runtimes without batching decode rows back to back.
+
+        A row cancelled mid-decode yields its GenerationCancelled in place of text.
+        Streamed rows (request.sink set) decode through stream() and feed their sink.
+        """
+        results = []
+        for r in requests:
+            try:
+                if r.sink is not None:
+                    text = ""
+                    for piece in self.stream(
+                        r.input_text, r.max_tokens, prefix_text=r.prefix_text, cancel=r.cancel, **r.options
+                    ):
+                        r.sink(piece)
+                        text += piece
+                    results.append(text)
+                else:
+                    results.append(self.generate(
+                        r.input_text, r.max_tokens, prefix_text=r.prefix_text, cancel=r.cancel, **r.options
+                    ))
+            except GenerationCancelled as e:
+                results.append(e)
+        return results
+
+    def speculative_enabled(self) -> bool:
+        return False
+
+    def speculative_prefill(self, input_text: str, should_stop=None) -> int:
+        """Prefills input_text ahead of its request (see prefix_cache.SpeculativePrefill).
+
+        Returns the tokens prefilled; runtimes without a reusable KV cache do nothing.
+        """
+        return 0
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# transformers — AutoModelForCausalLM
+# ─────────────────────────────────────────────────────────────────────────────
+
+class TransformersBackend(InferenceBackend):
+    """The original AutoModelForCausalLM + generate() path."""
+
+    name = "transformers"
+    supports_batching = True
+    # Whether past_key_values can be seeded from the preamble cache
+    supports_prefix_cache = True
+
+    def __init__(self, compile_model: bool = False, compile_cache_dir: str = None, **options):
+        super().__init__()
+        self.compile_model = compile_model
+        self.compile_cache_dir = compile_cache_dir
+        self.model = None
+        self.tokenizer = None
+        # Optional small draft model for assisted (speculative) decoding
+        self.draft_model = None
+        self.draft_tokenizer = None
+        # Past-key-values of each distinct system-message preamble
+        self.prefix_cache = PrefixKVCache()
+        # Past-key-values of the prompt still being typed (patient story)
+        self.typing_prefill = SpeculativePrefill()
+
+    def load(self, model_path: str, draft_model_path: str = None, progress=None):
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        import torch
+
+        # Load tokenizer (left padding so batched prompts end on the same column)
+        _report(progress, 5, "Loading tokenizer")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        # Smart weight loading for CPU vs GPU
+        is_cuda = torch.cuda.is_available()
+        load_device = "cuda" if is_cuda else "cpu"
+
+        _report(progress, 15, "Loading weights")
+        if not is_cuda and self._load_prequantized(model_path):
+            self.device = str(self.model.device)
+            self.prefix_cache.clear()
+            self.typing_prefill.clear()
+            _report(progress, 80, "Loading draft model")
+            self._load_draft(draft_model_path)
+            self._maybe_compile(progress)
+            return
+
+        try:
+            # Optimized for CPU execution on 16GB RAM systems - avoid float32 for RAM safety
+            self.model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                device_map=load_device,
+                trust_remote_code=True,
+                low_cpu_mem_usage=True
+            )
+        except Exception as e:
+            print(f"[TruthShield] Standard load failed, trying auto map: {e}")
+            self.model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                device_map="auto",
+                trust_remote_code=True
+            )
+
+        self.device = str(self.model.device)
+        self.prefix_cache.clear()
+        self.typing_prefill.clear()
+        _report(progress, 80, "Loading draft model")
+        self._load_draft(draft_model_path)
+        self._maybe_compile(progress)
+
+    def _maybe_compile(self, progress=None):
+        """Opt-in torch.compile of the forward; Inductor artifacts persist in compile_cache_dir.
+
+        Compilation itself happens lazily on the first forward, i.e. during warmup.
+        """
+        if not self.compile_model:
+            return
+        import torch
+
+        if self.compile_cache_dir:
+            cache_dir = os.path.abspath(self.compile_cache_dir)
+            os.makedirs(cache_dir, exist_ok=True)
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+            os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+            os.environ.setdefault("TORCHINDUCTOR_AUTOGRAD_CACHE", "1")
+        try:
+            import torch._inductor.config as inductor_config
+            inductor_config.fx_graph_cache = True
+        except Exception:
+            pass
+
+        _report(progress, 85, "Compiling model forward")
+        try:
+            # Prompt and KV lengths vary per request, so compile for dynamic shapes once
+            self.model.forward = torch.compile(self.model.forward, dynamic=True)
+            self.variant = (self.variant + "+compiled").lstrip("+")
+            print(f"[TruthShield] torch.compile enabled (cache: {self.compile_cache_dir or 'default'})")
+        except Exception as e:
+            print(f"[TruthShield] torch.compile unavailable, running eager: {e}")
+
+    def _load_prequantized(self, model_path) -> bool:
+        """Maps the setup_model.py --prequantize artifact if present; False means load normally."""
+        from quantized_artifact import find_artifact, load_artifact, read_manifest
+
+        artifact_dir = find_artifact(model_path)
+        if not artifact_dir:
+            return False
+        try:
+            self.model = load_artifact(model_path, artifact_dir)
+            self.variant = f"prequantized-int{read_manifest(artifact_dir)['bits']}"
+            return True
+        except Exception as e:
+            print(f"[TruthShield] Pre-quantized artifact not used, converting at load time instead: {e}")
+            return False
+
+    def _load_draft(self, draft_model_path):
+        """Loads the optional draft model; any failure falls back to plain greedy decoding."""
+        self.draft_model = None
+        self.draft_tokenizer = None
+        if not draft_model_path:
+            return
+        draft_dir = resolve_model_dir(draft_model_path)
+        if not draft_dir:
+            print(f"[TruthShield] Draft model not found ({draft_model_path}); using plain greedy decoding.")
+            return
+        try:
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+            self.draft_tokenizer = AutoTokenizer.from_pretrained(draft_dir, trust_remote_code=True)
+            self.draft_model = AutoModelForCausalLM.from_pretrained(
+                draft_dir, device_map=self.device, trust_remote_code=True, low_cpu_mem_usage=True
+            )
+            print(f"[TruthShield] Speculative decoding enabled with draft: {os.path.basename(draft_dir)}")
+        except Exception as e:
+            self.draft_model = None
+            self.draft_tokenizer = None
+            print(f"[TruthShield] Draft model load failed, using plain greedy decoding: {e}")
+
+    def speculative_enabled(self) -> bool:
+        return self.draft_model is not None
+
+    def render_prompt(self, prompt_text, system_msg):
+        messages = [
+            {"role": "system", "content": system_msg},
+            {"role": "user", "content": prompt_text},
+        ]
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _generation_kwargs(self):
+        return dict(
+            do_sample=False, # Greedy decoding for maximum stability
+            repetition_penalty=REPETITION_PENALTY, # Reduced for speed
+            pad_token_id=self.tokenizer.pad_token_id,
+        )
+
+    @staticmethod
+    def _new_cache():
+        from transformers import DynamicCache
+        return DynamicCache()
+
+    def _forward_into(self, ids, cache):
+        """Prefills ids on top of cache in place."""
+        import torch
+
+        with torch.no_grad():
+            self.model(input_ids=torch.tensor([ids], device=self.model.device), past_key_values=cache, use_cache=True)
+
+    def _prefix_past(self, prefix_text, input_ids):
+        """Copy of the cached preamble KV for this request, built on first use. Call under lock.
+
+        A typing-time prefill that shares more of input_ids than the preamble is used instead.
+        """
+        def _prefill(ids):
+            cache = self._new_cache()
+            self._forward_into(ids, cache)
+            return cache
+
+        prefix_ids = self.tokenizer(prefix_text, return_tensors="pt")["input_ids"][0].tolist()
+        entry = self.prefix_cache.get_or_build(prefix_text, prefix_ids, _prefill)
+        typed = self.typing_prefill.entry()
+        if typed is not None and common_prefix_len(typed[0], input_ids) > common_prefix_len(entry[0], input_ids):
+            METRICS.incr("speculative_prefill_hits")
+            entry = typed
+        return self.prefix_cache.reuse(entry, input_ids)
+
+    def speculative_prefill(self, input_text, should_stop=None):
+        """Advances the typing-time KV one chunk per lock hold.
+
+        Never waits for the lock: if a request is decoding, or should_stop()
+        reports one waiting, the prefill gives up and the next call resumes it.
+        """
+        if not self.supports_prefix_cache or self.model is None:
+            return 0
+        target = self.tokenizer(input_text, return_tensors="pt")["input_ids"][0].tolist()
+        total = 0
+        while not (should_stop and should_stop()):
+            if not self.lock.acquire(blocking=False):
+                break
+            try:
+                added = self.typing_prefill.advance(target, self._new_cache, self._forward_into)
+            finally:
+                self.lock.release()
+            if not added:
+                break
+            total += added
+        return total
+
+    def _eos_token_ids(self):
+        eos = self.model.generation_config.eos_token_id
+        ids = list(eos) if isinstance(eos, (list, tuple)) else [eos]
+        return ids + [self.tokenizer.eos_token_id]
+
+    def generate(self, input_text, max_tokens, prefix_text=None, decoding="auto", grammar=None, stop=None,
+                 cancel=None, streamer=None):
+        """Single-prompt generate; only the suffix after the cached system preamble is prefilled.
+
+        decoding: "auto" (draft-assisted when a draft is loaded, else greedy),
+        "greedy" (never speculate) or "prompt_lookup" (n-gram drafts copied from the prompt).
+        All three produce greedy-equivalent text. The cached preamble seeds greedy and
+        prompt-lookup decoding; draft-assisted calls prefill in full.
+        grammar: constraint spec (see constrained.py); constrained calls decode plain greedy.
+        stop: stopping-criterion specs (see stopping.py) ending generation before max_tokens.
+        cancel: CancelToken checked at every step; the partial output is discarded.
+        """
+        import torch
+
+        if cancel is not None:
+            cancel.check()
+        inputs = self.tokenizer(input_text, return_tensors="pt").to(self.model.device)
+        if grammar:
+            decoding = "greedy"
+
+        with self.lock, torch.no_grad():
+            extra = {}
+            if grammar:
+                from transformers import LogitsProcessorList
+                from constrained import build_logits_processor
+                extra["logits_processor"] = LogitsProcessorList([
+                    build_logits_processor(grammar, self.tokenizer, self._eos_token_ids())
+                ])
+            criteria = []
+            text_stop = None
+            if stop:
+                text_stop = TokenTextStop(TextStopChecker(stop), self.tokenizer, inputs["input_ids"].shape[1])
+                criteria.append(text_stop)
+            if cancel is not None:
+                criteria.append(CancelStop([cancel]))
+            if criteria:
+                from transformers import StoppingCriteriaList
+                extra["stopping_criteria"] = StoppingCriteriaList(criteria)
+            counters = []
+            if decoding == "auto" and self.draft_model is not None:
+                # Assisted decoding keeps greedy-equivalent output; the draft re-prefills on its own
+                extra["assistant_model"] = self.draft_model
+                if self.draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                    extra.update(tokenizer=self.tokenizer, assistant_tokenizer=self.draft_tokenizer)
+                counters = [ForwardCounter(self.model), ForwardCounter(self.draft_model)]
+            elif decoding == "prompt_lookup":
+                # Alerts quote survey/notes spans verbatim, so prompt n-grams make cheap drafts
+                extra.update(prompt_lookup_num_tokens=PROMPT_LOOKUP_TOKENS, max_matching_ngram_size=PROMPT_LOOKUP_NGRAM)
+                counters = [ForwardCounter(self.model)]
+            if prefix_text and self.supports_prefix_cache and "assistant_model" not in extra:
+                try:
+                    past, _ = self._prefix_past(prefix_text, inputs["input_ids"][0].tolist())
+                    if past is not None:
+                        extra["past_key_values"] = past
+                except Exception as e:
+                    # Architectures without croppable dynamic caches simply prefill in full
+                    print(f"[TruthShield] Prefix cache unavailable, prefilling in full: {e}")
+            try:
+                outputs = self.model.generate(
+                    **inputs, max_new_tokens=max_tokens, streamer=streamer, **extra, **self._generation_kwargs()
+                )
+            finally:
+                for c in counters:
+                    c.remove()
+            if cancel is not None:
+                cancel.check()
+            new_tokens = outputs.shape[1] - inputs["input_ids"].shape[1]
+            if text_stop is not None and text_stop.fired:
+                record_early_stop(text_stop.fired, max_tokens, new_tokens)
+            if decoding == "prompt_lookup":
+                record_speculation(new_tokens, counters[0].calls, prefix="lookup")
+            elif counters:
+                record_speculation(new_tokens, counters[0].calls, counters[1].calls)
+        return self.tokenizer.decode(outputs[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+
+    def stream(self, input_text, max_tokens, prefix_text=None, decoding="auto", grammar=None, stop=None,
+               cancel=None):
+        """Runs generate on a background thread and yields text as the streamer decodes it.
+
+        If the consumer stops iterating (closed generator), the decode is cancelled.
+        """
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        cancel = cancel or CancelToken()
+        errors = []
+        # The decode thread takes the model lock in the caller's place in the priority order
+        context = current_priority()
+
+        def _decode():
+            pin_inference_thread()
+            try:
+                with priority_scope(context):
+                    self.generate(
+                        input_text, max_tokens, prefix_text=prefix_text, decoding=decoding, grammar=grammar,
+                        stop=stop, cancel=cancel, streamer=streamer,
+                    )
+            except Exception as e:
+                errors.append(e)
+                streamer.end()  # Unblock the consumer below
+
+        worker = threading.Thread(target=_decode, name="truthshield-stream", daemon=True)
+        worker.start()
+        try:
+            for piece in streamer:
+                if piece:
+                    yield piece
+        finally:
+            if worker.is_alive():
+                cancel.cancel()
+        worker.join()
+        if errors:
+            raise errors[0]
+
+    def generate_batch(self, requests):
+        """Runs one padded generate call and hands each request its own decoded slice.
+
+        Streamed rows receive their text step by step through a RowStreamer.
+        """
+        keys = {r.batch_key for r in requests}
+        if len(requests) == 1 or self.draft_model is not None or None in keys or len(keys) > 1:
+            # Solo requests skip padding and reuse the cached system preamble;
+            # assisted decoding only supports batch size 1, so drafts run rows back to back
+            return super().generate_batch(requests)
+
+        import torch
+        from transformers import StoppingCriteriaList
+
+        budgets = [r.max_tokens for r in requests]
+        inputs = self.tokenizer(
+            [r.input_text for r in requests], return_tensors="pt", padding=True
+        ).to(self.model.device)
+        prompt_len = inputs["input_ids"].shape[1]
+
+        # Mixed budgets: each row stops at its own max_tokens, the batch at the longest
+        criteria = [RowBudgetStop(prompt_len, budgets)]
+        tokens = [r.cancel for r in requests]
+        if any(t is not None for t in tokens):
+            # Cancelled rows finish early; the others keep decoding
+            criteria.append(CancelStop(tokens))
+        streamer = None
+        if any(r.sink is not None for r in requests):
+            streamer = RowStreamer(self.tokenizer, prompt_len, requests)
+            criteria.append(streamer)
+        extra = {}
+        options = requests[0].options
+        text_stop = None
+        if options.get("stop"):
+            text_stop = TokenTextStop(TextStopChecker(options["stop"]), self.tokenizer, prompt_len)
+            criteria.append(text_stop)
+        if options.get("grammar"):
+            from transformers import LogitsProcessorList
+            from constrained import build_logits_processor
+            # The grammar state is tracked per row, so every row gets its own N lines
+            extra["logits_processor"] = LogitsProcessorList([
+                build_logits_processor(options["grammar"], self.tokenizer, self._eos_token_ids())
+            ])
+
+        with self.lock, torch.no_grad():
+            outputs = self.model.generate(
+                **inputs, max_new_tokens=max(budgets),
+                stopping_criteria=StoppingCriteriaList(criteria),
+                **extra, **self._generation_kwargs(),
+            )
+        if text_stop is not None:
+            for row, (spec, new_tokens) in text_stop.fired_rows.items():
+                record_early_stop(spec, budgets[row], new_tokens)
+        results = [
+            GenerationCancelled(tokens[i].reason) if tokens[i] is not None and tokens[i].reason
+            else self.tokenizer.decode(outputs[i][prompt_len:prompt_len + budgets[i]], skip_special_tokens=True)
+            for i in range(len(requests))
+        ]
+        if streamer is not None:
+            # Send anything the criterion held back, e.g. a character its last token left incomplete
+            for i, text in enumerate(results):
+                if requests[i].sink is not None and isinstance(text, str):
+                    streamer.emit(i, text)
+        return results
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# ONNX Runtime — exported decoder-with-past graph
+# ─────────────────────────────────────────────────────────────────────────────
+
+class OnnxRuntimeBackend(TransformersBackend):
+    """ORTModelForCausalLM is generate()-compatible, so only loading differs from transformers."""
+
+    name = "onnx"
+    # ORT sessions take legacy past tuples, not croppable DynamicCache objects
+    supports_prefix_cache = False
+
+    def load(self, model_path: str, draft_model_path: str = None, progress=None):
+        import onnxruntime as ort
+        from optimum.onnxruntime import ORTModelForCausalLM
+        from transformers import AutoTokenizer
+
+        onnx_dir, file_name = find_onnx(model_path)
+        if not onnx_dir:
+            raise FileNotFoundError(f"No exported ONNX decoder in {model_path}. Run setup_model.py --onnx first.")
+
+        _report(progress, 5, "Loading tokenizer")
+        tokenizer_dir = onnx_dir if os.path.exists(os.path.join(onnx_dir, "tokenizer_config.json")) else model_path
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir, trust_remote_code=True)
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        _report(progress, 15, "Creating ONNX Runtime session")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = get_topology().intra_op
+        options.inter_op_num_threads = get_topology().inter_op
+        self.model = ORTModelForCausalLM.from_pretrained(
+            onnx_dir,
+            file_name=file_name,
+            use_cache=True,
+            provider="CPUExecutionProvider",
+            session_options=options,
+        )
+        self.device = "cpu (onnxruntime)"
+        self.variant = file_name
+        self.prefix_cache.clear()
+        self.draft_model = None
+        self.draft_tokenizer = None
+        if draft_model_path:
+            print("[TruthShield] Draft models are not used by the ONNX backend; prompt lookup is available per call.")
+        print(f"[TruthShield] ONNX Runtime graph: {os.path.join(onnx_dir, file_name)}")
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# llama.cpp — GGUF weights via llama-cpp-python
+# ─────────────────────────────────────────────────────────────────────────────
+
+class LlamaCppBackend(InferenceBackend):
+    """GGUF runtime. llama.cpp reuses the KV of the longest matching prompt prefix itself."""
+
+    name = "llama_cpp"
+
+    def __init__(self, n_ctx: int = 4096, cache_bytes: int = 512 << 20):
+        super().__init__()
+        self.n_ctx = n_ctx
+        self.cache_bytes = cache_bytes
+        self.llm = None
+        self._formatter = None
+        self._lookup_draft = None
+
+    def load(self, model_path: str, draft_model_path: str = None, progress=None):
+        from llama_cpp import Llama, LlamaRAMCache
+        from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+        gguf = find_gguf(model_path)
+        if not gguf:
+            raise FileNotFoundError(f"No .gguf file found in {model_path}. Run setup_model.py --gguf first.")
+
+        self.variant = os.path.basename(gguf)
+        _report(progress, 15, "Mapping GGUF weights")
+        self.llm = Llama(
+            model_path=gguf,
+            n_ctx=self.n_ctx,
+            n_threads=get_topology().intra_op,
+            verbose=False,
+        )
+        # Keeps KV states of several recent prompts (e.g. both system preambles)
+        self.llm.set_cache(LlamaRAMCache(capacity_bytes=self.cache_bytes))
+        self._lookup_draft = LlamaPromptLookupDecoding(
+            num_pred_tokens=PROMPT_LOOKUP_TOKENS, max_ngram_size=PROMPT_LOOKUP_NGRAM
+        )
+
+        meta = self.llm.metadata
+        template = meta.get("tokenizer.chat_template")
+        if template:
+            vocab = self.llm._model.token_get_text
+            self._formatter = Jinja2ChatFormatter(
+                template=template,
+                bos_token=vocab(self.llm.token_bos()),
+                eos_token=vocab(self.llm.token_eos()),
+            )
+        if draft_model_path:
+            print("[TruthShield] Draft models are not used by the llama.cpp backend; prompt lookup is available per call.")
+
+    def render_prompt(self, prompt_text, system_msg):
+        messages = [
+            {"role": "system", "content": system_msg},
+            {"role": "user", "content": prompt_text},
+        ]
+        if self._formatter is not None:
+            return self._formatter(messages=messages).prompt
+        # Gemma turn format (system folded into the first user turn)
+        return (
+            f"<start_of_turn>user\n{system_msg}\n\n{prompt_text}<end_of_turn>\n"
+            f"<start_of_turn>model\n"
+        )
+
+    def _tokenize(self, text):
+        # Rendered templates already carry <bos>; special=True keeps turn markers as single tokens
+        add_bos = not text.startswith("<bos>")
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=add_bos, special=True)
+
+    def count_tokens(self, text):
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+    def _completion(self, input_text, max_tokens, decoding, stream, grammar=None, stop=None, cancel=None):
+        """create_completion call; returns (result, fired) where fired[0] names the criterion that stopped it."""
+        extra = {}
+        prompt = self._tokenize(input_text)
+        fired = [None]
+        criteria = []
+        if stop:
+            checker = TextStopChecker(stop)
+            prompt_len = len(prompt)
+
+            def _text_stop(input_ids, logits):
+                if fired[0] is None and b"\n" in self.llm.detokenize([int(input_ids[-1])]):
+                    text = self.llm.detokenize(list(input_ids[prompt_len:])).decode("utf-8", errors="ignore")
+                    fired[0] = checker(text)
+                return fired[0] is not None
+
+            criteria.append(_text_stop)
+        if cancel is not None:
+            criteria.append(lambda input_ids, logits: cancel.reason is not None)
+        if criteria:
+            from llama_cpp import StoppingCriteriaList
+            extra["stopping_criteria"] = StoppingCriteriaList(criteria)
+        if grammar:
+            from llama_cpp import LlamaGrammar
+            from constrained import mcq_gbnf, parse_grammar_spec
+            extra["grammar"] = LlamaGrammar.from_string(mcq_gbnf(parse_grammar_spec(grammar)[1]), verbose=False)
+            decoding = "greedy"
+        self.llm.draft_model = self._lookup_draft if decoding == "prompt_lookup" else None
+        result = self.llm.create_completion(
+            prompt,
+            max_tokens=max_tokens,
+            temperature=0.0,
+            top_k=1,
+            repeat_penalty=REPETITION_PENALTY,
+            stream=stream,
+            **extra,
+        )
+        return result, fired
+
+    def generate(self, input_text, max_tokens, prefix_text=None, decoding="auto", grammar=None, stop=None,
+                 cancel=None):
+        if cancel is not None:
+            cancel.check()
+        with self.lock:
+            out, fired = self._completion(
+                input_text, max_tokens, decoding, stream=False, grammar=grammar, stop=stop, cancel=cancel
+            )
+        if cancel is not None:
+            cancel.check()
+        new_tokens = out.get("usage", {}).get("completion_tokens", 0)
+        METRICS.incr("llama_cpp_tokens", new_tokens)
+        if fired[0]:
+            record_early_stop(fired[0], max_tokens, new_tokens)
+        return out["choices"][0]["text"]
+
+    def stream(self, input_text, max_tokens, prefix_text=None, decoding="auto", grammar=None, stop=None,
+               cancel=None):
+        """Decodes on a pinned worker so ggml's compute threads stay on the inference cores."""
+        pieces = queue.Queue()
+        cancel = cancel or CancelToken()
+        context = current_priority()
+
+        def _decode():
+            pin_inference_thread()
+            try:
+                with priority_scope(context), self.lock:
+                    chunks, fired = self._completion(
+                        input_text, max_tokens, decoding, stream=True, grammar=grammar, stop=stop, cancel=cancel
+                    )
+                    new_tokens = 0
+                    for chunk in chunks:
+                        new_tokens += 1
+                        pieces.put(chunk["choices"][0]["text"])
+                cancel.check()
+                if fired[0]:
+                    record_early_stop(fired[0], max_tokens, new_tokens)
+            except Exception as e:
+                pieces.put(e)
+            finally:
+                pieces.put(None)
+
+        worker = threading.Thread(target=_decode, name="truthshield-stream", daemon=True)
+        worker.start()
+        try:
+            while True:
+                piece = pieces.get()
+                if piece is None:
+                    return
+                if isinstance(piece, Exception):
+                    raise piece
+                if piece:
+                    yield piece
+        finally:
+            # Consumer went away mid-stream: stop decoding at the next token
+            if worker.is_alive():
+                cancel.cancel()
@@ -0,0 +1,303 @@
+"""
+TruthShield — Micro-Batching Scheduler for MedGemma Inference
+
+Concurrent Gradio events (clinician analyses, patient MCQ generation) are
+gathered into padded batches so a single model.generate call serves several
+callers instead of serializing them or fighting over the same torch threads.
+
+Streamed requests (analyses, sequential MCQs) go through the same queue:
+each row carries a sink that the backend feeds with its decoded pieces, so
+concurrent streams share a padded batch just like blocking calls.
+
+Knobs:
+    max_batch_size  — upper bound on rows per generate call (1 disables batching)
+    max_wait_ms     — how long the worker holds the first request open for
+                      companions; higher trades latency for throughput
+
+The queue is ordered by priority class with aging (see priority.py), not
+arrival: the worker always starts from the most urgent waiting request.
+"""
+
+import itertools
+import queue
+import threading
+import time
+
+from cancellation import CancelToken, GenerationCancelled
+from cpu_topology import pin_inference_thread
+from metrics import METRICS
+from priority import DEFAULT_CLASS, PriorityContext, priority_scope, sort_key
+
+
+# Options that apply row-wise, so every row of a padded batch can carry them
+BATCHABLE_OPTIONS = ("grammar", "stop")
+
+
+class InferenceRequest:
+    """A single pending generation, resolved by the scheduler worker."""
+
+    def __init__(self, input_text: str, max_tokens: int, options: dict = None, prefix_text: str = None,
+                 cancel=None, priority: str = None, sink=None):
+        self.input_text = input_text
+        self.max_tokens = max_tokens
+        # Shared system/chat-template preamble, reusable from the prefix KV cache
+        self.prefix_text = prefix_text
+        self.options = options or {}
+        # CancelToken (see cancellation.py); per row, so it never affects the batch key
+        self.cancel = cancel
+        # Priority class (see priority.py); like cancel, per row and outside the batch key
+        self.priority = priority or DEFAULT_CLASS
+        # Streamed requests: called with each decoded text piece of this row, from the decode thread
+        self.sink = sink
+        self.enqueued_at = time.time()
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def batch_key(self):
+        """Requests with equal keys can share a padded batch; None means run solo."""
+        if any(k not in BATCHABLE_OPTIONS for k in self.options):
+            # Per-call decoding modes (speculation) only work at batch size 1
+            return None
+        return tuple(sorted((k, repr(v)) for k, v in self.options.items()))
+
+    @property
+    def sort_key(self) -> float:
+        return sort_key(self.priority, self.enqueued_at)
+
+    @property
+    def batchable(self) -> bool:
+        return self.batch_key is not None
+
+    def resolve(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel is not None and self.cancel.reason is not None
+
+    def wait(self):
+        # A fired token releases the caller at once; the worker skips or stops the row on its own
+        while not self._done.wait(0.05 if self.cancel is not None else None):
+            if self.cancelled:
+                raise GenerationCancelled(self.cancel.reason)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class RowBudgetStop:
+    """Stopping criterion that finishes each batch row at its own max_tokens budget.
+
+    Plain callable so this module stays importable without transformers;
+    generate() only needs criteria that return a per-row bool tensor.
+    """
+
+    def __init__(self, prompt_len: int, budgets):
+        self.prompt_len = prompt_len
+        self.budgets = list(budgets)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        generated = input_ids.shape[1] - self.prompt_len
+        return torch.tensor([generated >= b for b in self.budgets], dtype=torch.bool, device=input_ids.device)
+
+
+class RowStreamer:
+    """Stopping criterion that never stops a row: it feeds each streamed row's new text to its sink.
+
+    transformers streamers only handle batch size 1, while criteria see every
+    row after every step. Like RowBudgetStop, a plain callable.
+    """
+
+    def __init__(self, tokenizer, prompt_len: int, requests):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.requests = list(requests)
+        self._sent = [""] * len(self.requests)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        for i, r in enumerate(self.requests):
+            if r.sink is not None and not r.cancelled:
+                row = input_ids[i][self.prompt_len:self.prompt_len + r.max_tokens]
+                self.emit(i, self.tokenizer.decode(row, skip_special_tokens=True))
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    def emit(self, row: int, text: str):
+        """Sends the part of text not sent yet; an incomplete trailing character waits for its next token."""
+        text = text.rstrip("\ufffd")
+        sent = self._sent[row]
+        if len(text) > len(sent) and text.startswith(sent):
+            self.requests[row].sink(text[len(sent):])
+            self._sent[row] = text
+
+
+class MicroBatchScheduler:
+    """Single worker thread that owns model.generate and batches concurrent callers."""
+
+    def __init__(self, generate_batch_fn, max_batch_size: int = 4, max_wait_ms: float = 25.0):
+        self._generate_batch = generate_batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        # (sort key, arrival seq, request or group); seq keeps equal keys first-come first-served
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def configure(self, max_batch_size: int = None, max_wait_ms: float = None):
+        """Adjusts the latency/throughput knobs; takes effect on the next batch."""
+        if max_batch_size is not None:
+            self.max_batch_size = max(1, int(max_batch_size))
+        if max_wait_ms is not None:
+            self.max_wait_ms = max(0.0, float(max_wait_ms))
+
+    def submit(self, input_text: str, max_tokens: int, prefix_text: str = None, cancel=None, priority=None,
+               **options) -> str:
+        """Enqueues a request and blocks the calling Gradio worker until its slice is decoded.
+
+        cancel: optional CancelToken; when it fires, GenerationCancelled is raised here.
+        priority: class from priority.classify(); decides the place in the queue.
+        """
+        request = InferenceRequest(
+            input_text, max_tokens, options, prefix_text=prefix_text, cancel=cancel, priority=priority
+        )
+        self._ensure_worker()
+        self._put(request)
+        return request.wait()
+
+    def stream(self, input_text: str, max_tokens: int, prefix_text: str = None, cancel=None, priority=None,
+               **options):
+        """Like submit, but yields the row's text pieces as its batch decodes them.
+
+        Closing the generator early cancels the row; the rest of its batch keeps decoding.
+        """
+        pieces = queue.Queue()
+        # Own token, so a consumer that stops reading cancels this row only
+        cancel = cancel.child() if cancel is not None else CancelToken()
+        request = InferenceRequest(
+            input_text, max_tokens, options, prefix_text=prefix_text, cancel=cancel, priority=priority,
+            sink=pieces.put,
+        )
+        self._ensure_worker()
+        self._put(request)
+        try:
+            while True:
+                try:
+                    yield pieces.get(timeout=0.05)
+                    continue
+                except queue.Empty:
+                    pass
+                if request.done:
+                    # Pieces are all put before the row is resolved
+                    while not pieces.empty():
+                        yield pieces.get_nowait()
+                    request.wait()
+                    return
+                if request.cancelled:
+                    raise GenerationCancelled(cancel.reason)
+        finally:
+            if not request.done:
+                cancel.cancel()
+
+    def submit_group(self, items, cancel=None, priority=None):
+        """Enqueues (input_text, max_tokens, prefix_text, options) tuples as one padded batch.
+
+        The group bypasses max_batch_size and max_wait_ms: its rows are known to
+        belong together (e.g. one MCQ prompt per question) and decode in parallel.
+        cancel and priority apply to every row.
+        """
+        group = [
+            InferenceRequest(text, n, options, prefix_text=prefix, cancel=cancel, priority=priority)
+            for text, n, prefix, options in items
+        ]
+        self._ensure_worker()
+        self._put(group)
+        return [r.wait() for r in group]
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _put(self, item):
+        first = item[0] if isinstance(item, list) else item
+        self._queue.put((first.sort_key, next(self._seq), item))
+
+    def _get(self, timeout=None):
+        return self._queue.get(timeout=timeout)[2]
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._worker_loop, name="truthshield-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect_batch(self, first: InferenceRequest):
+        """Holds the first request open for up to max_wait_ms to pick up companions."""
+        batch = [first]
+        if not first.batchable or self.max_batch_size == 1:
+            return batch, []
+
+        deferred = []
+        deadline = time.time() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                nxt = self._get(timeout=remaining)
+            except queue.Empty:
+                break
+            if isinstance(nxt, list) or nxt.batch_key != first.batch_key:
+                deferred.append(nxt)
+            else:
+                batch.append(nxt)
+        return batch, deferred
+
+    def _run(self, batch):
+        now = time.time()
+        live = []
+        for r in batch:
+            if r.cancelled:
+                # Cancelled or past its deadline while queued: never reaches the model
+                METRICS.incr("requests_dropped_before_decode")
+                r.resolve(error=GenerationCancelled(r.cancel.reason))
+            else:
+                METRICS.observe("queue_wait_s", now - r.enqueued_at)
+                live.append(r)
+        if not live:
+            return
+        METRICS.observe("batch_size", len(live))
+        try:
+            # The model lock is granted by the most urgent row; each row's wait is recorded once it is held
+            with priority_scope(PriorityContext((r.priority, r.enqueued_at) for r in live)):
+                results = self._generate_batch(live)
+            for r, text in zip(live, results):
+                # Backends return an exception in place of a row that was cancelled mid-decode
+                if isinstance(text, Exception):
+                    r.resolve(error=text)
+                else:
+                    r.resolve(result=text)
+        except Exception as e:
+            for r in live:
+                r.resolve(error=e)
+
+    def _worker_loop(self):
+        pin_inference_thread()
+        while True:
+            first = self._get()
+            if isinstance(first, list):
+                self._run(first)
+                continue
+            batch, deferred = self._collect_batch(first)
+            # Requests that could not join this batch keep their place in the queue
+            for r in deferred:
+                self._put(r)
+            self._run(batch)
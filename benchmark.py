@@ -0,0 +1,262 @@
+"""
+TruthShield — Inference Benchmarks
+
+Measures generation speed of the MedGemma engine on this machine using the
+built-in demo SCENARIOS as a corpus.
+
+Usage:
+    python benchmark.py decoding --model-path ./models/medgemma-4b-awq
+    python benchmark.py decoding --model-path ./models/medgemma-4b-awq --max-tokens 200 --repeats 2
+    python benchmark.py backends --model-path ./models/medgemma-4b-awq --backends transformers onnx
+    python benchmark.py mcq --model-path ./models/medgemma-4b-awq --count 10
+    python benchmark.py sessions --sessions 32 --model-path ./models/medgemma-4b-awq
+"""
+
+import argparse
+import sys
+import time
+
+from scenarios import SCENARIOS
+
+
+def _load_engine(model_path: str, backend: str = None):
+    from main import AI_ENGINE
+    success, msg = AI_ENGINE.load(model_path, backend=backend)
+    if not success:
+        print(f"[ERROR] Could not load model: {msg}")
+        sys.exit(1)
+    return AI_ENGINE
+
+
+def _timed_generate(engine, input_text: str, max_tokens: int, decoding: str):
+    start = time.time()
+    text = engine.backend.generate(input_text, max_tokens, decoding=decoding)
+    elapsed = time.time() - start
+    tokens = engine.count_tokens(text)
+    return text, tokens, elapsed
+
+
+def bench_decoding(args):
+    """Plain greedy vs. prompt-lookup decoding on the discrepancy-analysis prompts."""
+    from prompts import build_analysis_inference
+
+    engine = _load_engine(args.model_path, args.backend)
+    modes = ["greedy", "prompt_lookup"]
+    totals = {m: [0, 0.0] for m in modes}
+
+    print(f"\n{'Scenario':<22} {'greedy tok/s':>13} {'lookup tok/s':>13} {'speedup':>8}  same")
+    print("-" * 66)
+    for scenario_id, s in SCENARIOS.items():
+        prompt, system_msg = build_analysis_inference(s["survey"], s["notes"], [])
+        input_text = engine.build_input_text(prompt, system_msg)
+
+        rates, texts = {}, {}
+        for mode in modes:
+            best = None
+            for _ in range(args.repeats):
+                text, tokens, elapsed = _timed_generate(engine, input_text, args.max_tokens, mode)
+                if best is None or elapsed < best[2]:
+                    best = (text, tokens, elapsed)
+            texts[mode] = best[0]
+            rates[mode] = best[1] / best[2] if best[2] > 0 else 0.0
+            totals[mode][0] += best[1]
+            totals[mode][1] += best[2]
+
+        speedup = rates["prompt_lookup"] / rates["greedy"] if rates["greedy"] else 0.0
+        same = "yes" if texts["greedy"] == texts["prompt_lookup"] else "NO"
+        print(f"{scenario_id:<22} {rates['greedy']:>13.2f} {rates['prompt_lookup']:>13.2f} {speedup:>7.2f}x  {same}")
+
+    overall = {m: (t / e if e else 0.0) for m, (t, e) in totals.items()}
+    print("-" * 66)
+    print(f"{'OVERALL':<22} {overall['greedy']:>13.2f} {overall['prompt_lookup']:>13.2f} "
+          f"{(overall['prompt_lookup'] / overall['greedy'] if overall['greedy'] else 0.0):>7.2f}x")
+    print(f"\nPrompt-lookup stats: {engine.speculative_stats()['prompt_lookup']}")
+
+
+def bench_backends(args):
+    """Prefill and per-token decode latency of each runtime on the same prompts."""
+    import gc
+
+    from backends import create_backend
+    from prompts import build_analysis_inference
+
+    corpus = list(SCENARIOS.values())[:args.scenarios]
+    print(f"\n{'Backend':<14} {'prefill ms':>11} {'decode ms/tok':>14} {'tok/s':>8}")
+    print("-" * 51)
+    for name in args.backends:
+        backend = create_backend(name)
+        try:
+            backend.load(args.model_path)
+        except Exception as e:
+            print(f"{name:<14} load failed: {e}")
+            continue
+
+        prefill, decode = [], []
+        for s in corpus:
+            prompt, system_msg = build_analysis_inference(s["survey"], s["notes"], [])
+            input_text = backend.render_prompt(prompt, system_msg)
+            backend.generate(input_text, 1, decoding="greedy")  # Warm the session for this shape
+
+            start = time.time()
+            backend.generate(input_text, 1, decoding="greedy")
+            t_first = time.time() - start
+
+            start = time.time()
+            text = backend.generate(input_text, args.max_tokens, decoding="greedy")
+            t_full = time.time() - start
+            tokens = backend.count_tokens(text)
+
+            prefill.append(t_first)
+            if tokens > 1:
+                decode.append(max(0.0, t_full - t_first) / (tokens - 1))
+
+        p_ms = 1000 * sum(prefill) / len(prefill)
+        d_ms = 1000 * sum(decode) / len(decode) if decode else 0.0
+        print(f"{name:<14} {p_ms:>11.1f} {d_ms:>14.1f} {(1000 / d_ms if d_ms else 0.0):>8.2f}")
+
+        del backend
+        gc.collect()
+
+
+def bench_mcq(args):
+    """Personalized MCQs: one sequential generation vs. one batched prompt per question."""
+    import main as app
+    from inference_cache import InferenceResultCache
+
+    engine = _load_engine(args.model_path, args.backend)
+    # Every run must decode; a cached sequential answer would hide the comparison
+    engine.result_cache = InferenceResultCache(0)
+    bank = {q["question"] for q in app.PATIENT_MCQS}
+    modes = ["sequential", "parallel"]
+    totals = {m: [0.0, 0] for m in modes}
+
+    print(f"\n{'Scenario':<22} {'sequential s':>13} {'parallel s':>11} {'speedup':>8}  AI questions (seq/par)")
+    print("-" * 82)
+    for scenario_id, s in SCENARIOS.items():
+        elapsed, generated = {}, {}
+        for mode in modes:
+            start = time.time()
+            mcqs = app.generate_ai_mcqs(s["survey"], False, count=args.count, mode=mode)
+            elapsed[mode] = time.time() - start
+            # Bank fill-ins are the fallback, not model output
+            generated[mode] = sum(1 for q, _ in mcqs if q not in bank)
+            totals[mode][0] += elapsed[mode]
+            totals[mode][1] += generated[mode]
+
+        speedup = elapsed["sequential"] / elapsed["parallel"] if elapsed["parallel"] else 0.0
+        print(f"{scenario_id:<22} {elapsed['sequential']:>13.2f} {elapsed['parallel']:>11.2f} {speedup:>7.2f}x  "
+              f"{generated['sequential']}/{generated['parallel']}")
+
+    print("-" * 82)
+    seq, par = totals["sequential"], totals["parallel"]
+    print(f"{'OVERALL':<22} {seq[0]:>13.2f} {par[0]:>11.2f} {(seq[0] / par[0] if par[0] else 0.0):>7.2f}x  "
+          f"{seq[1]}/{par[1]}")
+
+
+def bench_sessions(args):
+    """Many simultaneous portal sessions: every survey must list its own session's questions."""
+    import random
+    import threading
+
+    import gradio as gr
+
+    import main as app
+    from session_store import SESSIONS
+
+    if args.model_path:
+        _load_engine(args.model_path, args.backend)
+    handlers = app.portal_handlers(app.create_app())
+    submit_story = handlers["_handle_story_submission"]
+    submit_survey = handlers["_submit_patient_data"]
+    stories = [s["survey"] for s in SCENARIOS.values()]
+
+    latencies, mismatches, errors = [], [], []
+    lock = threading.Lock()
+    start_together = threading.Barrier(args.sessions)
+
+    def _session(index):
+        request = gr.Request(session_hash=f"bench-{index}")
+        story = f"{stories[index % len(stories)]} (patient {index})"
+        start_together.wait()
+        try:
+            for _ in range(args.rounds):
+                start = time.time()
+                labels = {}
+                for outputs in submit_story(story, request):
+                    for slot, update in enumerate(outputs[2:12]):
+                        if isinstance(update, dict) and update.get("choices"):
+                            labels[slot] = update["label"]
+                elapsed = time.time() - start
+                # Other sessions keep submitting while this patient answers
+                time.sleep(random.uniform(0, args.think_ms / 1000.0))
+                answers = [None] * 10
+                _, combined = submit_survey(request, story, *answers)
+                listed = [line.split(". ", 1)[1].rsplit(" → ", 1)[0]
+                          for line in combined.split("--- STRUCTURED CLINICAL SURVEY ---\n", 1)[1].splitlines() if line]
+                expected = [labels[i] for i in sorted(labels)]
+                with lock:
+                    latencies.append(elapsed)
+                    if listed[:len(expected)] != expected:
+                        mismatches.append(index)
+        except Exception as e:
+            with lock:
+                errors.append(f"session {index}: {type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=_session, args=(i,)) for i in range(args.sessions)]
+    wall = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.time() - wall
+
+    latencies.sort()
+    pct = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+    mode = "simulation" if app.AI_ENGINE.is_simulation else app.AI_ENGINE.model_name
+    print(f"\n{args.sessions} sessions x {args.rounds} rounds ({mode}) in {wall:.2f}s")
+    print(f"Story submission latency: p50 {pct(0.5):.2f}s  p95 {pct(0.95):.2f}s  max {pct(1.0):.2f}s")
+    print(f"Sessions held: {len(SESSIONS)}  Mismatched surveys: {len(mismatches)}  Errors: {len(errors)}")
+    for line in errors[:10]:
+        print(f"  {line}")
+    if mismatches or errors:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TruthShield inference benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("decoding", help="Plain greedy vs. prompt-lookup decoding on SCENARIOS")
+    p.add_argument("--model-path", type=str, required=True, help="Path to the MedGemma weights")
+    p.add_argument("--backend", type=str, default="auto", help="Inference runtime (transformers, llama_cpp, auto)")
+    p.add_argument("--max-tokens", type=int, default=200, help="Tokens per generation (default: 200, as in analysis)")
+    p.add_argument("--repeats", type=int, default=1, help="Runs per scenario and mode; the fastest is kept")
+    p.set_defaults(func=bench_decoding)
+
+    p = sub.add_parser("backends", help="Prefill / decode latency per inference runtime")
+    p.add_argument("--model-path", type=str, required=True, help="Weights directory (with onnx/ or *.gguf as needed)")
+    p.add_argument("--backends", nargs="+", default=["transformers", "onnx"], help="Runtimes to compare (default: transformers onnx)")
+    p.add_argument("--max-tokens", type=int, default=64, help="Decode length used for the per-token figure (default: 64)")
+    p.add_argument("--scenarios", type=int, default=3, help="Number of SCENARIOS prompts to average over (default: 3)")
+    p.set_defaults(func=bench_backends)
+
+    p = sub.add_parser("mcq", help="Sequential vs. parallel (batched) personalized MCQ generation")
+    p.add_argument("--model-path", type=str, required=True, help="Path to the MedGemma weights")
+    p.add_argument("--backend", type=str, default="auto", help="Inference runtime (transformers, llama_cpp, auto)")
+    p.add_argument("--count", type=int, default=10, help="Questions per story (default: 10)")
+    p.set_defaults(func=bench_mcq)
+
+    p = sub.add_parser("sessions", help="Concurrent patient-portal sessions; fails if any survey mixes sessions")
+    p.add_argument("--model-path", type=str, default=None, help="Weights to load (default: simulation, bank questions only)")
+    p.add_argument("--backend", type=str, default="auto", help="Inference runtime (transformers, llama_cpp, auto)")
+    p.add_argument("--sessions", type=int, default=32, help="Simultaneous sessions (default: 32)")
+    p.add_argument("--rounds", type=int, default=2, help="Story + survey submissions per session (default: 2)")
+    p.add_argument("--think-ms", type=float, default=200.0, help="Max random pause between story and survey (default: 200ms)")
+    p.set_defaults(func=bench_sessions)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
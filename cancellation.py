@@ -0,0 +1,112 @@
+"""
+TruthShield — Request Cancellation & Deadlines
+
+A CancelToken travels with one generation from the UI handler to the
+runtime. It fires when someone calls cancel() (Clear clicked, the browser
+went away, a stream consumer stopped reading) or when its deadline passes
+(--inference-timeout). Runtimes check it at every decode step:
+
+    transformers / ONNX — CancelStop, a per-row StoppingCriteria-style callable
+    llama.cpp           — the same check inside its stopping_criteria hook
+    scheduler           — requests whose token fired are dropped before decoding
+
+The caller then gets GenerationCancelled instead of a (partial) result, and
+the cores go back to whoever is still waiting.
+"""
+
+import threading
+import time
+
+from metrics import METRICS
+
+CANCELLED = "cancelled"
+TIMED_OUT = "timeout"
+
+
+class GenerationCancelled(RuntimeError):
+    """Raised in place of a result when the request's CancelToken fired."""
+
+    def __init__(self, reason: str = CANCELLED):
+        self.reason = reason
+        super().__init__("Generation timed out" if reason == TIMED_OUT else "Generation cancelled")
+
+
+class CancelToken:
+    """Cancel flag plus optional deadline, shared between the caller and the decode loop."""
+
+    def __init__(self, timeout_s: float = None, parent=None):
+        self._event = threading.Event()
+        self._reason = None
+        self.deadline = time.time() + timeout_s if timeout_s else None
+        # Fires with the parent's reason; firing this token leaves the parent untouched
+        self.parent = parent
+
+    def child(self, timeout_s: float = None):
+        """A token that fires when this one does or after timeout_s (falsy: no deadline of its own).
+
+        Lets the engine bound one call without changing the caller's token, which
+        may outlive the call (e.g. the dashboard's Clear button still holds it).
+        """
+        return CancelToken(timeout_s, parent=self)
+
+    def cancel(self, reason: str = CANCELLED):
+        if self._reason is None:
+            self._reason = reason
+            METRICS.incr("requests_" + ("timed_out" if reason == TIMED_OUT else "cancelled"))
+        self._event.set()
+
+    @property
+    def reason(self):
+        """None while live, else CANCELLED or TIMED_OUT."""
+        if self._reason is None and self.parent is not None and self.parent.reason is not None:
+            # Already counted in the metrics by the parent
+            self._reason = self.parent.reason
+            self._event.set()
+        if self._reason is None and self.deadline is not None and time.time() >= self.deadline:
+            self.cancel(TIMED_OUT)
+        return self._reason
+
+    def remaining(self):
+        """Seconds until the deadline (the parent's, if sooner), or None without one."""
+        remaining = None if self.deadline is None else max(0.0, self.deadline - time.time())
+        inherited = self.parent.remaining() if self.parent is not None else None
+        if remaining is None or (inherited is not None and inherited < remaining):
+            return inherited
+        return remaining
+
+    def wait(self, timeout: float = None) -> bool:
+        """Blocks until the token fires or timeout elapses (the deadline counts as firing)."""
+        if self.parent is not None:
+            # The parent's cancel() does not set this token's event: poll
+            end = None if timeout is None else time.time() + timeout
+            while self.reason is None:
+                step = 0.05 if end is None else min(0.05, end - time.time())
+                if step <= 0:
+                    break
+                self._event.wait(step)
+            return self.reason is not None
+        remaining = self.remaining()
+        if remaining is not None and (timeout is None or remaining < timeout):
+            self._event.wait(remaining)
+        else:
+            self._event.wait(timeout)
+        return self.reason is not None
+
+    def check(self):
+        """Raises GenerationCancelled if the token fired."""
+        reason = self.reason
+        if reason is not None:
+            raise GenerationCancelled(reason)
+
+
+class CancelStop:
+    """transformers StoppingCriteria: finishes each batch row whose token fired (None = never)."""
+
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        return torch.tensor(
+            [t is not None and t.reason is not None for t in self.tokens], dtype=torch.bool, device=input_ids.device
+        )
@@ -0,0 +1,268 @@
+"""
+TruthShield — Grammar-Constrained MCQ Generation
+
+Personalized MCQs are decoded under a grammar instead of being parsed after
+the fact. Every line the model can emit has the shape
+
+    N. Question text | Option one, Option two, Option three
+
+numbered 1..count, and generation ends (EOS) right after line `count`.
+
+Backends receive the constraint as a plain string option, grammar="mcq:<count>",
+so it survives the scheduler, the replica pipe, the HTTP daemon and the
+result-cache key unchanged.
+
+    transformers / ONNX  — MCQGrammarProcessor, a logits processor driven by a
+                           character-level state machine. Token classes
+                           (plain text, text with comma, pipe, newline, number
+                           prefixes) are precomputed once per tokenizer as
+                           boolean vocab masks, so each step is one mask pick.
+    llama.cpp            — the equivalent GBNF grammar (mcq_gbnf).
+"""
+
+import re
+
+# Bounds keep every line finite so `count` lines always fit the token budget
+QUESTION_MAX_CHARS = 160
+OPTIONS_MAX_CHARS = 120
+MIN_OPTIONS = 2
+# Characters per token assumed when budgeting a maximal line (short words and punctuation tokenize densely)
+BUDGET_CHARS_PER_TOKEN = 2
+
+_TABLE_CACHE = {}
+
+
+def parse_grammar_spec(spec: str):
+    """'mcq:10' → ('mcq', 10)"""
+    kind, _, arg = spec.partition(":")
+    if kind != "mcq" or not arg.isdigit() or int(arg) < 1:
+        raise ValueError(f"Unknown grammar spec: {spec!r}")
+    return kind, int(arg)
+
+
+def mcq_grammar(count: int) -> str:
+    return f"mcq:{count}"
+
+
+def mcq_max_tokens(count: int) -> int:
+    """Token budget that fits `count` lines at the grammar's length bounds, plus EOS."""
+    line_chars = len(f"{count}. ") + QUESTION_MAX_CHARS + len("|") + OPTIONS_MAX_CHARS + len("\n")
+    return count * -(-line_chars // BUDGET_CHARS_PER_TOKEN) + 1
+
+
+def _parse_mcq_line(line: str):
+    """'3. Question | A, B, C' → ('Question', ['A', 'B', 'C']), or None."""
+    question, sep, options = line.partition("|")
+    if not sep:
+        return None
+    question = re.sub(r"^\d+\.\s*", "", question).strip()
+    opts = [o.strip() for o in options.split(",") if o.strip()]
+    if question and len(opts) >= MIN_OPTIONS:
+        return question, opts
+    return None
+
+
+def parse_mcq_lines(text: str):
+    """Splits grammar-shaped output into (question, options); no repair is needed."""
+    return [mcq for mcq in map(_parse_mcq_line, text.strip().split("\n")) if mcq]
+
+
+class MCQStreamParser:
+    """Incremental parse_mcq_lines over streamed text.
+
+    feed() returns the MCQs whose line was completed by the new piece; the
+    unterminated tail is kept until its newline arrives (or close()).
+    """
+
+    def __init__(self):
+        self._partial = ""
+
+    def feed(self, piece: str):
+        *lines, self._partial = (self._partial + piece).split("\n")
+        return [mcq for mcq in map(_parse_mcq_line, lines) if mcq]
+
+    def close(self):
+        """Parses the unterminated last line (unconstrained output may end without a newline)."""
+        tail, self._partial = self._partial, ""
+        mcq = _parse_mcq_line(tail)
+        return [mcq] if mcq else []
+
+
+def mcq_gbnf(count: int) -> str:
+    """GBNF grammar for llama.cpp producing exactly `count` MCQ lines."""
+    lines = " ".join(f'"{i}. " question " | " options "\\n"' for i in range(1, count + 1))
+    return (
+        f"root ::= {lines}\n"
+        'question ::= [^|\\n] [^|\\n]*\n'
+        'options ::= option ("," " "? option)+\n'
+        'option ::= [^,|\\n] [^,|\\n]*\n'
+    )
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Token tables (built once per tokenizer)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _token_strings(tokenizer):
+    """Surface text of every vocab entry; None for special tokens."""
+    special = set(tokenizer.all_special_ids)
+    vocab_size = len(tokenizer)
+    pieces = tokenizer.convert_ids_to_tokens(list(range(vocab_size)))
+    sentencepiece = any(p and p.startswith("▁") for p in pieces[:5000])
+    strings = []
+    for i, piece in enumerate(pieces):
+        if i in special or piece is None:
+            strings.append(None)
+        elif sentencepiece:
+            byte = re.fullmatch(r"<0x([0-9A-Fa-f]{2})>", piece)
+            if byte:
+                value = int(byte.group(1), 16)
+                strings.append(chr(value) if value < 128 else None)
+            else:
+                strings.append(piece.replace("▁", " "))
+        else:
+            strings.append(tokenizer.convert_tokens_to_string([piece]))
+    return strings
+
+
+class MCQTokenTables:
+    """Boolean vocab masks for each token class the MCQ grammar distinguishes."""
+
+    def __init__(self, tokenizer):
+        import torch
+
+        self.strings = _token_strings(tokenizer)
+        size = len(self.strings)
+
+        def _mask(predicate):
+            return torch.tensor([s is not None and s != "" and predicate(s) for s in self.strings], dtype=torch.bool)
+
+        self.text = _mask(lambda s: not any(c in s for c in "|\n,"))
+        self.text_comma = _mask(lambda s: "," in s and not any(c in s for c in "|\n"))
+        self.pipe = _mask(lambda s: s.count("|") == 1 and "\n" not in s and "," not in s)
+        self.newline = _mask(lambda s: s == "\n")
+        # Number prefixes ("1", "1.", ". ", " ") are short: index them by their text
+        self.short = {}
+        for i, s in enumerate(self.strings):
+            if s and len(s) <= 4 and re.fullmatch(r"[0-9. ]+", s):
+                self.short.setdefault(s, []).append(i)
+        self.size = size
+
+
+def get_mcq_tables(tokenizer) -> MCQTokenTables:
+    key = id(tokenizer)
+    if key not in _TABLE_CACHE:
+        _TABLE_CACHE[key] = MCQTokenTables(tokenizer)
+    return _TABLE_CACHE[key]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Logits processor
+# ─────────────────────────────────────────────────────────────────────────────
+
+class _LineState:
+    """Character-level position inside the MCQ grammar."""
+
+    def __init__(self, count):
+        self.count = count
+        self.line = 1          # Question number being written
+        self.prefix = "1. "    # Remaining literal "N. " still to emit
+        self.question = ""     # Text between the prefix and the pipe
+        self.options = None    # Text after the pipe (None until the pipe)
+        self.done = False
+
+    def feed(self, text: str):
+        for ch in text:
+            if self.done:
+                return
+            if self.prefix:
+                self.prefix = self.prefix[1:]
+            elif self.options is None:
+                if ch == "|":
+                    self.options = ""
+                else:
+                    self.question += ch
+            elif ch == "\n":
+                self.line += 1
+                if self.line > self.count:
+                    self.done = True
+                self.prefix, self.question, self.options = f"{self.line}. ", "", None
+            else:
+                self.options += ch
+
+    def option_count(self) -> int:
+        return len([o for o in (self.options or "").split(",") if o.strip()])
+
+
+class MCQGrammarProcessor:
+    """Masks every token that would leave the `N. Question | A, B, C` grammar.
+
+    Stateless with respect to call order: the generated suffix is re-synced on
+    every call, so it also works when generate re-scores earlier positions.
+    """
+
+    def __init__(self, tokenizer, count: int, eos_token_ids):
+        self.tables = get_mcq_tables(tokenizer)
+        self.count = count
+        self.eos_token_ids = [e for e in eos_token_ids if e is not None]
+        self.prompt_len = None
+        # Per batch row: (token ids already fed, grammar state)
+        self._rows = {}
+
+    def _sync(self, row, generated):
+        seen, state = self._rows.get(row, ([], None))
+        if state is None or generated[:len(seen)] != seen:
+            seen, state = [], _LineState(self.count)
+        for token_id in generated[len(seen):]:
+            s = self.tables.strings[token_id] if token_id < self.tables.size else None
+            state.feed(s or "")
+        self._rows[row] = (list(generated), state)
+        return state
+
+    def _allowed(self, st, vocab):
+        import torch
+
+        t = self.tables
+        allowed = torch.zeros(vocab, dtype=torch.bool)
+
+        def _add(mask):
+            allowed[:mask.shape[0]] |= mask[:vocab]
+
+        if st.done:
+            allowed[[e for e in self.eos_token_ids if e < vocab]] = True
+        elif st.prefix:
+            ids = [i for k in range(1, len(st.prefix) + 1) for i in t.short.get(st.prefix[:k], []) if i < vocab]
+            allowed[ids] = True
+        elif st.options is None:
+            _add(t.text)
+            _add(t.text_comma)
+            if st.question.strip():
+                _add(t.pipe)
+            if len(st.question) >= QUESTION_MAX_CHARS:
+                allowed.zero_()
+                _add(t.pipe)
+        else:
+            complete = st.option_count() >= MIN_OPTIONS and st.options.split(",")[-1].strip()
+            if len(st.options) >= OPTIONS_MAX_CHARS and complete:
+                _add(t.newline)
+            else:
+                _add(t.text)
+                if st.options.split(",")[-1].strip():
+                    _add(t.text_comma)
+                if complete:
+                    _add(t.newline)
+        return allowed
+
+    def __call__(self, input_ids, scores):
+        if self.prompt_len is None:
+            self.prompt_len = input_ids.shape[1]
+        for row in range(input_ids.shape[0]):
+            state = self._sync(row, input_ids[row, self.prompt_len:].tolist())
+            scores[row, ~self._allowed(state, scores.shape[-1]).to(scores.device)] = float("-inf")
+        return scores
+
+
+def build_logits_processor(spec: str, tokenizer, eos_token_ids):
+    """Logits processor for a grammar spec string (see parse_grammar_spec)."""
+    _, count = parse_grammar_spec(spec)
+    return MCQGrammarProcessor(tokenizer, count, eos_token_ids)
@@ -0,0 +1,207 @@
+"""
+TruthShield — CPU Thread & Core Topology for Inference
+
+Configured once at startup (main.py flags) instead of per request:
+
+    intra-op threads   — width of each matmul / attention kernel
+    inter-op threads   — independent ops run concurrently (1 is right for decode)
+    inference cores    — CPUs the inference threads are pinned to
+    server cores       — CPUs left to Gradio/uvicorn so the web server never
+                         competes with decode for a core
+    NUMA node          — restricts inference cores to one node's CPUs
+
+Pinning uses os.sched_setaffinity on the calling thread (Linux). Worker
+threads (batcher, streamer, loader) pin themselves when they start; torch's
+OpenMP pool and llama.cpp / ONNX Runtime threads inherit the affinity of the
+thread that creates them.
+"""
+
+import os
+
+_TOPOLOGY = None
+
+
+def parse_cpu_list(spec: str):
+    """'0-3,8,10-11' → [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+
+def format_cpu_list(cpus) -> str:
+    """[0, 1, 2, 3, 8] → '0-3,8'"""
+    cpus = sorted(cpus)
+    if not cpus:
+        return "-"
+    ranges = []
+    start = prev = cpus[0]
+    for c in cpus[1:]:
+        if c == prev + 1:
+            prev = c
+            continue
+        ranges.append(f"{start}-{prev}" if start != prev else str(start))
+        start = prev = c
+    ranges.append(f"{start}-{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_node_cpus(node: int):
+    path = f"/sys/devices/system/node/node{node}/cpulist"
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return parse_cpu_list(f.read().strip())
+    except OSError:
+        return []
+
+
+class ThreadTopology:
+    """Resolved thread counts and core sets for inference vs. the web server."""
+
+    def __init__(self, inference_cores, server_cores, intra_op, inter_op, numa_node=None):
+        self.inference_cores = list(inference_cores)
+        self.server_cores = list(server_cores)
+        self.intra_op = intra_op
+        self.inter_op = inter_op
+        self.numa_node = numa_node
+        self.pinning = hasattr(os, "sched_setaffinity")
+
+    def short(self) -> str:
+        return f"{self.intra_op}T @ {format_cpu_list(self.inference_cores)}"
+
+    def summary(self) -> str:
+        numa = f" · NUMA {self.numa_node}" if self.numa_node is not None else ""
+        return (
+            f"{self.intra_op}×intra/{self.inter_op}×inter on CPUs {format_cpu_list(self.inference_cores)}"
+            f" · server {format_cpu_list(self.server_cores)}{numa}"
+        )
+
+
+def resolve_topology(intra_op=None, inter_op=None, inference_cores=None, server_cores=None, numa_node=None):
+    """Works out which CPUs inference and the server get; nothing is applied yet."""
+    allowed = available_cpus()
+    pool = allowed
+    if numa_node is not None:
+        node_cpus = [c for c in numa_node_cpus(numa_node) if c in allowed]
+        if node_cpus:
+            pool = node_cpus
+        else:
+            print(f"[TruthShield] NUMA node {numa_node} not found; using all CPUs.")
+            numa_node = None
+
+    if inference_cores:
+        inference = [c for c in parse_cpu_list(inference_cores) if c in allowed]
+    else:
+        # Default: keep a core (two on larger boxes) for Gradio/uvicorn, preferably outside the pool
+        reserve = server_cores if server_cores is not None else (0 if len(allowed) < 4 else (2 if len(allowed) > 8 else 1))
+        outside = [c for c in allowed if c not in pool]
+        from_pool = max(0, reserve - len(outside))
+        inference = pool[:len(pool) - from_pool] if from_pool else list(pool)
+    inference = inference or list(pool)
+    server = [c for c in allowed if c not in inference] or list(allowed)
+
+    return ThreadTopology(
+        inference_cores=inference,
+        server_cores=server,
+        intra_op=intra_op or len(inference),
+        inter_op=inter_op or 1,
+        numa_node=numa_node,
+    )
+
+
+def add_topology_arguments(parser):
+    """Command-line options for resolve_topology (shared by main.py, app.py and inference_server.py)."""
+    parser.add_argument("--intra-op-threads", type=int, default=None, help="Threads per inference op (default: one per inference core)")
+    parser.add_argument("--inter-op-threads", type=int, default=None, help="Ops run concurrently (default: 1)")
+    parser.add_argument("--inference-cores", type=str, default=None, help="CPUs for inference threads, e.g. '0-5' (default: all but the server cores)")
+    parser.add_argument("--server-cores", type=int, default=None, help="CPUs kept free for the Gradio/uvicorn server (default: 1, 2 above 8 CPUs, 0 below 4)")
+    parser.add_argument("--numa-node", type=int, default=None, help="Keep inference cores on one NUMA node")
+
+
+def configure_from_args(args) -> ThreadTopology:
+    """Resolves and applies the topology from add_topology_arguments options, once at startup."""
+    topology = configure(resolve_topology(
+        intra_op=args.intra_op_threads,
+        inter_op=args.inter_op_threads,
+        inference_cores=args.inference_cores,
+        server_cores=args.server_cores,
+        numa_node=args.numa_node,
+    ))
+    print(f"[TruthShield] CPU topology: {topology.summary()}")
+    return topology
+
+
+def split_cores(cores, parts: int):
+    """Splits cores into `parts` contiguous, near-equal slices (one per replica)."""
+    cores = list(cores)
+    parts = max(1, min(parts, len(cores)))
+    size, extra = divmod(len(cores), parts)
+    slices, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+def configure(topology: ThreadTopology):
+    """Applies thread counts once, at startup, before any model is loaded."""
+    global _TOPOLOGY
+    _TOPOLOGY = topology
+
+    # Read by OpenMP/MKL when torch initializes its pools (torch is imported lazily)
+    os.environ["OMP_NUM_THREADS"] = str(topology.intra_op)
+    os.environ["MKL_NUM_THREADS"] = str(topology.intra_op)
+    try:
+        import torch
+        torch.set_num_threads(topology.intra_op)
+        try:
+            torch.set_num_interop_threads(topology.inter_op)
+        except RuntimeError:
+            # Only settable before the first inter-op parallel work
+            pass
+    except ImportError:
+        pass
+    return topology
+
+
+def get_topology() -> ThreadTopology:
+    """The configured topology, or an unpinned default using every CPU."""
+    if _TOPOLOGY is None:
+        cpus = available_cpus()
+        return ThreadTopology(cpus, cpus, len(cpus), 1)
+    return _TOPOLOGY
+
+
+def _pin(cpus):
+    if _TOPOLOGY is None or not _TOPOLOGY.pinning:
+        return
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        print(f"[TruthShield] Could not set CPU affinity: {e}")
+
+
+def pin_server_thread():
+    """Moves the calling thread off the inference cores; threads Gradio/uvicorn spawn later inherit it."""
+    if _TOPOLOGY is not None:
+        _pin(_TOPOLOGY.server_cores)
+
+
+def pin_inference_thread():
+    """Pins the calling thread to the inference cores; no-op when unconfigured or unsupported."""
+    if _TOPOLOGY is not None:
+        _pin(_TOPOLOGY.inference_cores)
@@ -0,0 +1,542 @@
+"""
+TruthShield — Clinical AI Engine
+
+ClinicalAIEngine owns the loaded runtime (see backends.py), the batching
+scheduler, the result cache and the loading/warmup lifecycle. It has no UI
+dependency, so the same engine backs the embedded Gradio app (main.py) and
+the standalone inference daemon (inference_server.py).
+"""
+
+import os
+import threading
+import time
+
+from prompts import SYSTEM_PROMPT, build_analysis_inference, MCQ_GENERATION_PROMPT, MCQ_SYSTEM_PROMPT
+from scenarios import SCENARIOS
+from admission import AdmissionController
+from batching import InferenceRequest, MicroBatchScheduler
+from cancellation import CancelToken
+from constrained import mcq_grammar
+from cpu_topology import add_topology_arguments, configure_from_args, pin_inference_thread
+from metrics import METRICS
+from priority import configure as configure_priority
+from replica_pool import ReplicaPool
+from single_flight import SingleFlight
+from stopping import STOP_REPEAT, STOP_SUMMARY
+from backends import create_backend, detect_backend, find_gguf, find_onnx
+from inference_cache import InferenceResultCache, model_fingerprint
+from speculative import resolve_model_dir, speculation_report
+
+
+# Engine readiness: idle (simulation only) → loading → warming → ready | failed
+LOADING_STATES = ("loading", "warming")
+
+class ClinicalAIEngine:
+    """Universal loader and interface for clinical AI models."""
+    def __init__(self):
+        # Active runtime (see backends.py); None while in simulation
+        self.backend = None
+        self.backend_name = "auto"
+        self.is_simulation = True
+        self.model_name = "None (Simulation Active)"
+        self.device = "cpu"
+        self.load_error: str = ""
+        self.state = "idle"
+        self.progress = 0
+        self.progress_message = ""
+        # "degrade": serve simulation while loading; "queue": hold requests until ready
+        self.loading_policy = "degrade"
+        self.load_wait_timeout = 120.0
+        self._ready = threading.Event()
+        self._load_thread = None
+        # "none" | "quick" | "full" — representative prompts run at the end of load()
+        self.warmup_mode = "quick"
+        # Passed to create_backend (e.g. compile_model / compile_cache_dir for transformers)
+        self.backend_options = {}
+        # Gathers concurrent callers into batches for backends that support it
+        self.scheduler = MicroBatchScheduler(self._generate_batch)
+        # >1 forks model replicas after load; generations are then routed to them
+        self.replicas = 1
+        self.pool = None
+        # Greedy decoding is deterministic: identical inputs on the same weights reuse the text
+        self.result_cache = InferenceResultCache()
+        self.model_fingerprint = ""
+        # Identical requests arriving while one is decoding share its generation
+        self.flights = SingleFlight()
+        # Deadline applied to every generation, in seconds (0: none; see cancellation.py)
+        self.inference_timeout_s = 0.0
+        # Refuses generations that would finish past the SLO (see admission.py)
+        self.admission = AdmissionController()
+        # "degrade": refused requests get the simulation/question-bank fast path; "reject": an error
+        self.overload_policy = "degrade"
+        # Typing-time prefill: quiet period before it starts (0 disables); each call bumps the generation
+        self.prefill_debounce_s = 0.4
+        self._prefill_timer = None
+        self._prefill_generation = 0
+
+    def detect_local_models(self):
+        """Scans ./models/ for compatible transformers (config.json), ONNX or GGUF models."""
+        models_dir = "./models"
+        if not os.path.exists(models_dir):
+            return []
+        try:
+            return [
+                d for d in sorted(os.listdir(models_dir))
+                if os.path.isdir(os.path.join(models_dir, d))
+                and (
+                    os.path.exists(os.path.join(models_dir, d, "config.json"))
+                    or find_gguf(os.path.join(models_dir, d))
+                    or find_onnx(os.path.join(models_dir, d))[0]
+                )
+            ]
+        except:
+            return []
+
+    def _set_progress(self, percent, message):
+        self.progress = int(percent)
+        self.progress_message = message
+
+    def load_async(self, model_path: str = None, draft_model_path: str = None, backend: str = None):
+        """Starts load() on a background worker so the UI can serve (simulation) immediately."""
+        self.state = "loading"
+        self._set_progress(0, "Queued")
+        self._ready.clear()
+        def _load():
+            # Runtime thread pools (ORT sessions, OpenMP teams) inherit the loader's cores
+            pin_inference_thread()
+            self.load(model_path, draft_model_path, backend)
+
+        self._load_thread = threading.Thread(target=_load, name="truthshield-loader", daemon=True)
+        self._load_thread.start()
+        return self._load_thread
+
+    def is_loading(self):
+        return self.state in LOADING_STATES
+
+    def await_ready(self):
+        """Applies the loading policy for one real-AI request; True when a model can serve it."""
+        if self.backend is not None and not self.is_simulation:
+            return True
+        if self.is_loading() and self.loading_policy == "queue":
+            self._ready.wait(self.load_wait_timeout)
+        return self.state == "ready" and not self.is_simulation
+
+    def load(self, model_path: str = None, draft_model_path: str = None, backend: str = None):
+        """Loads a model with robust error handling and quantization support.
+
+        backend: "transformers", "onnx", "llama_cpp" or "auto"/None to detect from the weights.
+        draft_model_path (a directory or a folder name under ./models/) enables
+        speculative decoding; without it generation is plain greedy.
+        """
+        self.state = "loading"
+        self._ready.clear()
+        self._set_progress(0, "Scanning for weights")
+        try:
+            draft_dir = resolve_model_dir(draft_model_path)
+            if not model_path:
+                local_models = [
+                    m for m in self.detect_local_models()
+                    if not draft_dir or os.path.realpath(os.path.join("./models", m)) != os.path.realpath(draft_dir)
+                ]
+                if local_models:
+                    model_path = os.path.join("./models", local_models[0])
+                else:
+                    raise FileNotFoundError("MedGemma weights not found in ./models/. Please initialize first.")
+
+            backend = backend or self.backend_name
+            if backend == "auto":
+                backend = detect_backend(model_path)
+
+            print(f"[TruthShield] Initializing Intelligence Layer: {model_path} ({backend})...")
+            start = time.time()
+
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+            runtime = create_backend(backend, **self.backend_options)
+            runtime.load(model_path, draft_model_path, progress=self._set_progress)
+
+            self.backend = runtime
+            self.device = runtime.device
+            self.model_name = os.path.basename(model_path).replace("-", " ").title()
+            self.model_fingerprint = f"{backend}:{runtime.variant}:{model_fingerprint(model_path)}"
+            self.result_cache.invalidate(keep_model=self.model_fingerprint)
+
+            # Pay kernel selection, allocator growth and thread spin-up before real traffic
+            self.state = "warming"
+            self._set_progress(90, "Warming up")
+            if self.replicas > 1:
+                # Fork before any inference in this process; each replica warms itself up
+                self._set_progress(90, f"Starting {self.replicas} replicas")
+                self.pool = ReplicaPool(
+                    runtime, self.replicas, warmup_fn=self.warmup,
+                    max_batch_size=self.scheduler.max_batch_size, max_wait_ms=self.scheduler.max_wait_ms,
+                ).start()
+                self.model_name += f" ×{self.replicas}"
+            else:
+                self.warmup()
+            self.is_simulation = False
+            self.load_error = ""
+            self.state = "ready"
+            self._set_progress(100, "Ready")
+            self._ready.set()
+            
+            elapsed = time.time() - start
+            print(f"[TruthShield] Engine Ready: {self.model_name} activated on {self.device} via {backend} ({elapsed:.1f}s)")
+            return True, f"Successfully loaded {self.model_name}"
+            
+        except Exception as e:
+            self.load_error = str(e)
+            self.is_simulation = True
+            self.state = "failed"
+            self._set_progress(0, str(e))
+            self._ready.set()  # Release queued requests; they degrade to simulation
+            print(f"[TruthShield] Engine Standby (MedGemma not found): {e}")
+            return False, str(e)
+
+    def warmup(self):
+        """Runs representative analysis and MCQ prompts through the backend (see --warmup).
+
+        quick: one short generation per prompt family (also fills the prefix KV cache).
+        full:  additionally a padded batch and a longer decode to grow allocator pools.
+        Results bypass the result cache so warmup never serves a real request.
+        """
+        if self.warmup_mode == "none":
+            return
+        start = time.time()
+        s = SCENARIOS["cyberbullying"]
+        analysis = build_analysis_inference(s["survey"], s["notes"])
+        # Same shapes as the live handlers: analyze_discrepancies decodes with prompt lookup
+        # and summary/loop stops; the MCQ prompt runs constrained so the grammar's token tables are built here
+        analysis_options = dict(decoding="prompt_lookup", stop=[STOP_SUMMARY, STOP_REPEAT])
+        calls = [
+            (analysis, analysis_options),
+            ((MCQ_GENERATION_PROMPT.format(patient_story=s["survey"]), MCQ_SYSTEM_PROMPT.format(count=10)),
+             dict(grammar=mcq_grammar(10))),
+        ]
+        for (prompt_text, system_msg), options in calls:
+            self.backend.generate(
+                self.build_input_text(prompt_text, system_msg), 8,
+                prefix_text=self.build_prefix_text(system_msg), **options,
+            )
+        if self.warmup_mode == "full":
+            requests = [
+                InferenceRequest(self.build_input_text(p, m), 8, prefix_text=self.build_prefix_text(m))
+                for (p, m), _ in calls
+            ]
+            self.backend.generate_batch(requests)
+            prompt_text, system_msg = analysis
+            self.backend.generate(
+                self.build_input_text(prompt_text, system_msg), 64,
+                prefix_text=self.build_prefix_text(system_msg), **analysis_options,
+            )
+        elapsed = time.time() - start
+        METRICS.observe("warmup_s", elapsed)
+        print(f"[TruthShield] Warmup ({self.warmup_mode}) finished in {elapsed:.1f}s")
+
+    @property
+    def max_concurrency(self) -> int:
+        """Generations this engine decodes side by side: one batch per replica."""
+        return self.scheduler.max_batch_size * max(1, self.replicas)
+
+    def speculative_stats(self):
+        """Draft acceptance rate so far; judge whether the draft pays off on this hardware."""
+        report = speculation_report()
+        report["enabled"] = bool(self.backend and self.backend.speculative_enabled())
+        report["prompt_lookup"] = speculation_report(prefix="lookup", with_drafts=False)
+        return report
+
+    def build_input_text(self, prompt_text, system_msg=SYSTEM_PROMPT):
+        """Renders the chat template for one system/user exchange."""
+        return self.backend.render_prompt(prompt_text, system_msg)
+
+    def build_prefix_text(self, system_msg=SYSTEM_PROMPT):
+        """The chat-template text preceding the user content; identical for every request with system_msg."""
+        marker = "\x00TRUTHSHIELD_USER\x00"
+        rendered = self.build_input_text(marker, system_msg)
+        return rendered[:rendered.index(marker)]
+
+    def count_tokens(self, text):
+        return self.backend.count_tokens(text)
+
+    def _cancel_token(self, cancel=None):
+        """A token for one call: fires with the caller's CancelToken or after inference_timeout_s.
+
+        The caller's token is never changed, so a finished call cannot later read as timed out.
+        """
+        return cancel.child(self.inference_timeout_s) if cancel is not None else CancelToken(self.inference_timeout_s)
+
+    def run_inference(self, prompt_text, system_msg=SYSTEM_PROMPT, max_tokens=512, decoding="auto", grammar=None,
+                      stop_criteria=None, cancel=None, priority=None):
+        """Generic inference wrapper. Concurrent callers are micro-batched by the scheduler.
+
+        decoding selects the speculative mode per call ("auto", "greedy", "prompt_lookup");
+        grammar constrains the output shape (e.g. "mcq:10", see constrained.py);
+        stop_criteria end generation early (e.g. ["summary_line"], see stopping.py);
+        cancel (a CancelToken) or --inference-timeout stop it between decode steps,
+        raising GenerationCancelled.
+        priority is a class from priority.classify(); urgent calls are served first.
+        Calls with non-default options run unbatched; identical concurrent calls
+        share one generation (see single_flight.py).
+        """
+        if not self.await_ready():
+            return None
+
+        # Decoding modes are greedy-equivalent and share cache entries; grammar and stops change the text
+        shape = self._shape_options(grammar, stop_criteria)
+        key = self.result_cache.make_key(self.model_fingerprint, system_msg, prompt_text, max_tokens, **shape)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            return cached
+
+        self.cancel_prefill()  # Real requests take the model lock first
+        options = dict(shape)
+        if decoding != "auto":
+            options["decoding"] = decoding
+        submit = self.pool.submit if self.pool is not None else self.scheduler.submit
+        input_text, prefix_text = self.build_input_text(prompt_text, system_msg), self.build_prefix_text(system_msg)
+
+        def _start(flight_cancel):
+            # Admitted here, so callers joining this flight add no work
+            with self.admission.admit(max_tokens, flight_cancel) as ticket:
+                result = submit(
+                    input_text, max_tokens, prefix_text=prefix_text, cancel=flight_cancel, priority=priority, **options
+                )
+                ticket.tokens = self._generated_tokens(result)
+            self.result_cache.put(key, result, self.model_fingerprint)
+            yield result
+
+        # A streaming twin of this request may be the one decoding: join whatever it produced
+        with self.flights.join(key, _start, self._cancel_token(cancel), self.inference_timeout_s) as pieces:
+            return "".join(pieces)
+
+    def run_inference_batch(self, prompt_texts, system_msg=SYSTEM_PROMPT, max_tokens=512, grammar=None,
+                            stop_criteria=None, cancel=None, priority=None):
+        """Decodes several prompts as one padded batch; results keep the input order.
+
+        Wall-clock time follows the longest row rather than the sum of all rows.
+        Cached prompts are answered directly and only the misses are decoded.
+        """
+        if not self.await_ready():
+            return [None] * len(prompt_texts)
+
+        shape = self._shape_options(grammar, stop_criteria)
+        keys = [
+            self.result_cache.make_key(self.model_fingerprint, system_msg, p, max_tokens, **shape)
+            for p in prompt_texts
+        ]
+        results = [self.result_cache.get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if not missing:
+            return results
+
+        self.cancel_prefill()
+        cancel = self._cancel_token(cancel)
+        prefix_text = self.build_prefix_text(system_msg)
+        items = [
+            (self.build_input_text(prompt_texts[i], system_msg), max_tokens, prefix_text, dict(shape))
+            for i in missing
+        ]
+
+        def _start(flight_cancel):
+            with self.admission.admit(max_tokens * len(items), flight_cancel) as ticket:
+                if self.pool is not None:
+                    # Replicas each batch what reaches them together; spread the rows across them
+                    from concurrent.futures import ThreadPoolExecutor
+                    with ThreadPoolExecutor(max_workers=len(items)) as executor:
+                        texts = list(executor.map(
+                            lambda it: self.pool.submit(
+                                it[0], it[1], prefix_text=it[2], cancel=flight_cancel, priority=priority, **it[3]
+                            ),
+                            items,
+                        ))
+                else:
+                    texts = self.scheduler.submit_group(items, cancel=flight_cancel, priority=priority)
+                ticket.tokens = sum(self._generated_tokens(t) for t in texts)
+            for i, text in zip(missing, texts):
+                self.result_cache.put(keys[i], text, self.model_fingerprint)
+            yield texts
+
+        flight_key = "batch:" + ",".join(keys[i] for i in missing)
+        with self.flights.join(flight_key, _start, cancel, self.inference_timeout_s) as pieces:
+            (texts,) = pieces
+        for i, text in zip(missing, texts):
+            results[i] = text
+        return results
+
+    def run_inference_stream(self, prompt_text, system_msg=SYSTEM_PROMPT, max_tokens=512, decoding="auto",
+                             grammar=None, stop_criteria=None, cancel=None, priority=None):
+        """Streaming variant of run_inference: yields decoded text increments as tokens are produced.
+
+        Closing the generator early cancels the decode as well.
+        """
+        if not self.await_ready():
+            return
+
+        shape = self._shape_options(grammar, stop_criteria)
+        key = self.result_cache.make_key(self.model_fingerprint, system_msg, prompt_text, max_tokens, **shape)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        self.cancel_prefill()
+        input_text, prefix_text = self.build_input_text(prompt_text, system_msg), self.build_prefix_text(system_msg)
+
+        options = dict(shape)
+        if decoding != "auto":
+            options["decoding"] = decoding
+        # Streams queue with blocking calls, so concurrent analyses and MCQ lists share padded batches
+        stream = self.pool.stream if self.pool is not None else self.scheduler.stream
+
+        def _start(flight_cancel):
+            text = ""
+            with self.admission.admit(max_tokens, flight_cancel) as ticket:
+                for piece in stream(
+                    input_text, max_tokens, prefix_text=prefix_text, cancel=flight_cancel, priority=priority, **options
+                ):
+                    text += piece
+                    yield piece
+                ticket.tokens = self._generated_tokens(text)
+            self.result_cache.put(key, text, self.model_fingerprint)
+
+        # Double-clicks attach here: later callers replay the pieces so far, then follow live
+        with self.flights.join(key, _start, self._cancel_token(cancel), self.inference_timeout_s) as pieces:
+            yield from pieces
+
+    def speculative_prefill(self, prompt_text, system_msg=SYSTEM_PROMPT, typed_text=None):
+        """Prefills a prompt the user is still typing, so its request later only prefills the tail.
+
+        Debounced: only the latest call runs, after prefill_debounce_s without a
+        newer one. typed_text is the part still being edited; the rendered
+        prompt is cut at its end because the template text after it will move.
+        The work yields to real requests (see backend.speculative_prefill).
+        """
+        self.cancel_prefill()
+        if (self.prefill_debounce_s <= 0 or self.pool is not None or self.backend is None
+                or self.is_simulation or self.state != "ready"):
+            return
+        input_text = self.build_input_text(prompt_text, system_msg)
+        if typed_text:
+            end = input_text.rfind(typed_text.rstrip())
+            if end < 0:
+                return
+            input_text = input_text[:end + len(typed_text.rstrip())]
+
+        generation = self._prefill_generation
+        timer = threading.Timer(self.prefill_debounce_s, self._run_prefill, args=(generation, input_text))
+        timer.daemon = True
+        self._prefill_timer = timer
+        timer.start()
+
+    def cancel_prefill(self):
+        """Stops a pending or running typing-time prefill (between chunks)."""
+        self._prefill_generation += 1
+        if self._prefill_timer is not None:
+            self._prefill_timer.cancel()
+            self._prefill_timer = None
+
+    def _run_prefill(self, generation, input_text):
+        pin_inference_thread()
+
+        def _should_stop():
+            return generation != self._prefill_generation or self.scheduler.pending() > 0
+
+        try:
+            self.backend.speculative_prefill(input_text, should_stop=_should_stop)
+        except Exception as e:
+            print(f"[TruthShield] Speculative prefill skipped: {e}")
+
+    def _generated_tokens(self, text):
+        """Output length fed to the admission throughput estimate."""
+        return self.count_tokens(text) if text else 0
+
+    @staticmethod
+    def _shape_options(grammar, stop_criteria):
+        """Backend options that change the generated text (and therefore the cache key)."""
+        shape = {}
+        if grammar:
+            shape["grammar"] = grammar
+        if stop_criteria:
+            shape["stop"] = list(stop_criteria)
+        return shape
+
+    def _generate_batch(self, requests):
+        """Scheduler callback: one batch in, one decoded slice per request out."""
+        return self.backend.generate_batch(requests)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Engine command-line options (shared by main.py and inference_server.py)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def add_engine_arguments(parser):
+    parser.add_argument("--model-path", type=str, default=None, help="Path to AWQ-quantized MedGemma model")
+    parser.add_argument("--backend", type=str, default="auto", choices=["auto", "transformers", "onnx", "llama_cpp"], help="Inference runtime (default: detect from the weights)")
+    parser.add_argument("--draft-model", type=str, default=None, help="Draft model (path or folder in ./models) for speculative decoding")
+    parser.add_argument("--sync-load", action="store_true", help="Load the model before starting the UI instead of in the background")
+    parser.add_argument("--loading-policy", type=str, default="degrade", choices=["degrade", "queue"], help="Real-AI requests while the model loads: serve simulation (degrade) or wait (queue)")
+    parser.add_argument("--load-wait-timeout", type=float, default=120.0, help="Max seconds a queued request waits for the model (default: 120)")
+    parser.add_argument("--warmup", type=str, default="quick", choices=["none", "quick", "full"], help="Warmup pass run after loading (default: quick)")
+    parser.add_argument("--compile", action="store_true", help="torch.compile the model forward (transformers backend)")
+    parser.add_argument("--compile-cache-dir", type=str, default="./models/.compile_cache", help="Persistent torch.compile cache so restarts don't recompile")
+    parser.add_argument("--max-batch-size", type=int, default=4, help="Max concurrent requests fused into one generate call (1 disables batching)")
+    parser.add_argument("--batch-wait-ms", type=float, default=25.0, help="How long the batcher waits for companion requests (default: 25ms)")
+    parser.add_argument("--result-cache-size", type=int, default=256, help="In-memory inference result cache entries (default: 256)")
+    parser.add_argument("--result-cache-db", type=str, default=None, help="Optional SQLite file for the on-disk result cache tier")
+    add_topology_arguments(parser)
+    parser.add_argument("--inference-timeout", type=float, default=0.0, help="Seconds after which a generation is stopped and reported as timed out (default: 0, no limit)")
+    parser.add_argument("--max-queue-depth", type=int, default=16, help="Generations admitted at once; more are refused (0: unbounded)")
+    parser.add_argument("--slo", type=float, default=120.0, help="Refuse generations whose estimated wait exceeds this many seconds (0: never)")
+    parser.add_argument("--overload-policy", type=str, default="degrade", choices=["degrade", "reject"], help="Refused requests: serve simulation / the standard question bank (degrade) or report busy (reject)")
+    parser.add_argument("--priority-aging", type=float, default=15.0, help="Seconds of queueing that lift a request one priority class, so MCQs cannot starve behind analyses (default: 15)")
+    parser.add_argument("--prefill-debounce-ms", type=float, default=400.0, help="Idle time while typing before the story prompt is prefilled in the background (0 disables)")
+    parser.add_argument("--replicas", type=int, default=1, help="Model replica processes sharing the weights copy-on-write, each on its own core slice (transformers backend)")
+
+
+def configure_engine(engine, args):
+    """Applies the parsed engine options; thread pools are sized once here rather than per request."""
+    configure_from_args(args)
+
+    engine.backend_name = args.backend
+    engine.result_cache = InferenceResultCache(args.result_cache_size, args.result_cache_db)
+    engine.scheduler.configure(max_batch_size=args.max_batch_size, max_wait_ms=args.batch_wait_ms)
+    configure_priority(aging_s=args.priority_aging)
+
+    engine.warmup_mode = args.warmup
+    engine.backend_options = {"compile_model": args.compile, "compile_cache_dir": args.compile_cache_dir}
+    engine.loading_policy = args.loading_policy
+    engine.load_wait_timeout = args.load_wait_timeout
+    engine.inference_timeout_s = max(0.0, args.inference_timeout)
+    engine.admission.configure(max_depth=args.max_queue_depth, slo_s=args.slo)
+    engine.overload_policy = args.overload_policy
+    engine.prefill_debounce_s = max(0.0, args.prefill_debounce_ms) / 1000.0
+    engine.replicas = max(1, args.replicas)
+    if engine.replicas > 1 and not args.sync_load:
+        # Replicas are forked from the loaded model, which must happen before the server starts its threads
+        print("[TruthShield] --replicas implies --sync-load")
+        args.sync_load = True
+
+
+def start_engine(engine, args):
+    """Loads the weights now (--sync-load) or in the background, or stays in simulation."""
+    if args.sync_load:
+        pin_inference_thread()
+        if args.model_path:
+            engine.load(args.model_path, args.draft_model, args.backend)
+        else:
+            # Auto-detect and load any synchronized model
+            print("[TruthShield] Scanning for local AI weights...")
+            success, msg = engine.load(draft_model_path=args.draft_model)
+            if success:
+                print(f"[TruthShield] Automatic Initialization: {msg}")
+            else:
+                print(f"[TruthShield] No local weights found: {msg}")
+                print("[TruthShield] Starting in Simulation Mode. Use 'Model Management' to sync MedGemma.\n")
+    elif args.model_path or engine.detect_local_models():
+        # The UI comes up immediately; real-AI requests follow --loading-policy until ready
+        print(f"[TruthShield] Loading AI weights in the background (policy: {args.loading_policy})...")
+        engine.load_async(args.model_path, args.draft_model, args.backend)
+    else:
+        print("[TruthShield] No local weights found in ./models/.")
+        print("[TruthShield] Starting in Simulation Mode. Use 'Model Management' to sync MedGemma.\n")
@@ -0,0 +1,287 @@
+"""
+TruthShield — Remote Engine Client
+
+RemoteEngine speaks the inference_server.py protocol and exposes the subset
+of ClinicalAIEngine that the UIs use, so main.py / app.py become thin
+clients with --engine-url. Stdlib only: a UI process never needs torch.
+
+If the daemon is unreachable the client reports itself as failed and in
+simulation, so the UI degrades exactly as it does without local weights;
+run_inference_stream raises EngineUnreachable so a stream that was already
+under way can fall back to simulation too.
+"""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from admission import Overloaded
+from cancellation import GenerationCancelled
+from prompts import SYSTEM_PROMPT
+
+# Engine state is polled by the sidebar timer; avoid one HTTP call per attribute read
+STATUS_TTL_S = 0.5
+
+
+class EngineUnreachable(OSError):
+    """The daemon did not answer: connection refused, DNS failure or timeout."""
+
+    def __init__(self, url: str, cause: Exception):
+        reason = getattr(cause, "reason", cause)
+        super().__init__(f"Inference server unreachable at {url}: {reason}")
+
+
+def _error_body(e: urllib.error.HTTPError) -> dict:
+    """The daemon's JSON error body; proxies and crashed handlers may send plain text or nothing."""
+    text = e.read().decode("utf-8", errors="replace")
+    try:
+        body = json.loads(text)
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        body = {"error": text.strip() or str(e)}
+    body.setdefault("status", e.code)
+    return body
+
+
+def _raise_for_error(body: dict):
+    if "cancelled" in body:
+        raise GenerationCancelled(body["cancelled"])
+    if "overloaded" in body:
+        raise Overloaded(body["overloaded"], body.get("estimated_wait"))
+    raise RuntimeError(f"Inference server error (HTTP {body['status']}): {body.get('error', '')}")
+
+
+class RemoteEngine:
+    """ClinicalAIEngine look-alike backed by a local inference daemon."""
+
+    def __init__(self, url: str, timeout: float = 600.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._status = {}
+        self._status_at = 0.0
+
+    # ── Transport ────────────────────────────────────────────────────────
+
+    def _request(self, path, payload=None, timeout=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(
+            self.url + path, data=data, headers={"Content-Type": "application/json"},
+            method="POST" if data is not None else "GET",
+        )
+        return urllib.request.urlopen(req, timeout=timeout or self.timeout)
+
+    def _call(self, path, payload=None, timeout=None) -> dict:
+        try:
+            with self._request(path, payload, timeout) as resp:
+                text = resp.read()
+        except urllib.error.HTTPError as e:
+            _raise_for_error(_error_body(e))
+        except (urllib.error.URLError, ConnectionError, TimeoutError) as e:
+            raise EngineUnreachable(self.url, e) from e
+        try:
+            return json.loads(text)
+        except ValueError:
+            raise RuntimeError(f"Inference server sent a non-JSON response: {text[:200]!r}")
+
+    def _generation(self, payload, cancel):
+        """Adds request_id/timeout to a generation payload and forwards cancel() to the daemon.
+
+        Returns an Event to set once the call has finished.
+        """
+        payload["request_id"] = uuid.uuid4().hex
+        payload["timeout"] = cancel.remaining() if cancel is not None else None
+        finished = threading.Event()
+        if cancel is not None:
+            def _forward():
+                while not finished.is_set():
+                    if cancel.wait(0.2):
+                        try:
+                            self._call("/v1/cancel", {"request_id": payload["request_id"]}, timeout=2.0)
+                        except (OSError, RuntimeError):
+                            pass
+                        return
+
+            threading.Thread(target=_forward, name="truthshield-cancel-forward", daemon=True).start()
+        return finished
+
+    def status(self, refresh=False) -> dict:
+        if refresh or time.time() - self._status_at > STATUS_TTL_S:
+            try:
+                self._status = self._call("/health", timeout=2.0)
+            except (OSError, RuntimeError) as e:
+                self._status = {
+                    "state": "failed", "is_simulation": True, "model_name": "Inference Server Unreachable",
+                    "load_error": f"{self.url}: {e}", "progress": 0, "progress_message": "",
+                }
+            self._status_at = time.time()
+        return self._status
+
+    # ── Engine state ─────────────────────────────────────────────────────
+
+    @property
+    def state(self):
+        return self.status().get("state", "failed")
+
+    @property
+    def is_simulation(self):
+        return self.status().get("is_simulation", True)
+
+    @property
+    def model_name(self):
+        return self.status().get("model_name", "")
+
+    @property
+    def device(self):
+        return self.status().get("device", "")
+
+    @property
+    def load_error(self):
+        return self.status().get("load_error", "")
+
+    @property
+    def progress(self):
+        return self.status().get("progress", 0)
+
+    @property
+    def progress_message(self):
+        return self.status().get("progress_message", "")
+
+    @property
+    def loading_policy(self):
+        return self.status().get("loading_policy", "degrade")
+
+    @property
+    def inference_timeout_s(self):
+        return self.status().get("inference_timeout", 0.0)
+
+    @property
+    def max_concurrency(self):
+        return self.status().get("max_concurrency", 1)
+
+    @property
+    def overload_policy(self):
+        return self.status().get("overload_policy", "degrade")
+
+    @property
+    def model_fingerprint(self):
+        return self.status().get("model_fingerprint", "")
+
+    def is_loading(self):
+        return self.state in ("loading", "warming")
+
+    def await_ready(self):
+        try:
+            return self._call("/v1/await_ready", {}).get("ready", False)
+        except (OSError, RuntimeError):
+            return False
+
+    def detect_local_models(self):
+        try:
+            return self._call("/v1/models", timeout=5.0).get("models", [])
+        except (OSError, RuntimeError):
+            return []
+
+    def load(self, model_path: str = None, draft_model_path: str = None, backend: str = None):
+        try:
+            out = self._call("/v1/load", {
+                "model_path": model_path, "draft_model_path": draft_model_path, "backend": backend, "wait": True,
+            })
+        except (OSError, RuntimeError) as e:
+            return False, str(e)
+        self.status(refresh=True)
+        return out["success"], out["message"]
+
+    def load_async(self, model_path: str = None, draft_model_path: str = None, backend: str = None):
+        self._call("/v1/load", {
+            "model_path": model_path, "draft_model_path": draft_model_path, "backend": backend, "wait": False,
+        })
+        self.status(refresh=True)
+
+    # ── Inference ────────────────────────────────────────────────────────
+
+    def count_tokens(self, text):
+        return self._call("/v1/count_tokens", {"text": text})["tokens"]
+
+    def speculative_stats(self):
+        return self._call("/v1/metrics", timeout=5.0).get("speculative", {})
+
+    def speculative_prefill(self, prompt_text, system_msg=SYSTEM_PROMPT, typed_text=None):
+        # Best effort: a missed prefill only costs the normal prefill on submit
+        try:
+            self._call("/v1/prefill", {"prompt": prompt_text, "system": system_msg, "typed": typed_text}, timeout=2.0)
+        except (OSError, RuntimeError):
+            pass
+
+    def cancel_prefill(self):
+        try:
+            self._call("/v1/prefill", {"cancel": True}, timeout=2.0)
+        except (OSError, RuntimeError):
+            pass
+
+    def run_inference(self, prompt_text, system_msg=SYSTEM_PROMPT, max_tokens=512, decoding="auto", grammar=None,
+                      stop_criteria=None, cancel=None, priority=None):
+        payload = {
+            "prompt": prompt_text, "system": system_msg, "max_tokens": max_tokens, "decoding": decoding,
+            "grammar": grammar, "stop": stop_criteria, "priority": priority,
+        }
+        finished = self._generation(payload, cancel)
+        try:
+            return self._call("/v1/generate", payload).get("text")
+        except OSError as e:
+            print(f"[TruthShield] {e}")
+            return None
+        finally:
+            finished.set()
+
+    def run_inference_batch(self, prompt_texts, system_msg=SYSTEM_PROMPT, max_tokens=512, grammar=None,
+                            stop_criteria=None, cancel=None, priority=None):
+        payload = {
+            "prompts": list(prompt_texts), "system": system_msg, "max_tokens": max_tokens,
+            "grammar": grammar, "stop": stop_criteria, "priority": priority,
+        }
+        finished = self._generation(payload, cancel)
+        try:
+            return self._call("/v1/generate_batch", payload).get("texts")
+        except OSError as e:
+            print(f"[TruthShield] {e}")
+            return [None] * len(prompt_texts)
+        finally:
+            finished.set()
+
+    def run_inference_stream(self, prompt_text, system_msg=SYSTEM_PROMPT, max_tokens=512, decoding="auto",
+                             grammar=None, stop_criteria=None, cancel=None, priority=None):
+        """Closing this generator drops the connection, which cancels the decode on the daemon."""
+        payload = {
+            "prompt": prompt_text, "system": system_msg, "max_tokens": max_tokens, "decoding": decoding,
+            "grammar": grammar, "stop": stop_criteria, "priority": priority,
+        }
+        finished = self._generation(payload, cancel)
+        try:
+            try:
+                resp = self._request("/v1/stream", payload)
+            except urllib.error.HTTPError as e:
+                _raise_for_error(_error_body(e))
+            except (urllib.error.URLError, ConnectionError, TimeoutError) as e:
+                # Raised, not swallowed: an empty stream would read as an empty answer
+                raise EngineUnreachable(self.url, e) from e
+            with resp:
+                for line in resp:
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    if "piece" in event:
+                        yield event["piece"]
+                    elif "cancelled" in event:
+                        raise GenerationCancelled(event["cancelled"])
+                    elif "overloaded" in event:
+                        raise Overloaded(event["overloaded"], event.get("estimated_wait"))
+                    elif "error" in event:
+                        raise RuntimeError(f"Inference server error: {event['error']}")
+                    else:
+                        return
+        finally:
+            finished.set()
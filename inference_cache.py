@@ -0,0 +1,127 @@
+"""
+TruthShield — Deterministic Inference Result Cache
+
+run_inference decodes greedily with a fixed repetition penalty, so the same
+(model, system message, prompt, max_tokens) always yields the same text.
+Results are content-addressed by a hash of those inputs and kept in a
+size-bounded in-memory LRU, with an optional SQLite tier that survives
+restarts. Keys embed the model fingerprint, so swapping weights makes every
+older entry unreachable.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from metrics import METRICS
+
+
+def model_fingerprint(model_path: str) -> str:
+    """Identity of a weights directory: resolved path plus name/size/mtime of its files."""
+    real = os.path.realpath(model_path)
+    parts = [real]
+    try:
+        for name in sorted(os.listdir(real)):
+            full = os.path.join(real, name)
+            if os.path.isfile(full):
+                st = os.stat(full)
+                parts.append(f"{name}:{st.st_size}:{int(st.st_mtime)}")
+    except OSError:
+        pass
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class InferenceResultCache:
+    """Memory LRU in front of an optional on-disk SQLite tier."""
+
+    def __init__(self, max_entries: int = 256, disk_path: str = None):
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, path: str):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, model TEXT, text TEXT)")
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"[TruthShield] Result cache disk tier disabled ({path}): {e}")
+            self._db = None
+
+    @staticmethod
+    def make_key(model_id: str, system_msg: str, prompt_text: str, max_tokens: int, **options) -> str:
+        payload = json.dumps(
+            [model_id, system_msg, prompt_text, int(max_tokens), sorted(options.items())],
+            ensure_ascii=False, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                METRICS.incr("result_cache_hits")
+                return self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT text FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    METRICS.incr("result_cache_hits")
+                    METRICS.incr("result_cache_disk_hits")
+                    return row[0]
+
+            self.misses += 1
+            METRICS.incr("result_cache_misses")
+            return None
+
+    def put(self, key: str, text: str, model_id: str = ""):
+        if text is None:
+            return
+        with self._lock:
+            self._remember(key, text)
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, model_id, text))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"[TruthShield] Result cache write failed: {e}")
+
+    def _remember(self, key: str, text: str):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def invalidate(self, keep_model: str = None):
+        """Drops the memory tier and every disk row not produced by keep_model."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results WHERE model != ?", (keep_model or "",))
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "entries": len(self._memory),
+            }
@@ -0,0 +1,241 @@
+"""
+TruthShield — Local Inference Daemon
+
+Runs one ClinicalAIEngine in its own process so several Gradio frontends
+(e.g. the patient portal and the clinician dashboard on different ports)
+share a single copy of MedGemma. Tokenization and decoding also stop
+competing with Gradio event handling for the UI process's GIL.
+
+Protocol: JSON over HTTP on localhost (stdlib only).
+    GET  /health            engine state, model name, device, load progress
+    GET  /v1/models         weights folders found in ./models/
+    GET  /v1/metrics        METRICS snapshot + speculative acceptance
+    POST /v1/await_ready    {}                                         → {"ready": bool}
+    POST /v1/generate       {"prompt", "system", "max_tokens", "decoding", "grammar", "stop", "priority", "request_id", "timeout"} → {"text": str | null}
+    POST /v1/stream         same body → newline-delimited JSON: {"piece": str} ... {"done": true} | {"error": str} | {"cancelled": reason} | {"overloaded": reason}
+    POST /v1/generate_batch {"prompts": [...], "system", "max_tokens", "grammar", "stop", "priority", "request_id", "timeout"} → {"texts": [...]}
+    POST /v1/cancel         {"request_id"}                             → {"cancelled": bool}
+    POST /v1/prefill        {"prompt", "system", "typed"} (or {"cancel": true}) → {"ok": true}
+    POST /v1/count_tokens   {"text"}                                   → {"tokens": int}
+    POST /v1/load           {"model_path", "draft_model_path", "backend", "wait"} → {"success", "message", "state"}
+
+Usage:
+    python inference_server.py --model-path ./models/medgemma-4b-awq --port 8765
+    python main.py --engine-url http://127.0.0.1:8765 --port 7860
+    python app.py  --engine-url http://127.0.0.1:8765 --port 7861
+
+Generations stopped by /v1/cancel or their "timeout" (seconds) answer
+HTTP 409 {"cancelled": "cancelled" | "timeout"}; a stream whose client
+disconnects is cancelled at its next token. Generations refused by admission
+control answer HTTP 503 {"overloaded": "queue_full" | "slo", "estimated_wait"}
+(streams: the same object as their only line). "priority" is a class from
+priority.py ("critical" … "low"); omitted, the request queues as "normal".
+"""
+
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from admission import Overloaded
+from cancellation import CancelToken, GenerationCancelled
+from cpu_topology import pin_server_thread
+from engine import ClinicalAIEngine, add_engine_arguments, configure_engine, start_engine
+from metrics import METRICS
+from prompts import SYSTEM_PROMPT
+
+ENGINE = ClinicalAIEngine()
+
+# request_id → CancelToken of generations in flight, for /v1/cancel
+_ACTIVE = {}
+_ACTIVE_LOCK = threading.Lock()
+
+
+def _register(body) -> CancelToken:
+    token = CancelToken(body.get("timeout"))
+    if body.get("request_id"):
+        with _ACTIVE_LOCK:
+            _ACTIVE[body["request_id"]] = token
+    return token
+
+
+def _unregister(body):
+    if body.get("request_id"):
+        with _ACTIVE_LOCK:
+            _ACTIVE.pop(body["request_id"], None)
+
+
+def engine_status(engine) -> dict:
+    return {
+        "state": engine.state,
+        "is_simulation": engine.is_simulation,
+        "model_name": engine.model_name,
+        "device": engine.device,
+        "backend_name": engine.backend_name,
+        "progress": engine.progress,
+        "progress_message": engine.progress_message,
+        "load_error": engine.load_error,
+        "loading_policy": engine.loading_policy,
+        "load_wait_timeout": engine.load_wait_timeout,
+        "inference_timeout": engine.inference_timeout_s,
+        "overload_policy": engine.overload_policy,
+        "max_concurrency": engine.max_concurrency,
+        "queue_depth": engine.admission.depth(),
+        "estimated_wait": engine.admission.estimate_wait_s(),
+        "model_fingerprint": engine.model_fingerprint,
+    }
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    server_version = "TruthShieldInference/1.0"
+
+    def log_message(self, format, *args):
+        # Request lines would flood the console at batch rates
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(engine_status(ENGINE))
+        elif self.path == "/v1/models":
+            self._send_json({"models": ENGINE.detect_local_models()})
+        elif self.path == "/v1/metrics":
+            stats = ENGINE.speculative_stats() if ENGINE.backend is not None else {}
+            self._send_json({"metrics": METRICS.snapshot(), "speculative": stats})
+        else:
+            self._send_json({"error": f"Unknown path {self.path}"}, status=404)
+
+    def do_POST(self):
+        try:
+            body = self._read_json()
+        except ValueError as e:
+            self._send_json({"error": f"Invalid JSON: {e}"}, status=400)
+            return
+
+        try:
+            if self.path == "/v1/generate":
+                try:
+                    text = ENGINE.run_inference(
+                        body["prompt"], body.get("system", SYSTEM_PROMPT),
+                        max_tokens=int(body.get("max_tokens", 512)), decoding=body.get("decoding", "auto"),
+                        grammar=body.get("grammar"), stop_criteria=body.get("stop"), priority=body.get("priority"),
+                        cancel=_register(body),
+                    )
+                finally:
+                    _unregister(body)
+                self._send_json({"text": text})
+            elif self.path == "/v1/generate_batch":
+                try:
+                    texts = ENGINE.run_inference_batch(
+                        body["prompts"], body.get("system", SYSTEM_PROMPT),
+                        max_tokens=int(body.get("max_tokens", 512)),
+                        grammar=body.get("grammar"), stop_criteria=body.get("stop"), priority=body.get("priority"),
+                        cancel=_register(body),
+                    )
+                finally:
+                    _unregister(body)
+                self._send_json({"texts": texts})
+            elif self.path == "/v1/cancel":
+                with _ACTIVE_LOCK:
+                    token = _ACTIVE.get(body["request_id"])
+                if token is not None:
+                    token.cancel()
+                self._send_json({"cancelled": token is not None})
+            elif self.path == "/v1/stream":
+                self._stream(body)
+            elif self.path == "/v1/await_ready":
+                self._send_json({"ready": ENGINE.await_ready()})
+            elif self.path == "/v1/prefill":
+                if body.get("cancel"):
+                    ENGINE.cancel_prefill()
+                else:
+                    ENGINE.speculative_prefill(body["prompt"], body.get("system", SYSTEM_PROMPT), typed_text=body.get("typed"))
+                self._send_json({"ok": True})
+            elif self.path == "/v1/count_tokens":
+                self._send_json({"tokens": ENGINE.count_tokens(body["text"])})
+            elif self.path == "/v1/load":
+                args = (body.get("model_path"), body.get("draft_model_path"), body.get("backend"))
+                if body.get("wait", True):
+                    success, message = ENGINE.load(*args)
+                else:
+                    ENGINE.load_async(*args)
+                    success, message = True, "Loading in the background"
+                self._send_json({"success": success, "message": message, "state": ENGINE.state})
+            else:
+                self._send_json({"error": f"Unknown path {self.path}"}, status=404)
+        except GenerationCancelled as e:
+            self._send_json({"cancelled": e.reason}, status=409)
+        except Overloaded as e:
+            self._send_json({"overloaded": e.reason, "estimated_wait": e.estimated_wait_s}, status=503)
+        except KeyError as e:
+            self._send_json({"error": f"Missing field {e}"}, status=400)
+        except Exception as e:
+            self._send_json({"error": f"{type(e).__name__}: {e}"}, status=500)
+
+    def _stream(self, body):
+        cancel = _register(body)
+        pieces = ENGINE.run_inference_stream(
+            body["prompt"], body.get("system", SYSTEM_PROMPT),
+            max_tokens=int(body.get("max_tokens", 512)), decoding=body.get("decoding", "auto"),
+            grammar=body.get("grammar"), stop_criteria=body.get("stop"), priority=body.get("priority"),
+            cancel=cancel,
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        # HTTP/1.0 response: the body ends when the connection closes
+        try:
+            for piece in pieces:
+                self.wfile.write((json.dumps({"piece": piece}) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b'{"done": true}\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away: stop decoding for it
+            cancel.cancel()
+            pieces.close()
+        except GenerationCancelled as e:
+            self.wfile.write((json.dumps({"cancelled": e.reason}) + "\n").encode("utf-8"))
+        except Overloaded as e:
+            self.wfile.write((json.dumps({"overloaded": e.reason, "estimated_wait": e.estimated_wait_s}) + "\n").encode("utf-8"))
+        except Exception as e:
+            self.wfile.write((json.dumps({"error": f"{type(e).__name__}: {e}"}) + "\n").encode("utf-8"))
+        finally:
+            _unregister(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TruthShield local inference daemon")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Bind address (default: 127.0.0.1, local only)")
+    parser.add_argument("--port", type=int, default=8765, help="Port (default: 8765)")
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+
+    configure_engine(ENGINE, args)
+    start_engine(ENGINE, args)
+
+    # Handler threads inherit the server cores, away from decode
+    pin_server_thread()
+    server = ThreadingHTTPServer((args.host, args.port), InferenceRequestHandler)
+    server.daemon_threads = True
+    print(f"[TruthShield] Inference server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ all hospital departments. Runs 100% offline using MedGemma-4B-instruct
 Usage:
     python main.py
     python main.py --model-path ./models/medgemma-4b-awq
+    python main.py --engine-url http://127.0.0.1:8765   # thin client of inference_server.py
 """
 
 import argparse
@@ -23,12 +24,26 @@ import gradio as gr
 from prompts import (
     SYSTEM_PROMPT,
     build_full_prompt,
+    build_analysis_inference,
     MCQ_GENERATION_PROMPT,
+    MCQ_SYSTEM_PROMPT,
+    MCQ_SINGLE_PROMPT,
+    MCQ_SINGLE_SYSTEM_PROMPT,
     get_simulated_alert,
 )
 from scenarios import SCENARIOS, get_scenario_list, get_scenario
 from integration import generate_fhir_bundle, generate_api_curl_sample
 from questions import PATIENT_MCQS
+from cpu_topology import get_topology, pin_server_thread
+from engine import ClinicalAIEngine, LOADING_STATES, add_engine_arguments, configure_engine, start_engine
+from engine_client import EngineUnreachable, RemoteEngine
+from constrained import MCQStreamParser, mcq_grammar, mcq_max_tokens, parse_mcq_lines
+from stopping import STOP_REPEAT, STOP_SUMMARY, stop_after_mcq_lines
+from session_store import SESSIONS
+from cancellation import TIMED_OUT, CancelToken, GenerationCancelled
+from admission import OVER_SLO, Overloaded
+from metrics import METRICS
+from priority import KIND_ANALYSIS, KIND_MCQ, classify
 import huggingface_hub
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -47,175 +62,167 @@ DEPARTMENTS = [
     "Geriatrics",
 ]
 
-class ClinicalAIEngine:
-    """Universal loader and interface for clinical AI models."""
-    def __init__(self):
-        self.model = None
-        self.tokenizer = None
-        self.is_simulation = True
-        self.model_name = "None (Simulation Active)"
-        self.device = "cpu"
-        self.load_error: str = ""
-        # Track personalized questions for the final honesty report
-        self.current_personalized_qs = []
-
-    def detect_local_models(self):
-        """Scans ./models/ for compatible transformers models."""
-        models_dir = "./models"
-        if not os.path.exists(models_dir):
-            return []
-        try:
-            return [d for d in os.listdir(models_dir) if os.path.isdir(os.path.join(models_dir, d))]
-        except:
-            return []
+# Singleton Engine
+AI_ENGINE = ClinicalAIEngine()
 
-    def load(self, model_path: str = None):
-        """Loads a model with robust error handling and quantization support."""
-        try:
-            from transformers import AutoModelForCausalLM, AutoTokenizer
-            import torch
+# "sequential": one long MCQ generation; "parallel": one batched row per question (--mcq-mode)
+MCQ_MODE = "sequential"
+# One grammar-bounded question line per parallel row
+MCQ_SINGLE_MAX_TOKENS = mcq_max_tokens(1)
+
+# Gradio queue (--queue-size, --ui-concurrency, --model-concurrency): instant UI handlers
+# run on a wide pool so they never wait behind a generation; model-bound ones on a narrow pool
+QUEUE_MAX_SIZE = 64
+UI_CONCURRENCY = 16
+# 0: as many as the engine decodes side by side (AI_ENGINE.max_concurrency)
+MODEL_CONCURRENCY = 0
+
+def render_engine_status():
+    """Sidebar indicator for the engine readiness state."""
+    state = AI_ENGINE.state
+    if state == "ready":
+        color, bg, title, detail = "var(--c-primary)", "#f0f9f6", "MedGemma Active", AI_ENGINE.model_name
+    elif state in LOADING_STATES:
+        policy = "requests queued" if AI_ENGINE.loading_policy == "queue" else "simulation meanwhile"
+        color, bg = "var(--c-accent-amber)", "#fff7ed"
+        title = f"{'Loading' if state == 'loading' else 'Warming Up'} — {AI_ENGINE.progress}%"
+        detail = f"{AI_ENGINE.progress_message} ({policy})"
+    elif state == "failed":
+        color, bg, title, detail = "var(--c-red)", "var(--c-red-bg)", "Load Failed", AI_ENGINE.load_error[:80]
+    else:
+        color, bg, title, detail = "var(--c-amber)", "#fff7ed", "Awaiting Initialization", "Weights Not Found"
 
-            if not model_path:
-                local_models = self.detect_local_models()
-                if local_models:
-                    model_path = os.path.join("./models", local_models[0])
-                else:
-                    raise FileNotFoundError("MedGemma weights not found in ./models/. Please initialize first.")
+    return f"""
+        <div style="display:flex;align-items:center;gap:10px;padding:10px 14px;background:{bg};border-radius:10px;border:1px solid {color};">
+            <div style="width:12px;height:12px;border-radius:50%;background:{color};box-shadow: 0 0 10px {color}88;"></div>
+            <div>
+                <div style="font-weight:800;font-size:0.9em;color:{color};line-height:1.1;">{title}</div>
+                <div style="font-size:0.75em;color:{color};opacity:0.8;margin-top:2px;">{detail}</div>
+            </div>
+        </div>
+    """
 
-            print(f"[TruthShield] Initializing Intelligence Layer: {model_path}...")
-            start = time.time()
-            
-            # Load tokenizer
-            self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-            
-            # Smart weight loading for CPU vs GPU
-            is_cuda = torch.cuda.is_available()
-            load_device = "cuda" if is_cuda else "cpu"
-            
-            try:
-                # Optimized for CPU execution on 16GB RAM systems - avoid float32 for RAM safety
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    model_path, 
-                    device_map=load_device, 
-                    trust_remote_code=True,
-                    low_cpu_mem_usage=True
-                )
-            except Exception as e:
-                print(f"[TruthShield] Standard load failed, trying auto map: {e}")
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    model_path,
-                    device_map="auto",
-                    trust_remote_code=True
-                )
-            
-            self.device = str(self.model.device)
-            self.model_name = os.path.basename(model_path).replace("-", " ").title()
-            self.is_simulation = False
-            self.load_error = ""
-            
-            elapsed = time.time() - start
-            print(f"[TruthShield] Engine Ready: {self.model_name} activated on {self.device} ({elapsed:.1f}s)")
-            return True, f"Successfully loaded {self.model_name}"
-            
-        except Exception as e:
-            self.load_error = str(e)
-            self.is_simulation = True
-            print(f"[TruthShield] Engine Standby (MedGemma not found): {e}")
-            return False, str(e)
-
-    def run_inference(self, prompt_text, system_msg=SYSTEM_PROMPT, max_tokens=512):
-        """Generic inference wrapper."""
-        if self.is_simulation or not self.model:
-            return None
-            
-        messages = [
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": prompt_text},
-        ]
-        
-        input_text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        inputs = self.tokenizer(input_text, return_tensors="pt").to(self.model.device)
-        
-        import torch
-        # Extreme CPU optimization: Use all cores
-        torch.set_num_threads(os.cpu_count() or 4)
-        
-        with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs, max_new_tokens=max_tokens, 
-                do_sample=False, # Greedy decoding for maximum stability
-                repetition_penalty=1.1, # Reduced for speed
-            )
-        return self.tokenizer.decode(outputs[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+def model_concurrency():
+    """Size of the model-bound event pool: --model-concurrency, else what the engine decodes side by side."""
+    return MODEL_CONCURRENCY or max(1, AI_ENGINE.max_concurrency)
 
-# Singleton Engine
-AI_ENGINE = ClinicalAIEngine()
-
-def load_model(model_path: str):
-    return AI_ENGINE.load(model_path)
+def load_model(model_path: str, draft_model_path: str = None, backend: str = None):
+    return AI_ENGINE.load(model_path, draft_model_path, backend)
 
 def run_inference(survey_text, notes_text, patient_age, visit_type):
     prompt = build_full_prompt(survey_text, notes_text, patient_age, visit_type)
-    return AI_ENGINE.run_inference(prompt)
-
-
-def generate_ai_mcqs(patient_story, is_simulation, count=10):
-    """Generate personalized MCQs using the MedGemma AI engine."""
+    return AI_ENGINE.run_inference(prompt, priority=classify(KIND_ANALYSIS, visit_type))
+
+
+def mcq_topics(count):
+    """One PATIENT_MCQS entry per generated question: distinct categories first, then the rest of the bank."""
+    seen, first, rest = set(), [], []
+    for q in PATIENT_MCQS:
+        (rest if q["category"] in seen else first).append(q)
+        seen.add(q["category"])
+    ordered = first + rest
+    return [ordered[i % len(ordered)] for i in range(count)]
+
+
+def _generate_mcqs_parallel(patient_story, count):
+    """`count` single-question prompts decoded as one padded batch (--mcq-mode parallel)."""
+    topics = mcq_topics(count)
+    prompts = [
+        MCQ_SINGLE_PROMPT.format(patient_story=patient_story, category=q["category"], reference_question=q["question"])
+        for q in topics
+    ]
+    texts = AI_ENGINE.run_inference_batch(
+        prompts, MCQ_SINGLE_SYSTEM_PROMPT, max_tokens=MCQ_SINGLE_MAX_TOKENS, grammar=mcq_grammar(1),
+        priority=classify(KIND_MCQ),
+    )
     output_mcqs = []
+    for text in texts:
+        parsed = parse_mcq_lines(text or "")
+        if parsed and not any(parsed[0][0] == q for q, _ in output_mcqs):
+            output_mcqs.append(parsed[0])
+    return output_mcqs
 
-    # Real Engine Inference Only
-    if not AI_ENGINE.is_simulation:
+
+def _stream_mcqs_sequential(patient_story, count):
+    """One generation listing all questions; each is yielded as soon as its line is complete."""
+    print(f"[TruthShield] Generating {count} AI MCQs for story: {patient_story[:50]}...")
+    parser = MCQStreamParser()
+    # Decoded under the "N. Question | A, B, C" grammar: every line parses, EOS after `count`
+    for piece in AI_ENGINE.run_inference_stream(
+        MCQ_GENERATION_PROMPT.format(patient_story=patient_story),
+        system_msg=MCQ_SYSTEM_PROMPT.format(count=count),
+        max_tokens=600, # Increased for 10 questions
+        grammar=mcq_grammar(count),
+        stop_criteria=[stop_after_mcq_lines(count), STOP_REPEAT],
+        priority=classify(KIND_MCQ),
+    ):
+        yield from parser.feed(piece)
+    yield from parser.close()
+
+
+def stream_ai_mcqs(patient_story, count=10, mode=None, degraded=None):
+    """Yields `count` (question, options) pairs, each as soon as it is available.
+
+    mode: "sequential" (one generation listing all questions, streamed line by
+    line) or "parallel" (one short prompt per question, batched; all arrive
+    together); defaults to --mcq-mode.
+    degraded: optional list; the Overloaded error is appended when admission
+    control refused the generation and the question bank was served instead.
+    With --overload-policy reject, Overloaded is raised instead.
+    """
+    emitted = []
+    mode = mode or MCQ_MODE
+
+    # Real Engine Inference Only (while loading, --loading-policy decides: wait or use the bank)
+    if AI_ENGINE.await_ready():
         try:
-            print(f"[TruthShield] Generating {count} AI MCQs for story: {patient_story[:50]}...")
-            response = AI_ENGINE.run_inference(
-                MCQ_GENERATION_PROMPT.format(patient_story=patient_story),
-                system_msg=f"You are a clinical psychometrician. Generate exactly {count} nuanced questions. One per line.",
-                max_tokens=600 # Increased for 10 questions
-            )
-            
-            if response:
-                print(f"[TruthShield] Received AI Response ({len(response)} chars)")
-                # Robust parsing: Handle newlines or numbered lists
-                raw_lines = response.strip().split("\n")
-                
-                # If everything is on one line, try to split by "QuestionNumber."
-                if len(raw_lines) == 1 and "|" in raw_lines[0]:
-                    import re
-                    # Look for things like "2. ", "3. " to split
-                    split_parts = re.split(r'\d+\.\s+', raw_lines[0])
-                    raw_lines = [p.strip() for p in split_parts if "|" in p]
-
-                for line in raw_lines:
-                    line = line.strip()
-                    if "|" in line:
-                        parts = line.split("|")
-                        if len(parts) == 2:
-                            q_text = parts[0].strip()
-                            # Clean up leading numbers if any (e.g., "1. How...")
-                            import re
-                            q_text = re.sub(r'^\d+\.\s*', '', q_text)
-                            
-                            opts = [o.strip() for o in parts[1].split(",")]
-                            if q_text and len(opts) >= 2:
-                                output_mcqs.append((q_text, opts))
-                    if len(output_mcqs) >= count: 
-                        break
+            if mode == "parallel":
+                print(f"[TruthShield] Generating {count} AI MCQs in parallel for story: {patient_story[:50]}...")
+                ai_mcqs = _generate_mcqs_parallel(patient_story, count)
+            else:
+                ai_mcqs = _stream_mcqs_sequential(patient_story, count)
+            for mcq in ai_mcqs:
+                if len(emitted) >= count:
+                    break
+                emitted.append(mcq)
+                yield mcq
+        except Overloaded as e:
+            if AI_ENGINE.overload_policy == "reject":
+                raise
+            print(f"[TruthShield] MCQ generation refused ({e}); serving the standard question bank")
+            METRICS.incr("admission_degraded")
+            if degraded is not None:
+                degraded.append(e)
+        except EngineUnreachable as e:
+            print(f"[TruthShield] {e}; serving the standard question bank")
         except Exception as e:
             import traceback
             print(f"[TruthShield] MedGemma MCQ Generation failed: {e}")
             traceback.print_exc()
 
-    # Safety Fallback: Use standard clinical set only if AI is initializing
-    if len(output_mcqs) < count:
+    # Safety Fallback: standard clinical set when the AI is unavailable or ran out of token budget
+    for q in PATIENT_MCQS:
+        if len(emitted) >= count:
+            break
         # Fill strictly from the standard clinical question bank
-        for q in PATIENT_MCQS:
-            if len(output_mcqs) < count:
-                if not any(bq[0] == q["question"] for bq in output_mcqs):
-                    output_mcqs.append((q["question"], q["options"]))
+        if not any(bq[0] == q["question"] for bq in emitted):
+            emitted.append((q["question"], q["options"]))
+            yield emitted[-1]
+
+
+def prefill_mcq_story(partial_story, count=10):
+    """Typing-time prefill of the sequential MCQ prompt (debounced by the engine)."""
+    if partial_story.strip() and MCQ_MODE == "sequential":
+        AI_ENGINE.speculative_prefill(
+            MCQ_GENERATION_PROMPT.format(patient_story=partial_story),
+            MCQ_SYSTEM_PROMPT.format(count=count),
+            typed_text=partial_story,
+        )
 
-    return output_mcqs
 
-    return output_mcqs
+def generate_ai_mcqs(patient_story, is_simulation, count=10, mode=None):
+    """Generate personalized MCQs using the MedGemma AI engine (see stream_ai_mcqs)."""
+    return list(stream_ai_mcqs(patient_story, count=count, mode=mode))
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -226,7 +233,48 @@ def generate_ai_mcqs(patient_story, is_simulation, count=10):
 # ─────────────────────────────────────────────────────────────────────────────
 
 
-def analyze_discrepancies(survey_text, clinical_notes, patient_age, visit_type, is_simulation_mode, *mcq_answers):
+def render_status_bar(status, engine=None, ts=None, mode=""):
+    """Analysis status bar: run status, engine readiness and any degradation in effect."""
+    spans = [f"""<span>STATUS: <strong style="color:var(--c-primary);">{status}</strong></span>"""]
+    if engine:
+        spans.append(f"<span>ENGINE: <strong>{engine}</strong></span>")
+    spans.append(f"<span>STATE: <strong>{AI_ENGINE.state.upper()}</strong></span>")
+    spans.append(f"<span>CPU: <strong>{get_topology().short()}</strong></span>")
+    if mode:
+        spans.append(f"""<span>MODE: <strong style="color:var(--c-accent-amber);">{mode}</strong></span>""")
+    if ts:
+        spans.append(f"<span>TIME: <strong>{ts}</strong></span>")
+    return f"""<div class="ts-status-bar">
+        <span style="display:flex;gap:24px;align-items:center;">
+          {"".join(spans)}
+        </span>
+        <span style="font-weight:700; color:var(--c-text-light);">🔒 NONE TRANSMITTED — OFFLINE</span>
+    </div>"""
+
+
+def simulated_alert_for(survey_text, clinical_notes):
+    """Instant simulated alert for the scenario the survey/notes mention (general if none)."""
+    # Robust Detection: Check survey, notes, and scenario list for matches
+    scenario_id = "general"
+    search_blob = (survey_text + " " + clinical_notes).lower()
+
+    for key, s_data in SCENARIOS.items():
+        # Check key, title, and key with spaces
+        if key in search_blob or s_data['title'].lower() in search_blob or key.replace("_", " ") in search_blob:
+            scenario_id = key
+            break
+    return get_simulated_alert(scenario_id)
+
+
+def describe_overload(e):
+    """One sentence on why admission control refused a generation."""
+    if e.reason == OVER_SLO:
+        return f"MedGemma is busy: the estimated wait (~{e.estimated_wait_s:.0f}s) is beyond the response-time target."
+    return "MedGemma is busy: the inference queue is full."
+
+
+def analyze_discrepancies(request: gr.Request, survey_text, clinical_notes, patient_age, visit_type, is_simulation_mode, *mcq_answers):
+    # request comes first: Gradio inserts it at its parameter index, which *mcq_answers would shift
     # Flatten mcq_answers if it's a list of lists (caused by some Gradio versions/interactions)
     flat_answers = []
     for item in mcq_answers:
@@ -242,38 +290,81 @@ def analyze_discrepancies(survey_text, clinical_notes, patient_age, visit_type,
     yield "Analyzing — TruthShield is processing clinical discrepancies…", "", ""
 
     start_time = time.time()
-    
-    # Pre-process MCQs for better model/sim context
-    mcq_summary = ""
-    for i, ans in enumerate(flat_answers):
-        if ans:
-            mcq_summary += f"\n- Q{i+1}: {ans}"
 
     # 1. Check for Simulation/Demo Mode First
     alert = None
     used_model = False
+    degraded = ""
+
+    # 0. Model still loading: hold the request or degrade to simulation per policy
+    if not is_simulation_mode and AI_ENGINE.is_loading():
+        if AI_ENGINE.loading_policy == "queue":
+            yield f"Waiting for MedGemma to finish loading ({AI_ENGINE.progress}%)…", render_status_bar("QUEUED"), ""
+        if not AI_ENGINE.await_ready():
+            is_simulation_mode = True
+            degraded = "SIMULATION — MODEL LOADING"
     
     if is_simulation_mode:
-        # Robust Detection: Check survey, notes, and scenario list for matches
-        scenario_id = "general"
-        search_blob = (survey_text + " " + clinical_notes).lower()
-        
-        for key, s_data in SCENARIOS.items():
-            # Check key, title, and key with spaces
-            if key in search_blob or s_data['title'].lower() in search_blob or key.replace("_", " ") in search_blob:
-                scenario_id = key
-                break
-        
         # Strictly Instant: Never fall back to real model in simulation mode
-        alert = get_simulated_alert(scenario_id)
+        alert = simulated_alert_for(survey_text, clinical_notes)
         used_model = False
     
     # 2. Real AI Path
     elif not AI_ENGINE.is_simulation:
-        full_text = survey_text + "\n\nSTRUCTURED MCQS:" + mcq_summary
-        # Extreme speed target for analysis
-        alert = AI_ENGINE.run_inference(full_text, clinical_notes, max_tokens=200)
-        used_model = (alert is not None)
+        full_text, system_msg = build_analysis_inference(survey_text, clinical_notes, flat_answers)
+        streaming_html = render_status_bar("STREAMING")
+        # Extreme speed target for analysis; render the alert as it is decoded
+        streamed = ""
+        # Clear (or --inference-timeout) fires this token and frees the cores mid-decode
+        cancel = CancelToken()
+        session_id = request.session_hash if request is not None else None
+        SESSIONS.set(session_id, "analysis_cancel", cancel)
+        try:
+            for piece in AI_ENGINE.run_inference_stream(
+                full_text, system_msg, max_tokens=200, decoding="prompt_lookup",
+                stop_criteria=[STOP_SUMMARY, STOP_REPEAT], cancel=cancel,
+                # Acute departments (Emergency, Psychiatry) jump ahead of routine work
+                priority=classify(KIND_ANALYSIS, visit_type),
+            ):
+                streamed += piece
+                yield streamed, streaming_html, ""
+        except GenerationCancelled as e:
+            timed_out = e.reason == TIMED_OUT
+            title = "Analysis Timed Out" if timed_out else "Analysis Cancelled"
+            detail = (
+                f"MedGemma did not finish within the configured limit ({AI_ENGINE.inference_timeout_s:g}s)."
+                if timed_out else "The analysis was stopped before MedGemma finished."
+            )
+            yield (
+                f"### ⏹️ {title}\n{detail} No partial result was recorded. Run the analysis again when ready.",
+                render_status_bar("TIMED OUT" if timed_out else "CANCELLED", ts=datetime.datetime.now().strftime("%H:%M:%S")),
+                "",
+            )
+            return
+        except Overloaded as e:
+            # Refused before decoding (see admission.py): degrade or report, per --overload-policy
+            if AI_ENGINE.overload_policy == "reject":
+                yield (
+                    f"### ⏳ TruthShield Is at Capacity\n{describe_overload(e)} The request was not queued. "
+                    "Please run the analysis again in a moment.",
+                    render_status_bar("REJECTED", ts=datetime.datetime.now().strftime("%H:%M:%S"), mode="OVERLOADED"),
+                    "",
+                )
+                return
+            METRICS.incr("admission_degraded")
+            streamed = simulated_alert_for(survey_text, clinical_notes)
+            degraded = "SIMULATION — OVERLOADED"
+        except EngineUnreachable as e:
+            # The --engine-url daemon went away: degrade like a UI without local weights
+            print(f"[TruthShield] {e}; falling back to simulation")
+            streamed = simulated_alert_for(survey_text, clinical_notes)
+            degraded = "SIMULATION — ENGINE OFFLINE"
+        finally:
+            # Clear after the run ends must not "cancel" finished work; a newer run may own the slot already
+            if SESSIONS.get(session_id, "analysis_cancel") is cancel:
+                SESSIONS.set(session_id, "analysis_cancel", None)
+        alert = streamed if degraded or not AI_ENGINE.is_simulation else None
+        used_model = (alert is not None and not degraded)
 
     # 2. No Fallback allowed - Report Status
     if alert is None:
@@ -289,14 +380,7 @@ def analyze_discrepancies(survey_text, clinical_notes, patient_age, visit_type,
     if "🔴 CRITICAL" in alert:
         alert_class += " alert-critical"
 
-    timer_html = f"""<div class="ts-status-bar">
-        <span style="display:flex;gap:24px;align-items:center;">
-          <span>STATUS: <strong style="color:var(--c-primary);">COMPLETE</strong></span>
-          <span>ENGINE: <strong>{engine}</strong></span>
-          <span>TIME: <strong>{ts}</strong></span>
-        </span>
-        <span style="font-weight:700; color:var(--c-text-light);">🔒 NONE TRANSMITTED — OFFLINE</span>
-    </div>"""
+    timer_html = render_status_bar("COMPLETE", engine=engine, ts=ts, mode=degraded)
 
     yield gr.update(value=alert, elem_classes=[alert_class]), timer_html, fhir_bundle
 
@@ -770,21 +854,9 @@ def create_app():
                         with gr.Column(scale=1):
                             with gr.Group(elem_classes=["ts-glass-panel"]):
                                 gr.HTML("""<div style="font-weight:700;font-size:0.75em;color:var(--c-text-3);text-transform:uppercase;margin-bottom:12px;">Intelligence Status</div>""")
-                                # Professional Status Indicator
-                                is_simulation = AI_ENGINE.is_simulation
-                                status_color = "var(--c-primary)" if not is_simulation else "var(--c-amber)"
-                                status_text = "MedGemma Active" if not is_simulation else "Awaiting Initialization"
-                                status_bg = "#f0f9f6" if not is_simulation else "#fff7ed"
-                                
-                                gr.HTML(f"""
-                                    <div style="display:flex;align-items:center;gap:10px;padding:10px 14px;background:{status_bg};border-radius:10px;border:1px solid {status_color};">
-                                        <div style="width:12px;height:12px;border-radius:50%;background:{status_color};box-shadow: 0 0 10px {status_color}88;"></div>
-                                        <div>
-                                            <div style="font-weight:800;font-size:0.9em;color:{status_color};line-height:1.1;">{status_text}</div>
-                                            <div style="font-size:0.75em;color:{status_color};opacity:0.8;margin-top:2px;">{AI_ENGINE.model_name if not is_simulation else "Weights Not Found"}</div>
-                                        </div>
-                                    </div>
-                                """)
+                                # Professional Status Indicator (refreshed while the engine loads in the background)
+                                engine_status = gr.HTML(render_engine_status())
+                                status_timer = gr.Timer(2.0)
 
                             with gr.Group(elem_classes=["ts-glass-panel"]):
                                 gr.HTML("""<div style="font-weight:700;font-size:0.75em;color:var(--c-text-3);text-transform:uppercase;margin-bottom:8px;">System Control</div>""")
@@ -807,45 +879,74 @@ def create_app():
 """)
 
         # ─── Event Handlers ──────────────────────────────────────────
+        # Concurrency groups: extra model-bound events queue in Gradio (bounded by max_size)
+        # instead of piling onto the engine, while UI events keep their own workers
+        ui_event = dict(concurrency_id="ui", concurrency_limit=UI_CONCURRENCY)
+        model_event = dict(concurrency_id="model", concurrency_limit=model_concurrency())
+
+        # A status poll every 2s per open tab must never take (or be refused) a slot in the bounded queue
+        status_timer.tick(fn=render_engine_status, outputs=[engine_status], queue=False)
         
         # 1. Patient Portal Submission
-        def _handle_story_submission(story):
+        def _handle_story_submission(story, request: gr.Request):
             if not story.strip():
-                return ["""<div style="color:var(--c-red);font-weight:600;margin-top:10px;">⚠️ Please enter your story before proceeding.</div>""", gr.update()] + [gr.update() for _ in range(10)] + [gr.update(), gr.update()]
-            
+                yield ["""<div style="color:var(--c-red);font-weight:600;margin-top:10px;">⚠️ Please enter your story before proceeding.</div>""", gr.update()] + [gr.update() for _ in range(10)] + [gr.update(), gr.update()]
+                return
+
+            # Show the survey right away; each radio fills in as its question is decoded
+            generating_html = """<div style="color:var(--c-primary);font-weight:600;margin-top:10px;animation:ts-blink 1.5s infinite;">⏳ MedGemma is personalizing your survey — you can start answering the first questions now.</div>"""
+            yield (
+                [generating_html, gr.update(visible=True)]
+                + [gr.update(label=f"Scanning {i+1}...", choices=[], value=None, visible=True) for i in range(10)]
+                + [gr.update(visible=False), gr.update()]
+            )
+
             # Requesting 10 questions for "Crystal Clear" diagnostic clarity
-            new_qs = generate_ai_mcqs(story, False, count=10)
-            updates = []
-            for i in range(10):
-                if i < len(new_qs):
-                    q_text, opts = new_qs[i]
-                    updates.append(gr.update(label=q_text, choices=opts, value=None, visible=True))
-                else:
-                    updates.append(gr.update(visible=False))
-            
-            AI_ENGINE.current_personalized_qs = new_qs
-            
-            status_html = """<div style="color:var(--c-primary);font-weight:600;margin-top:10px;">✨ Story Processed. MedGemma has generated a 10-point diagnostic survey below.</div>"""
+            new_qs = []
+            degraded = []
+            # Per browser session: concurrent patients each keep their own survey
+            SESSIONS.set(request.session_hash, "personalized_qs", new_qs)
+            try:
+                for q_text, opts in stream_ai_mcqs(story, count=10, degraded=degraded):
+                    new_qs.append((q_text, opts))
+                    # gr.update() leaves already-shown questions (and their answers) untouched
+                    updates = [gr.update() for _ in range(10)]
+                    updates[len(new_qs) - 1] = gr.update(label=q_text, choices=opts, value=None, visible=True)
+                    yield [gr.update(), gr.update()] + updates + [gr.update(), gr.update()]
+            except Overloaded as e:
+                # --overload-policy reject: nothing was queued; the story stays for a retry
+                busy_html = f"""<div style="color:var(--c-amber);font-weight:600;margin-top:10px;">⏳ {describe_overload(e)} Please submit your story again in a moment.</div>"""
+                yield [busy_html, gr.update(visible=False)] + [gr.update(visible=False) for _ in range(10)] + [gr.update(visible=True), gr.update()]
+                return
+
+            updates = [gr.update() if i < len(new_qs) else gr.update(visible=False) for i in range(10)]
+            if degraded:
+                status_html = f"""<div style="color:var(--c-amber);font-weight:600;margin-top:10px;">⚡ {describe_overload(degraded[0])} Your survey uses our standard 10-point clinical questions instead.</div>"""
+            else:
+                status_html = """<div style="color:var(--c-primary);font-weight:600;margin-top:10px;">✨ Story Processed. MedGemma has generated a 10-point diagnostic survey below.</div>"""
             # We don't know the department for manual entry unless AI predicts it, let's keep it 'General Medicine'
             dept_html = """<div style="display:inline-flex; align-items:center; gap:8px; padding:6px 12px; background:#e0f2f7; border:1px solid var(--c-primary); border-radius:30px; font-size:0.7em; font-weight:800; color:var(--c-primary); letter-spacing:0.05em; margin-bottom:16px;"><span style="width:6px;height:6px;background:var(--c-primary);border-radius:50%;"></span> DEPARTMENT: GENERAL MEDICINE</div>"""
-            return [status_html, gr.update(visible=True)] + updates + [gr.update(visible=False), gr.update(value=dept_html, visible=True)]
+            yield [status_html, gr.update()] + updates + [gr.update(), gr.update(value=dept_html, visible=True)]
 
         submit_story_btn.click(
             fn=_handle_story_submission,
             inputs=[patient_survey_input],
-            outputs=[patient_status, mcq_survey_group] + mcq_components + [patient_initial_actions, department_display]
+            outputs=[patient_status, mcq_survey_group] + mcq_components + [patient_initial_actions, department_display],
+            **model_event,
         )
 
-        def _submit_patient_data(survey, *mcqs):
+        # gr.Request comes first: Gradio inserts it at its parameter index, which *mcqs would shift
+        def _submit_patient_data(request: gr.Request, survey, *mcqs):
             if not survey.strip():
                 return """<div style="color:var(--c-red);font-weight:600;margin-top:10px;">⚠️ Please enter some text before submitting.</div>""", gr.update()
             
             # Combine MCQ data for the clinician's hidden textbox
+            personalized_qs = SESSIONS.get(request.session_hash, "personalized_qs", [])
             mcq_summary = "\n\n--- STRUCTURED CLINICAL SURVEY ---\n"
             for i, val in enumerate(mcqs):
                 # Use personalized question if available, otherwise fallback to static
-                if AI_ENGINE.current_personalized_qs and i < len(AI_ENGINE.current_personalized_qs):
-                    q = AI_ENGINE.current_personalized_qs[i][0]
+                if personalized_qs and i < len(personalized_qs):
+                    q = personalized_qs[i][0]
                 else:
                     q = PATIENT_MCQS[i]["question"]
                 mcq_summary += f"{i+1}. {q} → {val if val else 'No answer'}\n"
@@ -856,10 +957,24 @@ def create_app():
         submit_final_btn.click(
             fn=_submit_patient_data,
             inputs=[patient_survey_input] + mcq_components,
-            outputs=[patient_status, survey_input]
+            outputs=[patient_status, survey_input],
+            **ui_event,
         )
         
-        def _clear_patient_portal():
+        # While the patient types, the MCQ prompt is prefilled so submit only prefills the tail
+        patient_survey_input.change(
+            fn=prefill_mcq_story,
+            inputs=[patient_survey_input],
+            outputs=None,
+            trigger_mode="always_last",
+            show_progress="hidden",
+            # Only schedules the debounced prefill; the engine does the work off the event thread
+            **ui_event,
+        )
+
+        def _clear_patient_portal(request: gr.Request):
+            AI_ENGINE.cancel_prefill()
+            SESSIONS.drop(request.session_hash)
             return (
                 ["", ""] + 
                 [None] * 5 + 
@@ -868,7 +983,8 @@ def create_app():
 
         clear_patient_btn.click(
             fn=_clear_patient_portal,
-            outputs=[patient_survey_input, patient_status] + mcq_components + [mcq_survey_group, patient_initial_actions]
+            outputs=[patient_survey_input, patient_status] + mcq_components + [mcq_survey_group, patient_initial_actions],
+            **ui_event,
         )
 
         # 3. Model Management
@@ -917,13 +1033,17 @@ def create_app():
         download_btn.click(
             fn=_handle_model_setup,
             inputs=[hf_token_input],
-            outputs=[setup_output]
+            outputs=[setup_output],
+            # Download + quantize + load: one at a time, outside both pools
+            concurrency_id="model_setup",
+            concurrency_limit=1,
         )
         # 4. Clinical Logic
-        analyze_btn.click(
+        analyze_event = analyze_btn.click(
             fn=analyze_discrepancies,
             inputs=[survey_input, notes_input, patient_age, visit_type, sim_mode_toggle] + mcq_components,
             outputs=[alert_output, timer_display, fhir_output],
+            **model_event,
         )
 
         def _load_demo_scenario(scenario_id):
@@ -956,13 +1076,13 @@ def create_app():
             ]
             return updates
 
-        demo_cyber.click(fn=lambda: _load_demo_scenario("cyberbullying"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display])
-        demo_burnout.click(fn=lambda: _load_demo_scenario("caregiver_burnout"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display])
-        demo_grief.click(fn=lambda: _load_demo_scenario("hidden_grief"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display])
-        demo_safety.click(fn=lambda: _load_demo_scenario("domestic_violence"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display])
-        demo_veteran.click(fn=lambda: _load_demo_scenario("veteran_trauma"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display])
-        demo_finance.click(fn=lambda: _load_demo_scenario("financial_fraud"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display])
-        demo_sexual.click(fn=lambda: _load_demo_scenario("sexual_health"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display])
+        demo_cyber.click(fn=lambda: _load_demo_scenario("cyberbullying"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display], **ui_event)
+        demo_burnout.click(fn=lambda: _load_demo_scenario("caregiver_burnout"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display], **ui_event)
+        demo_grief.click(fn=lambda: _load_demo_scenario("hidden_grief"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display], **ui_event)
+        demo_safety.click(fn=lambda: _load_demo_scenario("domestic_violence"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display], **ui_event)
+        demo_veteran.click(fn=lambda: _load_demo_scenario("veteran_trauma"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display], **ui_event)
+        demo_finance.click(fn=lambda: _load_demo_scenario("financial_fraud"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display], **ui_event)
+        demo_sexual.click(fn=lambda: _load_demo_scenario("sexual_health"), outputs=[patient_survey_input, patient_age, visit_type, notes_input, sim_mode_toggle] + mcq_components + [patient_status, mcq_survey_group, patient_initial_actions, department_display], **ui_event)
 
         def _simulate_ehr_sync(fhir):
             if not fhir:
@@ -971,38 +1091,71 @@ def create_app():
             bundle_id = json.loads(fhir).get("id")
             return f"""<div style="padding:14px 18px;border-radius:12px;margin-top:12px;background:var(--c-primary-soft);border:1px solid var(--c-border);font-size:0.85em;color:var(--c-primary);font-weight:600;">✅ HL7 FHIR Bundle transmitted to Hospital EHR.<br><code style="font-size:0.9em;">Bundle ID: {bundle_id}</code></div>"""
 
-        sync_btn.click(fn=_simulate_ehr_sync, inputs=[fhir_output], outputs=[sync_status])
+        sync_btn.click(fn=_simulate_ehr_sync, inputs=[fhir_output], outputs=[sync_status], **ui_event)
+
+        def _clear_dashboard(request: gr.Request):
+            # Stops a running analysis between decode steps; `cancels` drops its Gradio event
+            running = SESSIONS.get(request.session_hash, "analysis_cancel")
+            status_html = """<div class="ts-status-bar">STATUS: AWAITING ANALYSIS</div>"""
+            if running is not None and running.reason is None:
+                running.cancel()
+                status_html = render_status_bar("CANCELLED", ts=datetime.datetime.now().strftime("%H:%M:%S"))
+            return "", "", "", "", "*Submit the patient survey above to generate a clinical analysis.*", "", status_html
 
         clear_btn.click(
-            fn=lambda: ("", "", "", "", "*Submit the patient survey above to generate a clinical analysis.*", ""),
-            outputs=[survey_input, notes_input, patient_age, visit_type, alert_output, sync_status],
+            fn=_clear_dashboard,
+            outputs=[survey_input, notes_input, patient_age, visit_type, alert_output, sync_status, timer_display],
+            cancels=[analyze_event],
+            **ui_event,
         )
 
+    # Full queue: new events are refused at once rather than waiting out the browser
+    app.queue(max_size=QUEUE_MAX_SIZE or None, default_concurrency_limit=UI_CONCURRENCY)
     return app
 
 
+def portal_handlers(demo):
+    """The patient-portal event functions of an app built by create_app(), by name.
+
+    Lets benchmark.py and the tests drive the portal without a browser.
+    """
+    fns = demo.fns.values() if isinstance(demo.fns, dict) else demo.fns
+    return {f.fn.__name__: f.fn for f in fns if getattr(f, "fn", None) is not None}
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Entry point
 # ─────────────────────────────────────────────────────────────────────────────
 def main():
     parser = argparse.ArgumentParser(description="TruthShield Clinical Intelligence Platform")
-    parser.add_argument("--model-path", type=str, default=None, help="Path to AWQ-quantized MedGemma model")
     parser.add_argument("--port", type=int, default=7860, help="Server port (default: 7860)")
     parser.add_argument("--share", action="store_true", help="Create public Gradio link")
+    parser.add_argument("--mcq-mode", type=str, default="sequential", choices=["sequential", "parallel"], help="Personalized MCQs: one long generation, or one batched prompt per question")
+    parser.add_argument("--session-ttl", type=float, default=3600.0, help="Seconds an idle patient-portal session keeps its personalized survey (default: 3600)")
+    parser.add_argument("--max-sessions", type=int, default=1000, help="Patient-portal sessions kept in memory; least recently used are evicted (default: 1000)")
+    parser.add_argument("--queue-size", type=int, default=64, help="Gradio events waiting at once; more are refused (0: unbounded)")
+    parser.add_argument("--ui-concurrency", type=int, default=16, help="Workers for instant UI handlers (demo scenarios, clear, sync)")
+    parser.add_argument("--model-concurrency", type=int, default=0, help="Analyses/MCQ generations run at once (default: what the engine decodes side by side)")
+    parser.add_argument("--engine-url", type=str, default=None, help="Use a running inference_server.py (e.g. http://127.0.0.1:8765) instead of loading MedGemma in this process")
+    add_engine_arguments(parser)
     args = parser.parse_args()
 
-    if args.model_path:
-        load_model(args.model_path)
+    global AI_ENGINE, MCQ_MODE, QUEUE_MAX_SIZE, UI_CONCURRENCY, MODEL_CONCURRENCY
+    MCQ_MODE = args.mcq_mode
+    QUEUE_MAX_SIZE = max(0, args.queue_size)
+    UI_CONCURRENCY = max(1, args.ui_concurrency)
+    MODEL_CONCURRENCY = max(0, args.model_concurrency)
+    SESSIONS.configure(ttl_s=args.session_ttl, max_sessions=args.max_sessions)
+    if args.engine_url:
+        # Thin client: the daemon owns the weights, this process only serves the UI
+        AI_ENGINE = RemoteEngine(args.engine_url)
+        print(f"[TruthShield] Using inference server at {args.engine_url} ({AI_ENGINE.state})")
     else:
-        # Auto-detect and load any synchronized model
-        print("[TruthShield] Scanning for local AI weights...")
-        success, msg = AI_ENGINE.load()
-        if success:
-            print(f"[TruthShield] Automatic Initialization: {msg}")
-        else:
-            print(f"[TruthShield] No local weights found: {msg}")
-            print("[TruthShield] Starting in Simulation Mode. Use 'Model Management' to sync MedGemma.\n")
+        configure_engine(AI_ENGINE, args)
+        start_engine(AI_ENGINE, args)
 
+    # Gradio/uvicorn threads spawned from here on inherit the server cores
+    pin_server_thread()
     app = create_app()
     # Note: server_name set to "localhost" per user security preference for offline use
     print(f"\n[TruthShield] Server starting at http://localhost:{args.port}\n")
@@ -1013,6 +1166,8 @@ def main():
         show_error=True,
         favicon_path=None,
         inbrowser=True,
+        # Enough worker threads for both pools plus the one-off model setup
+        max_threads=max(40, UI_CONCURRENCY + model_concurrency() + 1),
     )
 
 
@@ -0,0 +1,56 @@
+"""
+TruthShield — Lightweight In-Process Metrics
+
+Thread-safe counters and rolling samples for the inference engine
+(batch sizes, queue wait, cache hits, ...). Kept dependency-free so the
+UI-only HF Spaces build can import it without torch.
+"""
+
+import threading
+from collections import deque
+
+
+class MetricsRegistry:
+    """Named counters plus rolling windows of recent observations."""
+
+    def __init__(self, window: int = 256):
+        self._lock = threading.Lock()
+        self._window = window
+        self._counters = {}
+        self._samples = {}
+
+    def incr(self, name: str, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            if name not in self._samples:
+                self._samples[name] = deque(maxlen=self._window)
+            self._samples[name].append(value)
+            self._counters[name + "_count"] = self._counters.get(name + "_count", 0) + 1
+
+    def get(self, name: str, default=0):
+        with self._lock:
+            return self._counters.get(name, default)
+
+    def mean(self, name: str, default=0.0):
+        with self._lock:
+            samples = self._samples.get(name)
+            if not samples:
+                return default
+            return sum(samples) / len(samples)
+
+    def snapshot(self):
+        """Returns counters and the mean/max of each rolling window."""
+        with self._lock:
+            snap = dict(self._counters)
+            for name, samples in self._samples.items():
+                if samples:
+                    snap[name + "_mean"] = sum(samples) / len(samples)
+                    snap[name + "_max"] = max(samples)
+            return snap
+
+
+# Process-wide registry shared by the engine, scheduler and UI
+METRICS = MetricsRegistry()
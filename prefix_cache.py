@@ -0,0 +1,126 @@
+"""
+TruthShield — Shared-Prefix KV Cache
+
+Every request starts with the same system message (SYSTEM_PROMPT, or the
+fixed psychometrician instruction for MCQ generation) wrapped in the chat
+template. The past-key-values for each distinct prefix are computed once and
+copied into later requests, so only the user-specific suffix is prefilled.
+
+SpeculativePrefill goes one step further for the patient story: while it is
+still being typed, its prompt is prefilled in the background, so on submit
+only the last few tokens remain.
+"""
+
+import copy
+import threading
+from collections import OrderedDict
+
+from metrics import METRICS
+
+
+def common_prefix_len(a, b) -> int:
+    """Number of leading token ids shared by two sequences."""
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class PrefixKVCache:
+    """LRU of (prefix token ids, past-key-values) keyed by the rendered prefix text."""
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_build(self, key: str, prefix_ids, build_fn):
+        """Returns the cached entry for key, running build_fn(prefix_ids) on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = (tuple(prefix_ids), build_fn(list(prefix_ids)))
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        METRICS.incr("prefix_cache_builds")
+        return entry
+
+    def reuse(self, entry, input_ids):
+        """Copies an entry's cache for one request, cropped to the tokens it shares with input_ids.
+
+        Returns (past_key_values, reused_tokens), or (None, 0) when nothing usable is shared.
+        At least one input token is always left for the model to prefill.
+        """
+        prefix_ids, cache = entry
+        n = min(common_prefix_len(prefix_ids, input_ids), len(input_ids) - 1)
+        if n <= 0:
+            return None, 0
+
+        past = copy.deepcopy(cache)
+        if n < len(prefix_ids):
+            past.crop(n)
+        METRICS.incr("prefix_cache_hits")
+        METRICS.incr("prefix_tokens_reused", n)
+        return past, n
+
+
+class SpeculativePrefill:
+    """One growing KV entry for a prompt that is still being typed.
+
+    Each advance() call prefills at most chunk_tokens more of the target ids;
+    if the text was edited before the cached end, the cache is first cropped
+    back to the tokens it still shares. Callers hold the model lock per call,
+    so a real request never waits for more than one chunk.
+    """
+
+    def __init__(self, max_tokens: int = 1024, chunk_tokens: int = 32):
+        self.max_tokens = max_tokens
+        self.chunk_tokens = chunk_tokens
+        self.ids = []
+        self.cache = None
+
+    def clear(self):
+        self.ids, self.cache = [], None
+
+    def entry(self):
+        """(ids, past-key-values) in the PrefixKVCache entry format, or None."""
+        return (tuple(self.ids), self.cache) if self.ids else None
+
+    def advance(self, target_ids, new_cache_fn, forward_fn) -> int:
+        """Prefills the next chunk toward target_ids; returns the tokens added (0 when caught up)."""
+        target_ids = target_ids[:self.max_tokens]
+        shared = common_prefix_len(self.ids, target_ids)
+        if self.cache is None:
+            self.cache, self.ids = new_cache_fn(), []
+        elif shared < len(self.ids):
+            # Diverged (an edit or a re-tokenized last word): drop the stale tail
+            METRICS.incr("speculative_prefill_discarded_tokens", len(self.ids) - shared)
+            if shared:
+                self.cache.crop(shared)
+                self.ids = self.ids[:shared]
+            else:
+                self.cache, self.ids = new_cache_fn(), []
+
+        chunk = target_ids[len(self.ids):len(self.ids) + self.chunk_tokens]
+        if not chunk:
+            return 0
+        try:
+            forward_fn(chunk, self.cache)
+        except Exception:
+            # A partially extended cache no longer matches self.ids
+            self.clear()
+            raise
+        self.ids.extend(chunk)
+        METRICS.incr("speculative_prefill_tokens", len(chunk))
+        return len(chunk)
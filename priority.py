@@ -0,0 +1,172 @@
+"""
+TruthShield — Request Priorities with Aging
+
+Generations used to reach the model in arrival order, so an Emergency
+Medicine analysis could sit behind a run of routine MCQ generations. Each
+request now carries a priority class derived from its kind and department:
+
+    critical — analysis for an acute department (Emergency, Psychiatry)
+    high     — any other analysis
+    normal   — untagged calls (warmup, daemon clients without a priority)
+    low      — patient MCQ generation
+
+Both places where requests wait are priority-ordered: the scheduler queue
+(batching.py), which blocking and streamed generations share, and the
+backend's model lock (PriorityLock below), where scheduler batches contend
+with warmup and typing-time prefill for the cores.
+
+Aging keeps low classes from starving: each class step is worth aging_s
+seconds of waiting, so a request's position is level * aging_s + enqueued_at.
+That key never changes while the request waits, so a plain heap stays
+correctly ordered. The time from enqueue to holding the model lock is
+recorded per class as the queue_wait_<class>_s metric.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import METRICS
+
+PRIORITY_CLASSES = ("critical", "high", "normal", "low")
+DEFAULT_CLASS = "normal"
+
+KIND_ANALYSIS = "analysis"
+KIND_MCQ = "mcq"
+
+# DEPARTMENTS (main.py) whose patients cannot wait; matched by keyword because
+# visit types are free text ("Emergency Medicine / Social Work", "Psychiatry / VA Care")
+ACUTE_DEPARTMENTS = {
+    "Emergency Medicine": ("emergency",),
+    "Psychiatry & Behavioral Health": ("psychiatr", "behavioral"),
+}
+
+# Seconds of waiting that make up for one class step (--priority-aging)
+AGING_S = 15.0
+
+
+def configure(aging_s: float = None):
+    global AGING_S
+    if aging_s is not None:
+        AGING_S = max(0.0, float(aging_s))
+
+
+def is_acute(department) -> bool:
+    text = (department or "").lower()
+    return any(k in text for keywords in ACUTE_DEPARTMENTS.values() for k in keywords)
+
+
+def classify(kind: str = None, department: str = None) -> str:
+    """Priority class for a request of this kind ("analysis", "mcq") from this department/visit type."""
+    if kind == KIND_ANALYSIS:
+        return "critical" if is_acute(department) else "high"
+    if kind == KIND_MCQ:
+        return "low"
+    return DEFAULT_CLASS
+
+
+def level(priority) -> int:
+    """0 for critical … 3 for low; unknown classes rank as normal."""
+    try:
+        return PRIORITY_CLASSES.index(priority)
+    except ValueError:
+        return PRIORITY_CLASSES.index(DEFAULT_CLASS)
+
+
+def sort_key(priority, enqueued_at: float) -> float:
+    """Position in a priority queue with aging; lower runs first."""
+    return level(priority) * AGING_S + enqueued_at
+
+
+class PriorityContext:
+    """The waiting rows (priority class, enqueue time) on whose behalf a thread takes the model lock."""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.recorded = False
+
+    @classmethod
+    def now(cls, priority):
+        return cls([(priority or DEFAULT_CLASS, time.time())])
+
+    @property
+    def key(self) -> float:
+        return min(sort_key(p, t) for p, t in self.rows)
+
+    def record_wait(self, granted_at: float):
+        """Observes each row's queue wait, once: later lock holds for the same rows are decode, not wait."""
+        if self.recorded:
+            return
+        self.recorded = True
+        for p, t in self.rows:
+            METRICS.observe(f"queue_wait_{p}_s", granted_at - t)
+
+
+_local = threading.local()
+
+
+def current_priority():
+    """The PriorityContext bound to this thread, or None."""
+    return getattr(_local, "context", None)
+
+
+@contextmanager
+def priority_scope(context):
+    """Binds context to this thread; model-lock acquisitions inside wait in its place."""
+    previous = current_priority()
+    _local.context = context
+    try:
+        yield context
+    finally:
+        _local.context = previous
+
+
+class PriorityLock:
+    """Drop-in for threading.Lock that grants waiters by (aged) priority instead of at random.
+
+    The waiting thread's place comes from its current_priority(); threads
+    without one queue as normal, from the moment they ask.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._held = False
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        context = current_priority()
+        with self._cond:
+            if not self._held and not self._waiting:
+                self._held = True
+            elif not blocking:
+                return False
+            else:
+                key = context.key if context is not None and context.rows else sort_key(DEFAULT_CLASS, time.time())
+                entry = (key, next(self._seq))
+                heapq.heappush(self._waiting, entry)
+                while self._held or self._waiting[0] != entry:
+                    self._cond.wait()
+                heapq.heappop(self._waiting)
+                self._held = True
+        if context is not None:
+            context.record_wait(time.time())
+        return True
+
+    def release(self):
+        with self._cond:
+            self._held = False
+            self._cond.notify_all()
+
+    def locked(self) -> bool:
+        with self._cond:
+            return self._held
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -37,6 +37,7 @@ For each discrepancy found, provide ONLY:
 5. **Approach**: (Short MI opener)
 
 Keep the entire output under 150 tokens.
+End with one line: "Summary: X discrepancies detected (Y critical, Z high, W moderate)."
 """
 
 
@@ -64,7 +65,7 @@ Generate the alert now. Begin with the highest-severity item. For each item incl
 • Suggested approach: "[exact words the clinician could say]"
 • Clinical reasoning: [one sentence on why this matters]
 
-End with a summary line: "X discrepancies detected (Y critical, Z high, W moderate)."
+End with one line: "Summary: X discrepancies detected (Y critical, Z high, W moderate)."
 """
 
 
@@ -92,6 +93,25 @@ Generate 10 SHORT clinical MCQs now.
 """
 
 
+# System message paired with MCQ_GENERATION_PROMPT
+MCQ_SYSTEM_PROMPT = "You are a clinical psychometrician. Generate exactly {count} nuanced questions. One per line."
+
+# Parallel MCQ mode: one short prompt per question, each on its own clinical category
+MCQ_SINGLE_PROMPT = """Based on the following patient story, write ONE deep clinical screening question about {category} that could reveal a masked truth or discrepancy.
+
+## Patient Story
+{patient_story}
+
+## Reference Question (same topic, do not copy)
+{reference_question}
+
+## Format
+1. [Question] | [Opt1], [Opt2], [Opt3]
+"""
+
+MCQ_SINGLE_SYSTEM_PROMPT = "You are a clinical psychometrician. Generate exactly one concise question on one line."
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # SIMULATION PROMPT — For instant demo mode
 # ─────────────────────────────────────────────────────────────────────────────
@@ -253,6 +273,21 @@ def build_full_prompt(survey_responses: str, clinical_notes: str,
     return user_prompt
 
 
+def build_analysis_inference(survey_text: str, clinical_notes: str, flat_answers=()) -> tuple:
+    """Prompt and system message sent to MedGemma for a discrepancy analysis.
+
+    The system message is always SYSTEM_PROMPT, so every analysis reuses the
+    same cached preamble; the patient's survey, MCQ answers and notes all go
+    in the user turn.
+    """
+    mcq_summary = ""
+    for i, ans in enumerate(flat_answers):
+        if ans:
+            mcq_summary += f"\n- Q{i+1}: {ans}"
+    survey = survey_text + "\n\nSTRUCTURED MCQS:" + mcq_summary
+    return build_full_prompt(survey, clinical_notes), SYSTEM_PROMPT
+
+
 def build_alert_prompt(discrepancy_analysis: str,
                        patient_age: str = "Unknown",
                        visit_type: str = "Routine") -> str:
@@ -0,0 +1,220 @@
+"""
+TruthShield — Pre-Quantized, Memory-Mappable Model Artifact
+
+setup_model.py --prequantize converts the downloaded weights once, offline:
+every language-model nn.Linear is stored as int8 (per-output-channel scales)
+or packed int4 (group-wise scales) and the whole state dict is written as a
+single torch zip file next to a manifest.
+
+At startup the engine builds the model skeleton on the meta device, swaps in
+QuantizedLinear modules and maps the file with torch.load(mmap=True), so no
+parameter is materialized or converted at load time. Pages are faulted in
+lazily, which keeps peak RSS close to the quantized size on 16 GB machines.
+
+Layout:
+    <weights>/prequantized/truthshield_manifest.json
+    <weights>/prequantized/model.int8.pt   (or model.int4.pt)
+"""
+
+import datetime
+import json
+import os
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+ARTIFACT_DIRNAME = "prequantized"
+MANIFEST_NAME = "truthshield_manifest.json"
+FORMAT_VERSION = 1
+
+# Kept in full precision: tied output head and the multimodal front-end
+SKIP_MODULES = ("lm_head", "vision", "multi_modal_projector")
+
+
+def find_artifact(model_path: str):
+    """Returns the artifact directory for a weights path, or None."""
+    for candidate in (model_path, os.path.join(model_path, ARTIFACT_DIRNAME)):
+        if os.path.exists(os.path.join(candidate, MANIFEST_NAME)):
+            return candidate
+    return None
+
+
+def read_manifest(artifact_dir: str) -> dict:
+    with open(os.path.join(artifact_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Quantization kernels
+# ─────────────────────────────────────────────────────────────────────────────
+
+def quantize_int8(weight):
+    """Symmetric per-output-channel int8. Returns (qweight[N, K] int8, scales[N])."""
+    w = weight.float()
+    scales = (w.abs().amax(dim=1) / 127.0).clamp(min=1e-8)
+    q = torch.round(w / scales[:, None]).clamp(-127, 127).to(torch.int8)
+    return q, scales.to(weight.dtype)
+
+
+def quantize_int4(weight, group_size: int):
+    """Symmetric group-wise int4 packed two per byte. Returns (qweight[N, K/2] uint8, scales[N, K/group])."""
+    w = weight.float()
+    n, k = w.shape
+    groups = w.reshape(n, k // group_size, group_size)
+    scales = (groups.abs().amax(dim=2) / 7.0).clamp(min=1e-8)
+    q = torch.round(groups / scales[:, :, None]).clamp(-8, 7).to(torch.int8).reshape(n, k)
+    q = (q + 8).to(torch.uint8)
+    packed = q[:, 0::2] | (q[:, 1::2] << 4)
+    return packed, scales.to(weight.dtype)
+
+
+class QuantizedLinear(nn.Module):
+    """Linear layer whose weight stays quantized in (memory-mapped) storage."""
+
+    def __init__(self, in_features, out_features, bias, bits, group_size, dtype, device="meta"):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.bits = bits
+        self.group_size = group_size
+        if bits == 8:
+            self.register_buffer("qweight", torch.empty(out_features, in_features, dtype=torch.int8, device=device))
+            self.register_buffer("scales", torch.empty(out_features, dtype=dtype, device=device))
+        else:
+            self.register_buffer("qweight", torch.empty(out_features, in_features // 2, dtype=torch.uint8, device=device))
+            self.register_buffer("scales", torch.empty(out_features, in_features // group_size, dtype=dtype, device=device))
+        self.bias = nn.Parameter(torch.empty(out_features, dtype=dtype, device=device)) if bias else None
+
+    def dequantize(self, dtype):
+        if self.bits == 8:
+            return self.qweight.to(dtype) * self.scales.to(dtype)[:, None]
+        low = (self.qweight & 0x0F).to(torch.int8) - 8
+        high = (self.qweight >> 4).to(torch.int8) - 8
+        q = torch.stack((low, high), dim=-1).reshape(self.out_features, self.in_features)
+        groups = q.reshape(self.out_features, -1, self.group_size).to(dtype)
+        return (groups * self.scales.to(dtype)[:, :, None]).reshape(self.out_features, self.in_features)
+
+    def forward(self, x):
+        if self.bits == 8 and x.device.type == "cpu" and hasattr(torch, "_weight_int8pack_mm"):
+            # Fused int8 weight-only matmul; the int8 matrix is never expanded
+            flat = x.reshape(-1, self.in_features)
+            out = torch._weight_int8pack_mm(flat, self.qweight, self.scales.to(x.dtype))
+            out = out.reshape(*x.shape[:-1], self.out_features)
+            return out + self.bias if self.bias is not None else out
+        return F.linear(x, self.dequantize(x.dtype), self.bias)
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, bits={self.bits}"
+
+
+def _quantizable(name: str, module, bits: int, group_size: int) -> bool:
+    if not isinstance(module, nn.Linear) or any(s in name for s in SKIP_MODULES):
+        return False
+    return bits == 8 or module.in_features % group_size == 0
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Build (offline) / load (startup)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def build_artifact(model_path: str, bits: int = 8, group_size: int = 128, dtype=torch.bfloat16) -> str:
+    """Quantizes the weights in model_path and writes <model_path>/prequantized/."""
+    from transformers import AutoModelForCausalLM
+    from inference_cache import model_fingerprint
+
+    if bits not in (4, 8):
+        raise ValueError("bits must be 8 or 4")
+
+    out_dir = os.path.join(model_path, ARTIFACT_DIRNAME)
+    os.makedirs(out_dir, exist_ok=True)
+    model = AutoModelForCausalLM.from_pretrained(
+        model_path, torch_dtype=dtype, low_cpu_mem_usage=True, trust_remote_code=True
+    )
+
+    quantized = []
+    tensors = {}
+    for name, module in model.named_modules():
+        if not _quantizable(name, module, bits, group_size):
+            continue
+        with torch.no_grad():
+            if bits == 8:
+                qweight, scales = quantize_int8(module.weight)
+            else:
+                qweight, scales = quantize_int4(module.weight, group_size)
+        tensors[f"{name}.qweight"] = qweight
+        tensors[f"{name}.scales"] = scales
+        # Release the full-precision copy right away to bound peak memory
+        module.weight = nn.Parameter(torch.empty(0, dtype=dtype), requires_grad=False)
+        quantized.append(name)
+
+    quantized_weights = {f"{n}.weight" for n in quantized}
+    for key, value in model.state_dict().items():
+        if key not in quantized_weights:
+            tensors[key] = value.contiguous()
+
+    weights_file = f"model.int{bits}.pt"
+    weights_path = os.path.join(out_dir, weights_file)
+    torch.save(tensors, weights_path)
+
+    manifest = {
+        "format": "truthshield-prequantized",
+        "version": FORMAT_VERSION,
+        "bits": bits,
+        "group_size": group_size if bits == 4 else None,
+        "dtype": str(dtype).replace("torch.", ""),
+        "architecture": (model.config.architectures or [type(model).__name__])[0],
+        "source_fingerprint": model_fingerprint(model_path),
+        "weights_file": weights_file,
+        "weights_bytes": os.path.getsize(weights_path),
+        "num_tensors": len(tensors),
+        "quantized_modules": quantized,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z"),
+    }
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return out_dir
+
+
+def load_artifact(model_path: str, artifact_dir: str):
+    """Builds the model on the meta device and maps the pre-quantized weights into it."""
+    from accelerate import init_empty_weights
+    from transformers import AutoConfig, AutoModelForCausalLM
+    from inference_cache import model_fingerprint
+
+    manifest = read_manifest(artifact_dir)
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact version {manifest.get('version')}; re-run setup_model.py --prequantize")
+    if manifest.get("source_fingerprint") != model_fingerprint(model_path):
+        raise ValueError("Pre-quantized artifact is stale (source weights changed); re-run setup_model.py --prequantize")
+
+    start = time.time()
+    dtype = getattr(torch, manifest["dtype"])
+    config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+    # Parameters on meta, buffers (e.g. rotary tables) real: nothing is allocated for weights
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype, trust_remote_code=True)
+
+    for name in manifest["quantized_modules"]:
+        parent_name, _, child = name.rpartition(".")
+        parent = model.get_submodule(parent_name) if parent_name else model
+        linear = getattr(parent, child)
+        setattr(parent, child, QuantizedLinear(
+            linear.in_features, linear.out_features, linear.bias is not None,
+            manifest["bits"], manifest["group_size"], dtype,
+        ))
+
+    state = torch.load(
+        os.path.join(artifact_dir, manifest["weights_file"]), mmap=True, weights_only=True, map_location="cpu"
+    )
+    model.load_state_dict(state, strict=False, assign=True)
+    model.tie_weights()
+
+    missing = [n for n, p in list(model.named_parameters()) + list(model.named_buffers()) if p.is_meta]
+    if missing:
+        raise ValueError(f"Artifact is missing {len(missing)} tensors (e.g. {missing[0]})")
+
+    model.eval()
+    print(f"[TruthShield] Mapped int{manifest['bits']} artifact ({manifest['num_tensors']} tensors) in {time.time() - start:.1f}s")
+    return model
@@ -0,0 +1,293 @@
+"""
+TruthShield — Multi-Replica Inference Pool
+
+With --replicas N the engine loads MedGemma once, then forks N worker
+processes. Each worker owns a contiguous slice of the inference cores and
+serves generations from its copy of the model:
+
+    parent (Gradio + router) ──pipe──► replica 0  (cores 0-3)
+                             ──pipe──► replica 1  (cores 4-7)
+
+Weights are shared rather than duplicated: forked pages stay shared
+copy-on-write as long as nobody writes to them (inference never does), and
+a memory-mapped pre-quantized artifact is shared through the page cache.
+Only per-replica activations and KV caches cost extra RAM.
+
+The router sends each call to the live replica with the least outstanding
+work (sum of max_tokens in flight). Inside a replica, concurrent calls still
+go through a MicroBatchScheduler. A caller's CancelToken is mirrored into
+the replica (deadline with the call, cancel() as a follow-up message).
+
+Forking requires that the parent has not run inference yet (runtime thread
+pools do not survive fork), so warmup runs inside each replica instead.
+"""
+
+import itertools
+import multiprocessing
+import queue
+import threading
+
+from batching import MicroBatchScheduler
+from cancellation import CancelToken, GenerationCancelled
+from cpu_topology import ThreadTopology, configure, get_topology, pin_inference_thread, split_cores
+from metrics import METRICS
+
+
+def _replica_main(index, cores, conn, backend, warmup_fn, max_batch_size, max_wait_ms):
+    """Worker process body: serve requests from the router until the pipe closes."""
+    parent = get_topology()
+    configure(ThreadTopology(cores, parent.server_cores, len(cores), parent.inter_op, parent.numa_node))
+    pin_inference_thread()
+
+    send_lock = threading.Lock()
+
+    def _send(message):
+        with send_lock:
+            conn.send(message)
+
+    try:
+        if warmup_fn is not None:
+            warmup_fn()
+    except Exception as e:
+        print(f"[TruthShield] Replica {index} warmup failed: {e}")
+    scheduler = MicroBatchScheduler(backend.generate_batch, max_batch_size, max_wait_ms)
+    _send(("ready", index, None))
+    # call_id → CancelToken of the calls in flight
+    tokens = {}
+
+    def _handle(call_id, kind, input_text, max_tokens, prefix_text, options, priority, timeout_s):
+        cancel = tokens[call_id]
+        try:
+            if kind == "stream":
+                for piece in scheduler.stream(
+                    input_text, max_tokens, prefix_text=prefix_text, cancel=cancel, priority=priority, **options
+                ):
+                    _send(("piece", call_id, piece))
+                _send(("done", call_id, None))
+            else:
+                text = scheduler.submit(
+                    input_text, max_tokens, prefix_text=prefix_text, cancel=cancel, priority=priority, **options
+                )
+                _send(("done", call_id, text))
+        except GenerationCancelled as e:
+            _send(("cancelled", call_id, e.reason))
+        except Exception as e:
+            _send(("error", call_id, f"{type(e).__name__}: {e}"))
+        finally:
+            tokens.pop(call_id, None)
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        call_id, kind = message[0], message[1]
+        if kind == "cancel":
+            if call_id in tokens:
+                tokens[call_id].cancel()
+            continue
+        tokens[call_id] = CancelToken(message[-1])
+        threading.Thread(target=_handle, args=message, name="truthshield-replica-call", daemon=True).start()
+
+
+class _Replica:
+    def __init__(self, index, cores, process, conn):
+        self.index = index
+        self.cores = cores
+        self.process = process
+        self.conn = conn
+        self.outstanding = 0
+        self.alive = True
+        self.ready = threading.Event()
+        self.send_lock = threading.Lock()
+
+
+class ReplicaPool:
+    """Forked model replicas behind a least-outstanding-work router."""
+
+    def __init__(self, backend, num_replicas: int, warmup_fn=None, max_batch_size: int = 4,
+                 max_wait_ms: float = 25.0):
+        if backend.name != "transformers":
+            raise ValueError("Replicas require the transformers backend (runtime sessions cannot be forked)")
+        self.backend = backend
+        self.num_replicas = num_replicas
+        self.warmup_fn = warmup_fn
+        # Each replica batches its own callers with the engine's scheduler settings
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.replicas = []
+        self._calls = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def start(self, ready_timeout: float = 600.0):
+        ctx = multiprocessing.get_context("fork")
+        for index, cores in enumerate(split_cores(get_topology().inference_cores, self.num_replicas)):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_replica_main,
+                args=(
+                    index, cores, child_conn, self.backend, self.warmup_fn, self.max_batch_size, self.max_wait_ms,
+                ),
+                name=f"truthshield-replica-{index}",
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            replica = _Replica(index, cores, process, parent_conn)
+            self.replicas.append(replica)
+            threading.Thread(
+                target=self._reader_loop, args=(replica,), name=f"truthshield-replica-{index}-reader", daemon=True
+            ).start()
+        for replica in self.replicas:
+            replica.ready.wait(ready_timeout)
+        live = [r for r in self.replicas if r.alive and r.ready.is_set()]
+        if not live:
+            raise RuntimeError("No inference replica came up")
+        print(f"[TruthShield] {len(live)} replicas serving on cores "
+              + " | ".join(",".join(map(str, r.cores)) for r in live))
+        return self
+
+    def close(self):
+        for replica in self.replicas:
+            try:
+                with replica.send_lock:
+                    replica.conn.send(None)
+            except (OSError, BrokenPipeError):
+                pass
+            replica.process.join(timeout=5)
+            if replica.process.is_alive():
+                replica.process.terminate()
+        self.replicas = []
+
+    def describe(self) -> str:
+        live = sum(1 for r in self.replicas if r.alive)
+        return f"{live}/{len(self.replicas)} replicas"
+
+    # ── Routing ──────────────────────────────────────────────────────────
+
+    def _reserve(self, call_id, max_tokens, inbox):
+        """Picks the least-loaded live replica and books the call's work on it in one step.
+
+        Done under one lock hold so concurrent callers see each other's
+        reservations instead of all choosing the same replica.
+        """
+        with self._lock:
+            live = [r for r in self.replicas if r.alive and r.ready.is_set()]
+            if not live:
+                raise RuntimeError("All inference replicas have exited")
+            replica = min(live, key=lambda r: r.outstanding)
+            replica.outstanding += max_tokens
+            self._calls[call_id] = (replica, max_tokens, inbox)
+            return replica, replica.outstanding
+
+    def _dispatch(self, kind, input_text, max_tokens, prefix_text, options, cancel=None, priority=None):
+        call_id = next(self._ids)
+        inbox = queue.Queue()
+        replica, outstanding = self._reserve(call_id, max_tokens, inbox)
+        METRICS.observe("replica_outstanding", outstanding)
+        METRICS.incr(f"replica_{replica.index}_calls")
+        try:
+            with replica.send_lock:
+                replica.conn.send((
+                    call_id, kind, input_text, max_tokens, prefix_text, options, priority,
+                    cancel.remaining() if cancel is not None else None,
+                ))
+        except (OSError, BrokenPipeError) as e:
+            self._finish(call_id)
+            raise RuntimeError(f"Replica {replica.index} is unreachable: {e}")
+        return call_id, inbox
+
+    def _cancel_call(self, call_id):
+        """Tells the replica to stop decoding call_id; its late reply is dropped."""
+        with self._lock:
+            entry = self._calls.get(call_id)
+        if entry is None:
+            return
+        self._finish(call_id)
+        try:
+            with entry[0].send_lock:
+                entry[0].conn.send((call_id, "cancel"))
+        except (OSError, BrokenPipeError):
+            pass
+
+    def _receive(self, call_id, inbox, cancel):
+        """Next (kind, payload) for a call; raises GenerationCancelled once cancel fires."""
+        while True:
+            try:
+                kind, payload = inbox.get(timeout=0.05 if cancel is not None else None)
+            except queue.Empty:
+                if cancel.reason is not None:
+                    self._cancel_call(call_id)
+                    raise GenerationCancelled(cancel.reason)
+                continue
+            if kind == "cancelled":
+                raise GenerationCancelled(payload)
+            if kind == "error":
+                raise RuntimeError(payload)
+            return kind, payload
+
+    def _finish(self, call_id):
+        with self._lock:
+            entry = self._calls.pop(call_id, None)
+            if entry is not None:
+                entry[0].outstanding -= entry[1]
+
+    def submit(self, input_text: str, max_tokens: int, prefix_text: str = None, cancel=None, priority=None,
+               **options) -> str:
+        """Same contract as MicroBatchScheduler.submit, served by the least-loaded replica."""
+        call_id, inbox = self._dispatch("generate", input_text, max_tokens, prefix_text, options, cancel, priority)
+        return self._receive(call_id, inbox, cancel)[1]
+
+    def stream(self, input_text, max_tokens, prefix_text=None, cancel=None, priority=None, **options):
+        """Same contract as MicroBatchScheduler.stream, served by the least-loaded replica.
+
+        priority orders the call inside the replica (see priority.py).
+        """
+        call_id, inbox = self._dispatch("stream", input_text, max_tokens, prefix_text, options, cancel, priority)
+        finished = False
+        try:
+            while True:
+                kind, payload = self._receive(call_id, inbox, cancel)
+                if kind != "piece":
+                    finished = True
+                    return
+                yield payload
+        except Exception:
+            finished = True
+            raise
+        finally:
+            if not finished:
+                # Consumer stopped reading: free the replica's cores
+                self._cancel_call(call_id)
+
+    def _reader_loop(self, replica):
+        while True:
+            try:
+                kind, call_id, payload = replica.conn.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "ready":
+                replica.ready.set()
+                continue
+            with self._lock:
+                entry = self._calls.get(call_id)
+            if entry is None:
+                continue
+            if kind != "piece":
+                self._finish(call_id)
+            entry[2].put((kind, payload))
+
+        # Replica exited: fail whatever it still owed
+        replica.alive = False
+        replica.ready.set()
+        with self._lock:
+            orphaned = [cid for cid, entry in self._calls.items() if entry[0] is replica]
+        for call_id in orphaned:
+            entry = self._calls.get(call_id)
+            self._finish(call_id)
+            if entry is not None:
+                entry[2].put(("error", f"Replica {replica.index} exited (code {replica.process.exitcode})"))
+        print(f"[TruthShield] Replica {replica.index} exited")
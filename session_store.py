@@ -0,0 +1,84 @@
+"""
+TruthShield — Per-Session UI State
+
+The patient portal keeps each browser session's personalized questions
+between "Submit Story" and "Submit Detailed Survey". That state used to live
+on the shared engine object, so two concurrent patients overwrote each
+other's survey; it is now keyed by Gradio's session_hash.
+
+Sessions are evicted after ttl_s without activity, and at most max_sessions
+are kept (least recently used first), so abandoned tabs cannot grow memory
+without bound. Stdlib only, like metrics.py.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import METRICS
+
+
+class SessionStore:
+    """Thread-safe {session_id: {key: value}} with idle TTL and an LRU size cap."""
+
+    def __init__(self, ttl_s: float = 3600.0, max_sessions: int = 1000):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # session_id → (last access time, state dict); oldest access first
+        self._sessions = OrderedDict()
+
+    def configure(self, ttl_s: float = None, max_sessions: int = None):
+        with self._lock:
+            if ttl_s is not None:
+                self.ttl_s = ttl_s
+            if max_sessions is not None:
+                self.max_sessions = max(1, max_sessions)
+            self._evict(time.time())
+
+    def _touch(self, session_id, now):
+        """State dict for session_id, created if missing. Call under lock."""
+        entry = self._sessions.pop(session_id, None)
+        state = entry[1] if entry is not None else {}
+        self._sessions[session_id] = (now, state)
+        return state
+
+    def _evict(self, now):
+        """Drops idle sessions, then the least recently used beyond the cap. Call under lock."""
+        while self._sessions:
+            session_id, (last, _) = next(iter(self._sessions.items()))
+            if now - last <= self.ttl_s and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            METRICS.incr("sessions_evicted")
+
+    def get(self, session_id, key, default=None):
+        if not session_id:
+            return default
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return default
+            return self._touch(session_id, now).get(key, default)
+
+    def set(self, session_id, key, value):
+        if not session_id:
+            return
+        now = time.time()
+        with self._lock:
+            self._touch(session_id, now)[key] = value
+            self._evict(now)
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+# Process-wide store shared by the Gradio handlers
+SESSIONS = SessionStore()
@@ -10,6 +10,10 @@ Prerequisites:
 Usage:
     python setup_model.py --hf-token YOUR_TOKEN
     python setup_model.py --hf-token YOUR_TOKEN --output-dir ./models/medgemma-4b-awq
+    python setup_model.py --hf-token YOUR_TOKEN --gguf --llama-cpp-dir ~/llama.cpp
+    python setup_model.py --skip-download --gguf --llama-cpp-dir ~/llama.cpp
+    python setup_model.py --skip-download --onnx --onnx-int8
+    python setup_model.py --skip-download --prequantize int8
 
 You need a HuggingFace token with access to google/medgemma-4b-it.
 Request access at: https://huggingface.co/google/medgemma-4b-it
@@ -17,6 +21,8 @@ Request access at: https://huggingface.co/google/medgemma-4b-it
 
 import argparse
 import os
+import shutil
+import subprocess
 import sys
 import time
 
@@ -77,7 +83,7 @@ def download_and_quantize(hf_token: str, output_dir: str, model_id: str):
         print(f"      ❌ Missing config.json in {output_dir}")
         sys.exit(1)
 
-    print(f"      TruthShield will use bitsandbytes 4-bit loading at runtime to save VRAM.")
+    print(f"      TruthShield converts weights at load time; add --prequantize int8 for a ready-to-map artifact.")
 
     # ── Step 4: Final Message ───────────────────────────────────────────
     print(f"{'='*60}")
@@ -88,6 +94,133 @@ def download_and_quantize(hf_token: str, output_dir: str, model_id: str):
     print(f"{'='*60}")
 
 
+def convert_to_gguf(output_dir: str, llama_cpp_dir: str, quant_type: str = "Q4_K_M"):
+    """Converts the downloaded weights to GGUF for the llama.cpp CPU backend.
+
+    Uses llama.cpp's convert_hf_to_gguf.py to write an f16 GGUF next to the
+    transformers weights, then llama-quantize to produce the runtime file.
+    """
+    print(f"\n[GGUF] Converting {output_dir} for the llama.cpp backend...")
+    if not llama_cpp_dir or not os.path.isdir(llama_cpp_dir):
+        print("[ERROR] --llama-cpp-dir must point to a llama.cpp checkout (for convert_hf_to_gguf.py).")
+        sys.exit(1)
+
+    convert_script = os.path.join(llama_cpp_dir, "convert_hf_to_gguf.py")
+    if not os.path.exists(convert_script):
+        print(f"[ERROR] {convert_script} not found.")
+        sys.exit(1)
+
+    name = os.path.basename(os.path.normpath(output_dir))
+    f16_path = os.path.join(output_dir, f"{name}-f16.gguf")
+    start = time.time()
+    result = subprocess.run(
+        [sys.executable, convert_script, output_dir, "--outfile", f16_path, "--outtype", "f16"]
+    )
+    if result.returncode != 0:
+        print(f"[ERROR] GGUF conversion failed with code {result.returncode}.")
+        sys.exit(1)
+    print(f"      Wrote {f16_path} in {time.time() - start:.0f}s")
+
+    if quant_type.lower() == "f16":
+        return f16_path
+
+    quantize_bin = None
+    for candidate in [
+        os.path.join(llama_cpp_dir, "build", "bin", "llama-quantize"),
+        os.path.join(llama_cpp_dir, "llama-quantize"),
+        shutil.which("llama-quantize"),
+    ]:
+        if candidate and os.path.exists(candidate):
+            quantize_bin = candidate
+            break
+    if not quantize_bin:
+        print("      ⚠️ llama-quantize not found; keeping the f16 GGUF (build llama.cpp to quantize).")
+        return f16_path
+
+    quant_path = os.path.join(output_dir, f"{name}-{quant_type}.gguf")
+    start = time.time()
+    result = subprocess.run([quantize_bin, f16_path, quant_path, quant_type])
+    if result.returncode != 0:
+        print(f"[ERROR] llama-quantize failed with code {result.returncode}.")
+        sys.exit(1)
+    # The quantized file is all the runtime needs
+    os.remove(f16_path)
+    print(f"      Saved {quant_path} in {time.time() - start:.0f}s")
+    return quant_path
+
+
+def export_onnx(output_dir: str, int8: bool = False):
+    """Exports an optimized ONNX decoder-with-past graph next to the transformers weights.
+
+    Writes <output_dir>/onnx/ with the exported graph, an ORT-optimized copy and,
+    with int8, a dynamically quantized copy. The ONNX backend picks the most
+    processed file it finds.
+    """
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM, ORTOptimizer, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+        from transformers import AutoTokenizer
+    except ImportError:
+        print("[ERROR] ONNX export needs: pip install optimum[onnxruntime]")
+        sys.exit(1)
+
+    onnx_dir = os.path.join(output_dir, "onnx")
+    print(f"\n[ONNX] Exporting decoder-with-past graph to {onnx_dir}...")
+    start = time.time()
+    try:
+        model = ORTModelForCausalLM.from_pretrained(output_dir, export=True, use_cache=True)
+        model.save_pretrained(onnx_dir)
+        AutoTokenizer.from_pretrained(output_dir).save_pretrained(onnx_dir)
+    except Exception as e:
+        print(f"[ERROR] ONNX export failed: {e}")
+        sys.exit(1)
+    print(f"      Exported in {time.time() - start:.0f}s")
+
+    file_name = "model.onnx"
+    start = time.time()
+    try:
+        # Level 2: constant folding plus fused attention/GELU/LayerNorm kernels
+        optimizer = ORTOptimizer.from_pretrained(model)
+        optimizer.optimize(save_dir=onnx_dir, optimization_config=OptimizationConfig(optimization_level=2))
+        file_name = "model_optimized.onnx"
+        print(f"      Graph optimized in {time.time() - start:.0f}s")
+    except Exception as e:
+        # Unsupported architectures still get ORT_ENABLE_ALL at session creation
+        print(f"      ⚠️ Offline graph optimization unavailable ({e}); using the exported graph.")
+
+    if int8:
+        start = time.time()
+        try:
+            quantizer = ORTQuantizer.from_pretrained(onnx_dir, file_name=file_name)
+            qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=True)
+            quantizer.quantize(save_dir=onnx_dir, quantization_config=qconfig)
+            print(f"      int8 dynamic quantization done in {time.time() - start:.0f}s")
+        except Exception as e:
+            print(f"[ERROR] int8 quantization failed: {e}")
+            sys.exit(1)
+
+    print(f"      ✅ ONNX Runtime artifacts ready in {onnx_dir}")
+    return onnx_dir
+
+
+def prequantize(output_dir: str, bits: int, group_size: int):
+    """Writes the ready-to-run, memory-mappable int8/int4 artifact the engine maps at startup."""
+    from quantized_artifact import build_artifact, read_manifest
+
+    print(f"\n[QUANT] Building pre-quantized int{bits} artifact for fast cold start...")
+    start = time.time()
+    try:
+        artifact_dir = build_artifact(output_dir, bits=bits, group_size=group_size)
+    except Exception as e:
+        print(f"[ERROR] Pre-quantization failed: {e}")
+        sys.exit(1)
+    manifest = read_manifest(artifact_dir)
+    print(f"      {len(manifest['quantized_modules'])} linear layers quantized, "
+          f"{manifest['weights_bytes'] / 1e9:.2f} GB in {time.time() - start:.0f}s")
+    print(f"      ✅ Manifest: {os.path.join(artifact_dir, 'truthshield_manifest.json')}")
+    return artifact_dir
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Download and quantize MedGemma-4B for TruthShield"
@@ -95,7 +228,7 @@ def main():
     parser.add_argument(
         "--hf-token",
         type=str,
-        required=True,
+        default=None,
         help="HuggingFace token with access to google/medgemma-4b-it",
     )
     parser.add_argument(
@@ -110,10 +243,65 @@ def main():
         default="./models/medgemma-4b-awq",
         help="Directory to save quantized model (default: ./models/medgemma-4b-awq)",
     )
+    parser.add_argument(
+        "--skip-download",
+        action="store_true",
+        help="Reuse weights already in --output-dir and only run the conversion steps",
+    )
+    parser.add_argument(
+        "--gguf",
+        action="store_true",
+        help="Also convert the weights to GGUF for the llama.cpp CPU backend",
+    )
+    parser.add_argument(
+        "--gguf-quant",
+        type=str,
+        default="Q4_K_M",
+        help="llama-quantize type for the GGUF file, or f16 to skip quantization (default: Q4_K_M)",
+    )
+    parser.add_argument(
+        "--llama-cpp-dir",
+        type=str,
+        default=os.environ.get("LLAMA_CPP_DIR"),
+        help="Path to a llama.cpp checkout (default: $LLAMA_CPP_DIR)",
+    )
+    parser.add_argument(
+        "--onnx",
+        action="store_true",
+        help="Also export an optimized ONNX decoder-with-past graph for the ONNX Runtime backend",
+    )
+    parser.add_argument(
+        "--onnx-int8",
+        action="store_true",
+        help="Dynamically quantize the exported ONNX graph to int8",
+    )
+    parser.add_argument(
+        "--prequantize",
+        type=str,
+        choices=["int8", "int4"],
+        default=None,
+        help="Write a pre-quantized, memory-mappable artifact so startup skips weight conversion",
+    )
+    parser.add_argument(
+        "--group-size",
+        type=int,
+        default=128,
+        help="int4 quantization group size (default: 128)",
+    )
     args = parser.parse_args()
 
+    if not args.skip_download and not args.hf_token:
+        parser.error("--hf-token is required unless --skip-download is given")
+
     check_dependencies()
-    download_and_quantize(args.hf_token, args.output_dir, args.model_id)
+    if not args.skip_download:
+        download_and_quantize(args.hf_token, args.output_dir, args.model_id)
+    if args.gguf:
+        convert_to_gguf(args.output_dir, args.llama_cpp_dir, args.gguf_quant)
+    if args.onnx or args.onnx_int8:
+        export_onnx(args.output_dir, int8=args.onnx_int8)
+    if args.prequantize:
+        prequantize(args.output_dir, bits=int(args.prequantize[3:]), group_size=args.group_size)
 
 
 if __name__ == "__main__":
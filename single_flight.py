@@ -0,0 +1,164 @@
+"""
+TruthShield — Single-Flight Coalescing of Identical Requests
+
+Double- and triple-clicks on "Run Analysis" or "Submit Story" used to start
+one full generation each, all with the same input. Identical requests that
+arrive while the first is still decoding now attach to it instead:
+
+    caller 1 ──┐
+    caller 2 ──┼──► one generation (driver thread) ──► pieces replayed to every caller
+    caller 3 ──┘
+
+Requests are identical when their result-cache key matches (prompt, system
+message, max_tokens, grammar, stop criteria); once the generation finishes
+its text is in the result cache, so later repeats are cache hits instead.
+
+Each caller keeps its own CancelToken. The shared generation runs under a
+token of its own that fires only when every attached caller has left, so one
+impatient user's Clear never cuts off a colleague waiting on the same output.
+"""
+
+import threading
+
+from cancellation import CANCELLED, CancelToken, GenerationCancelled
+from metrics import METRICS
+
+
+class _Flight:
+    """One running generation and the pieces it has produced so far."""
+
+    def __init__(self, timeout_s):
+        self.cancel = CancelToken(timeout_s)
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self.waiters = 0
+        self.cond = threading.Condition()
+
+
+class _Waiter:
+    """One caller's membership of a flight; detach() runs at most once."""
+
+    def __init__(self, flight, cancel):
+        self.flight = flight
+        self.cancel = cancel
+        self.attached = True
+
+    def detach(self):
+        flight, cancel = self.flight, self.cancel
+        with flight.cond:
+            if not self.attached:
+                return
+            self.attached = False
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.done:
+                flight.cancel.cancel(cancel.reason if cancel is not None and cancel.reason else CANCELLED)
+
+
+def _follow(waiter):
+    flight, cancel = waiter.flight, waiter.cancel
+    index = 0
+    try:
+        while True:
+            with flight.cond:
+                while index >= len(flight.pieces) and not flight.done:
+                    if cancel is not None and cancel.reason is not None:
+                        raise GenerationCancelled(cancel.reason)
+                    flight.cond.wait(0.05)
+                new, index = flight.pieces[index:], len(flight.pieces)
+                done = flight.done
+            for piece in new:
+                yield piece
+            if done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+    finally:
+        # Normal end, own cancel, or a consumer that stopped iterating
+        waiter.detach()
+
+
+class _Attachment:
+    """Iterator over a flight's pieces for one caller, attached from join() on.
+
+    Detaches on exhaustion, error, own cancel, close() or leaving the with
+    block, and also when a handle that was never iterated is dropped.
+    """
+
+    def __init__(self, flight, cancel):
+        # The generator holds the waiter, not this handle, so dropping the handle frees it at once
+        self._waiter = _Waiter(flight, cancel)
+        self._pieces = _follow(self._waiter)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._pieces)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        # An unstarted generator's finally never runs, so detach here as well
+        self._pieces.close()
+        self._waiter.detach()
+
+
+class SingleFlight:
+    """Registry of in-flight generations keyed by their result-cache key."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, start, cancel=None, timeout_s=None):
+        """Pieces of the generation for key, starting it with start(flight_token) if none is running.
+
+        start must return an iterator of pieces; it runs on a driver thread.
+        cancel is this caller's token: when it fires the caller detaches (and
+        raises GenerationCancelled); the generation stops once nobody is left.
+        The caller is attached from this call on, so use the result as a
+        context manager (or close() it) in case it is never iterated.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            # A flight abandoned by all its callers is winding down; start afresh
+            leader = flight is None or flight.cancel.reason is not None
+            if leader:
+                flight = self._flights[key] = _Flight(timeout_s)
+            with flight.cond:
+                flight.waiters += 1
+        if leader:
+            threading.Thread(
+                target=self._drive, args=(key, flight, start), name="truthshield-flight", daemon=True
+            ).start()
+        else:
+            METRICS.incr("singleflight_generations_saved")
+        return _Attachment(flight, cancel)
+
+    def _drive(self, key, flight, start):
+        try:
+            for piece in start(flight.cancel):
+                with flight.cond:
+                    flight.pieces.append(piece)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
@@ -0,0 +1,87 @@
+"""
+TruthShield — Speculative Decoding Support
+
+Assisted generation lets a small draft model propose several tokens that
+MedGemma verifies in a single forward pass. With greedy decoding a proposal
+is only kept when it equals the target's own argmax, so the output is
+identical to plain greedy decoding — only faster when the draft agrees often.
+
+Acceptance is measured by counting forward passes on both models around each
+generate call:
+    accepted = new_tokens - target_forwards   (each verify pass adds one token of its own)
+    rate     = accepted / drafted             (every draft forward proposes one token)
+
+Prompt lookup has no draft model, so the number of tokens it proposed is not
+observable this way; its report carries tokens per target forward only.
+"""
+
+import os
+
+from metrics import METRICS
+
+
+class ForwardCounter:
+    """Counts forward passes of a model.
+
+    torch modules get a forward hook; runtimes that are not nn.Modules
+    (e.g. ONNX Runtime sessions behind optimum) have forward wrapped instead.
+    """
+
+    def __init__(self, module):
+        self.calls = 0
+        self._module = module
+        self._handle = None
+        self._original_forward = None
+        if hasattr(module, "register_forward_hook"):
+            self._handle = module.register_forward_hook(self._hook)
+        else:
+            self._original_forward = module.forward
+
+            def _counted(*args, **kwargs):
+                self.calls += 1
+                return self._original_forward(*args, **kwargs)
+
+            module.forward = _counted
+
+    def _hook(self, module, args, output):
+        self.calls += 1
+
+    def remove(self):
+        if self._handle is not None:
+            self._handle.remove()
+        elif self._original_forward is not None:
+            self._module.forward = self._original_forward
+
+
+def resolve_model_dir(path: str, models_dir: str = "./models"):
+    """Accepts either a directory path or a folder name under ./models/."""
+    if not path:
+        return None
+    if os.path.isdir(path):
+        return path
+    candidate = os.path.join(models_dir, path)
+    return candidate if os.path.isdir(candidate) else None
+
+
+def record_speculation(new_tokens: int, target_forwards: int, draft_forwards: int = None, prefix: str = "spec"):
+    """Adds one assisted generate call to the counters; draft_forwards is None without a draft model."""
+    METRICS.incr(prefix + "_new_tokens", new_tokens)
+    METRICS.incr(prefix + "_target_forwards", target_forwards)
+    if draft_forwards is not None:
+        METRICS.incr(prefix + "_drafted_tokens", draft_forwards)
+        METRICS.incr(prefix + "_accepted_tokens", max(0, new_tokens - target_forwards))
+
+
+def speculation_report(prefix: str = "spec", with_drafts: bool = True) -> dict:
+    """Tokens per target forward since startup, plus the acceptance rate when drafts are counted."""
+    forwards = METRICS.get(prefix + "_target_forwards")
+    new_tokens = METRICS.get(prefix + "_new_tokens")
+    report = {"tokens_per_target_forward": (new_tokens / forwards) if forwards else 0.0}
+    if with_drafts:
+        drafted = METRICS.get(prefix + "_drafted_tokens")
+        accepted = METRICS.get(prefix + "_accepted_tokens")
+        report.update(
+            drafted_tokens=drafted, accepted_tokens=accepted,
+            acceptance_rate=(accepted / drafted) if drafted else 0.0,
+        )
+    return report
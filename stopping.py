@@ -0,0 +1,109 @@
+"""
+TruthShield — Content-Aware Stopping Criteria
+
+Generation otherwise runs to EOS or the max_tokens ceiling even when the
+useful content already ended. A request can name criteria that end it early:
+
+    "summary_line"   stop once the closing "Summary: ..." line is complete
+                     (the "**Discrepancies Detected**: N" header does not count)
+    "mcq_lines:N"    stop after N complete "Question | A, B" lines
+    "repeat_loop"    stop when a completed line repeats an earlier one
+                     (greedy decoding that starts looping never recovers)
+
+Criteria travel as plain strings (like grammar specs in constrained.py) and
+are evaluated on decoded text, so every backend shares one implementation:
+transformers through a StoppingCriteria-style callable, llama.cpp through its
+stopping_criteria hook. Text is only re-examined when a newline is produced.
+"""
+
+import re
+
+from metrics import METRICS
+
+SUMMARY_LINE = re.compile(r"^\W*summary\W*:", re.IGNORECASE)
+MCQ_LINE = re.compile(r"^\s*(?:\d+\.\s*)?[^|]+\|[^|]+,[^|]+$")
+REPEAT_MIN_CHARS = 12
+STOP_SUMMARY = "summary_line"
+STOP_REPEAT = "repeat_loop"
+
+
+def stop_after_mcq_lines(count: int) -> str:
+    return f"mcq_lines:{count}"
+
+
+def _complete_lines(text: str):
+    """Lines already terminated by a newline, stripped, empty ones dropped."""
+    return [line.strip() for line in text.split("\n")[:-1] if line.strip()]
+
+
+def _has_repeated_line(lines) -> bool:
+    # Short lines ("---", "• ", headings) legitimately recur
+    long_lines = [l for l in lines if len(l) >= REPEAT_MIN_CHARS]
+    return len(long_lines) != len(set(long_lines))
+
+
+class TextStopChecker:
+    """Evaluates a list of criterion specs against the text generated so far."""
+
+    def __init__(self, specs):
+        self.checks = []
+        for spec in specs:
+            name, _, arg = spec.partition(":")
+            if name == STOP_SUMMARY:
+                self.checks.append((spec, lambda lines: any(SUMMARY_LINE.search(l) for l in lines)))
+            elif name == "mcq_lines" and arg.isdigit():
+                n = int(arg)
+                self.checks.append((spec, lambda lines, n=n: sum(1 for l in lines if MCQ_LINE.match(l)) >= n))
+            elif name == STOP_REPEAT:
+                self.checks.append((spec, _has_repeated_line))
+            else:
+                raise ValueError(f"Unknown stopping criterion: {spec!r}")
+
+    def __call__(self, text: str):
+        """Name of the first criterion that fires, or None."""
+        lines = _complete_lines(text)
+        if not lines:
+            return None
+        for spec, check in self.checks:
+            if check(lines):
+                return spec
+        return None
+
+
+def record_early_stop(spec: str, max_tokens: int, new_tokens: int):
+    """Counts the tokens a criterion saved against the request's budget."""
+    saved = max(0, max_tokens - new_tokens)
+    METRICS.incr("stop_early_" + spec.partition(":")[0])
+    METRICS.incr("stop_tokens_saved", saved)
+    METRICS.observe("stop_tokens_saved_per_request", saved)
+
+
+class TokenTextStop:
+    """transformers StoppingCriteria: a row is re-decoded only when its new tokens carry a newline."""
+
+    def __init__(self, checker: TextStopChecker, tokenizer, prompt_len: int):
+        self.checker = checker
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.fired = None
+        # Row index → (criterion, new tokens when it fired)
+        self.fired_rows = {}
+        # Per row: sequence length already scanned (speculative steps may add several tokens)
+        self._checked = {}
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        done = []
+        for i, row in enumerate(input_ids):
+            hit = None
+            start = max(self.prompt_len, self._checked.get(i, self.prompt_len))
+            self._checked[i] = row.shape[0]
+            if row.shape[0] > start and "\n" in self.tokenizer.decode(row[start:]):
+                text = self.tokenizer.decode(row[self.prompt_len:], skip_special_tokens=True)
+                hit = self.checker(text)
+            if hit and i not in self.fired_rows:
+                self.fired_rows[i] = (hit, row.shape[0] - self.prompt_len)
+                self.fired = self.fired or hit
+            done.append(hit is not None)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
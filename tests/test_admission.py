@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+from admission import QUEUE_FULL, AdmissionController, Overloaded
+from backends import InferenceBackend
+from cancellation import TIMED_OUT, CancelToken, GenerationCancelled
+from engine import ClinicalAIEngine
+
+
+def _eventually(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_slot_is_released_when_the_block_raises():
+    admission = AdmissionController(max_depth=1)
+    with pytest.raises(GenerationCancelled):
+        with admission.admit(10):
+            raise GenerationCancelled()
+    assert admission.depth() == 0
+    with admission.admit(10):
+        with pytest.raises(Overloaded) as info:
+            with admission.admit(10):
+                pass
+        assert info.value.reason == QUEUE_FULL
+
+
+def test_fired_token_frees_the_slot_before_the_block_exits():
+    admission = AdmissionController(max_depth=1)
+    cancel = CancelToken()
+    with admission.admit(10, cancel):
+        cancel.cancel()
+        # The runtime has not noticed yet, but new work is admitted already
+        assert admission.depth() == 0
+        with admission.admit(10):
+            pass
+    timed_out = CancelToken(0.01)
+    with admission.admit(10, timed_out):
+        time.sleep(0.02)
+        assert admission.depth() == 0
+
+
+class _SlowBackend(InferenceBackend):
+    """Streams one word per step until max_tokens, honouring the CancelToken like real runtimes."""
+
+    name = "slow"
+
+    def render_prompt(self, prompt_text, system_msg):
+        return f"{system_msg}\n{prompt_text}"
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def stream(self, input_text, max_tokens, prefix_text=None, decoding="auto", grammar=None, stop=None, cancel=None):
+        for i in range(max_tokens):
+            if cancel is not None:
+                cancel.check()
+            time.sleep(0.01)
+            yield f"w{i} "
+
+    def generate(self, input_text, max_tokens, prefix_text=None, decoding="auto", grammar=None, stop=None,
+                 cancel=None):
+        return "".join(self.stream(input_text, max_tokens, cancel=cancel))
+
+
+@pytest.fixture
+def engine():
+    e = ClinicalAIEngine()
+    e.backend = _SlowBackend()
+    e.is_simulation = False
+    e.state = "ready"
+    e.admission.configure(max_depth=1)
+    return e
+
+
+def test_admission_recovers_after_a_cancelled_stream(engine):
+    cancel = CancelToken()
+    stream = engine.run_inference_stream("first", max_tokens=500, cancel=cancel)
+    next(stream)
+    with pytest.raises(Overloaded):
+        engine.run_inference("second", max_tokens=5)
+    cancel.cancel()
+    with pytest.raises(GenerationCancelled):
+        for _ in stream:
+            pass
+    assert _eventually(lambda: engine.admission.depth() == 0)
+    assert engine.run_inference("second", max_tokens=5) == "w0 w1 w2 w3 w4 "
+
+
+def test_admission_recovers_after_a_timeout_and_an_abandoned_stream(engine):
+    engine.inference_timeout_s = 0.05
+    with pytest.raises(GenerationCancelled) as info:
+        engine.run_inference("slow", max_tokens=500)
+    assert info.value.reason == TIMED_OUT
+    assert _eventually(lambda: engine.admission.depth() == 0)
+
+    engine.inference_timeout_s = 0.0
+    stream = engine.run_inference_stream("abandoned", max_tokens=500)
+    next(stream)
+    stream.close()  # The browser went away
+    assert _eventually(lambda: engine.admission.depth() == 0)
+    assert engine.run_inference("next", max_tokens=3) == "w0 w1 w2 "
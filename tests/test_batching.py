@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from batching import InferenceRequest, MicroBatchScheduler, RowStreamer
+from cancellation import CancelToken, GenerationCancelled
+
+
+class _Recorder:
+    """generate_batch stand-in: streams each row's own words to its sink, one step for all rows at a time."""
+
+    def __init__(self, steps=3, step_s=0.01):
+        self.steps = steps
+        self.step_s = step_s
+        self.batches = []
+
+    def __call__(self, requests):
+        self.batches.append(len(requests))
+        texts = [""] * len(requests)
+        for step in range(self.steps):
+            time.sleep(self.step_s)
+            for i, r in enumerate(requests):
+                if r.cancelled:
+                    continue
+                piece = f"{r.input_text}-{step} "
+                texts[i] += piece
+                if r.sink is not None:
+                    r.sink(piece)
+        return [GenerationCancelled(r.cancel.reason) if r.cancelled else t for r, t in zip(requests, texts)]
+
+
+def test_concurrent_streams_share_one_batch():
+    backend = _Recorder()
+    scheduler = MicroBatchScheduler(backend, max_batch_size=4, max_wait_ms=100)
+    results = {}
+
+    def _consume(name):
+        results[name] = list(scheduler.stream(name, 8, grammar="mcq:10"))
+
+    threads = [threading.Thread(target=_consume, args=(n,)) for n in ("a", "b", "c")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert backend.batches == [3]
+    for name in ("a", "b", "c"):
+        assert results[name] == [f"{name}-0 ", f"{name}-1 ", f"{name}-2 "]
+
+
+def test_closing_a_stream_cancels_only_its_row():
+    backend = _Recorder(steps=20)
+    scheduler = MicroBatchScheduler(backend, max_batch_size=2, max_wait_ms=100)
+    kept = []
+    keeper = threading.Thread(target=lambda: kept.extend(scheduler.stream("keep", 8)))
+    keeper.start()
+    leaving = scheduler.stream("leave", 8)
+    assert next(leaving) == "leave-0 "
+    leaving.close()
+    keeper.join()
+    assert backend.batches == [2]
+    assert len(kept) == 20
+
+
+def test_stream_raises_when_cancelled():
+    scheduler = MicroBatchScheduler(_Recorder(steps=50), max_batch_size=1)
+    cancel = CancelToken()
+    pieces = scheduler.stream("x", 8, cancel=cancel)
+    next(pieces)
+    cancel.cancel()
+    with pytest.raises(GenerationCancelled):
+        list(pieces)
+    assert cancel.reason is not None
+
+
+def test_row_streamer_sends_only_new_complete_text():
+    received = []
+    request = InferenceRequest("prompt", 8, sink=received.append)
+    streamer = RowStreamer(tokenizer=None, prompt_len=0, requests=[request])
+    for text in ("Sum", "Summary�", "Summary: 2", "Summary: 2"):
+        streamer.emit(0, text)
+    assert received == ["Sum", "mary", ": 2"]
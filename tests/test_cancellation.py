@@ -0,0 +1,41 @@
+import threading
+import time
+
+from cancellation import CANCELLED, TIMED_OUT, CancelToken
+from metrics import METRICS
+
+
+def test_child_deadline_leaves_the_parent_untouched():
+    parent = CancelToken()
+    child = parent.child(0.01)
+    time.sleep(0.02)
+    assert child.reason == TIMED_OUT
+    assert parent.reason is None and parent.deadline is None
+
+
+def test_child_fires_with_its_parent():
+    parent = CancelToken()
+    child = parent.child(60)
+    fired = []
+    waiter = threading.Thread(target=lambda: fired.append(child.wait(5)))
+    waiter.start()
+    parent.cancel()
+    waiter.join()
+    assert fired == [True] and child.reason == CANCELLED
+
+
+def test_child_remaining_is_the_sooner_deadline():
+    parent = CancelToken(60)
+    assert 59 < parent.child().remaining() <= 60
+    assert parent.child(1).remaining() <= 1
+    assert CancelToken().child().remaining() is None
+
+
+def test_finished_call_is_not_counted_as_timed_out_later():
+    caller = CancelToken()
+    call = caller.child(0.01)
+    assert call.reason is None  # The call finished in time
+    before = METRICS.get("requests_timed_out")
+    time.sleep(0.02)
+    assert caller.reason is None
+    assert METRICS.get("requests_timed_out") == before
@@ -0,0 +1,48 @@
+import re
+
+from constrained import (
+    OPTIONS_MAX_CHARS,
+    QUESTION_MAX_CHARS,
+    MCQStreamParser,
+    _LineState,
+    mcq_max_tokens,
+    parse_mcq_lines,
+)
+
+
+def _text(length):
+    """Short clinical words (the densest case for a tokenizer), cut to length characters."""
+    return " ".join("Do you or a new GP ever skip PRN meds at home".split() * length)[:length]
+
+
+def _maximal_line(number=1):
+    """One line at both grammar bounds: the question and the options are as long as allowed."""
+    question = _text(QUESTION_MAX_CHARS - 1) + "?"
+    options = (" " + ", ".join([_text(36).strip()] * 3)).ljust(OPTIONS_MAX_CHARS, "s")
+    return f"{number}. {question}|{options}"
+
+
+def _rough_tokens(text):
+    # Short words, numbers and punctuation marks are one token each in BPE vocabularies
+    return len(re.findall(r"\w+|[^\w\s]|\n", text))
+
+
+def test_maximal_line_is_grammatical_and_parses():
+    line = _maximal_line()
+    state = _LineState(1)
+    state.feed(line)
+    assert len(state.question) == QUESTION_MAX_CHARS
+    assert len(state.options) == OPTIONS_MAX_CHARS
+    state.feed("\n")
+    assert state.done
+    [(question, options)] = parse_mcq_lines(line)
+    assert question.endswith("?") and len(options) == 3
+    assert MCQStreamParser().feed(line + "\n") == [(question, options)]
+
+
+def test_budget_fits_maximal_lines():
+    assert _rough_tokens(_maximal_line() + "\n") < mcq_max_tokens(1)
+    ten = "\n".join(_maximal_line(n) for n in range(1, 11)) + "\n"
+    assert len(parse_mcq_lines(ten)) == 10
+    assert _rough_tokens(ten) < mcq_max_tokens(10)
+    assert mcq_max_tokens(1) >= 120
@@ -0,0 +1,69 @@
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from admission import Overloaded
+from engine_client import EngineUnreachable, RemoteEngine
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # path → (status, body bytes)
+    routes = {}
+
+    def do_GET(self):
+        status, body = self.routes[self.path]
+        self.send_response(status)
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_plain_text_error_body_keeps_status(server):
+    _Handler.routes = {"/health": (502, b"<html>Bad Gateway</html>")}
+    with pytest.raises(RuntimeError, match=r"HTTP 502.*Bad Gateway"):
+        RemoteEngine(server)._call("/health")
+
+
+def test_json_error_bodies_map_to_exceptions(server):
+    _Handler.routes = {
+        "/v1/generate": (503, json.dumps({"overloaded": "slo", "estimated_wait": 42.0}).encode()),
+        "/v1/count_tokens": (500, b""),
+    }
+    engine = RemoteEngine(server)
+    with pytest.raises(Overloaded) as info:
+        engine._call("/v1/generate", {})
+    assert info.value.estimated_wait_s == 42.0
+    with pytest.raises(RuntimeError, match="HTTP 500"):
+        engine.count_tokens("hello")
+
+
+def test_connection_refused_degrades():
+    engine = RemoteEngine(f"http://127.0.0.1:{_free_port()}", timeout=2.0)
+    with pytest.raises(EngineUnreachable):
+        engine._call("/health")
+    assert engine.state == "failed" and engine.is_simulation
+    assert engine.run_inference("prompt") is None
+    with pytest.raises(EngineUnreachable):
+        list(engine.run_inference_stream("prompt"))
@@ -0,0 +1,140 @@
+import re
+import threading
+import time
+
+import pytest
+
+import session_store
+from session_store import SessionStore
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(session_store.time, "time", c)
+    return c
+
+
+def test_sessions_are_isolated():
+    store = SessionStore()
+    store.set("a", "personalized_qs", ["qa"])
+    store.set("b", "personalized_qs", ["qb"])
+    assert store.get("a", "personalized_qs") == ["qa"]
+    assert store.get("b", "personalized_qs") == ["qb"]
+    store.drop("a")
+    assert store.get("a", "personalized_qs") is None
+    assert store.get("b", "personalized_qs") == ["qb"]
+    # Requests without a session hash never share state
+    store.set(None, "personalized_qs", ["anon"])
+    assert store.get(None, "personalized_qs", []) == []
+
+
+def test_idle_sessions_expire(clock):
+    store = SessionStore(ttl_s=60.0)
+    store.set("idle", "k", 1)
+    store.set("active", "k", 2)
+    clock.now += 40
+    assert store.get("active", "k") == 2  # Reading counts as activity
+    clock.now += 40
+    assert store.get("idle", "k") is None
+    assert store.get("active", "k") == 2
+    assert len(store) == 1
+
+
+def test_least_recently_used_session_is_evicted(clock):
+    store = SessionStore(max_sessions=2)
+    store.set("a", "k", 1)
+    clock.now += 1
+    store.set("b", "k", 2)
+    clock.now += 1
+    store.get("a", "k")
+    clock.now += 1
+    store.set("c", "k", 3)
+    assert store.get("b", "k") is None
+    assert store.get("a", "k") == 1 and store.get("c", "k") == 3
+    store.configure(max_sessions=1)
+    assert len(store) == 1 and store.get("c", "k") == 3
+
+
+class _StoryEngine:
+    """Stands in for ClinicalAIEngine: every answer names the patient its prompt was about."""
+
+    state = "ready"
+    is_simulation = False
+    loading_policy = "degrade"
+    overload_policy = "degrade"
+    inference_timeout_s = 0.0
+
+    def is_loading(self):
+        return False
+
+    def await_ready(self):
+        return True
+
+    def cancel_prefill(self):
+        pass
+
+    def run_inference_stream(self, prompt_text, system_msg=None, max_tokens=512, **kwargs):
+        patient = re.search(r"patient (\d+)", prompt_text).group(1)
+        if "psychometrician" in (system_msg or ""):
+            lines = [f"{n}. Patient {patient} question {n}? | Yes, No, Unsure\n" for n in range(1, 11)]
+        else:
+            lines = [f"Discrepancy for patient {patient}.\n", f"Summary: 1 discrepancy detected for patient {patient}.\n"]
+        for line in lines:
+            time.sleep(0.001)  # Let the other sessions interleave
+            yield line
+
+
+def test_concurrent_sessions_never_see_each_others_content(monkeypatch):
+    gr = pytest.importorskip("gradio")
+    import main
+
+    monkeypatch.setattr(main, "AI_ENGINE", _StoryEngine())
+    monkeypatch.setattr(main, "MCQ_MODE", "sequential")
+    monkeypatch.setattr(main, "SESSIONS", SessionStore())
+    handlers = main.portal_handlers(main.create_app())
+    submit_story, submit_survey = handlers["_handle_story_submission"], handlers["_submit_patient_data"]
+
+    sessions = 8
+    failures = []
+    start_together = threading.Barrier(sessions)
+
+    def _session(index):
+        request = gr.Request(session_hash=f"test-{index}")
+        story = f"My story as patient {index}."
+        start_together.wait()
+        try:
+            for _ in submit_story(story, request):
+                pass
+            _, survey = submit_survey(request, story, *(["Yes"] * 10))
+            asked = set(re.findall(r"Patient (\d+) question", survey))
+            if asked != {str(index)}:
+                failures.append(f"survey {index} lists questions for patients {sorted(asked)}")
+
+            alert = None
+            for alert, _, _ in main.analyze_discrepancies(
+                request, survey, f"Notes for patient {index}.", "40", "Primary Care", False, *(["Yes"] * 10)
+            ):
+                pass
+            text = alert["value"] if isinstance(alert, dict) else alert
+            named = set(re.findall(r"for patient (\d+)", text))
+            if named != {str(index)}:
+                failures.append(f"analysis {index} names patients {sorted(named)}")
+        except Exception as e:
+            failures.append(f"session {index}: {type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=_session, args=(i,)) for i in range(sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert failures == []
+    assert len(main.SESSIONS) == sessions
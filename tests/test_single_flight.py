@@ -0,0 +1,59 @@
+import gc
+import threading
+
+import pytest
+
+from cancellation import CancelToken, GenerationCancelled
+from single_flight import SingleFlight
+
+
+def _gated(pieces, release):
+    """A start() whose generation waits for release before producing pieces."""
+    tokens = []
+
+    def start(flight_cancel):
+        tokens.append(flight_cancel)
+        release.wait(5)
+        for p in pieces:
+            if flight_cancel.reason is not None:
+                raise GenerationCancelled(flight_cancel.reason)
+            yield p
+
+    return start, tokens
+
+
+def test_identical_requests_share_one_generation():
+    flights, release = SingleFlight(), threading.Event()
+    start, tokens = _gated(["a", "b"], release)
+    first = flights.join("k", start)
+    second = flights.join("k", start)
+    release.set()
+    with first, second:
+        assert "".join(first) == "ab" and "".join(second) == "ab"
+    assert len(tokens) == 1
+
+
+def test_never_iterated_handle_does_not_keep_the_flight_alive():
+    flights, release = SingleFlight(), threading.Event()
+    start, tokens = _gated(["a"], release)
+    flights.join("k", start)  # Dropped without being iterated
+    gc.collect()
+    assert tokens[0].wait(1) and tokens[0].reason is not None
+    release.set()
+
+
+def test_one_caller_leaving_does_not_cancel_the_other():
+    flights, release = SingleFlight(), threading.Event()
+    start, tokens = _gated(["a", "b"], release)
+    mine = CancelToken()
+    leaving = flights.join("k", start, cancel=mine)
+    staying = flights.join("k", start)
+    mine.cancel()
+    with pytest.raises(GenerationCancelled):
+        next(leaving)
+    with leaving:
+        pass
+    release.set()
+    with staying:
+        assert "".join(staying) == "ab"
+    assert tokens[0].reason is None
@@ -0,0 +1,17 @@
+from metrics import METRICS
+from speculative import record_speculation, speculation_report
+
+
+def test_lookup_report_has_no_acceptance_rate():
+    record_speculation(30, 10, prefix="test_lookup")
+    report = speculation_report(prefix="test_lookup", with_drafts=False)
+    assert report == {"tokens_per_target_forward": 3.0}
+    assert METRICS.get("test_lookup_drafted_tokens") == 0
+
+
+def test_draft_report_counts_acceptance():
+    record_speculation(30, 10, 25, prefix="test_spec")
+    report = speculation_report(prefix="test_spec")
+    assert report["accepted_tokens"] == 20
+    assert report["acceptance_rate"] == 0.8
+    assert report["tokens_per_target_forward"] == 3.0
@@ -0,0 +1,24 @@
+from stopping import STOP_REPEAT, STOP_SUMMARY, TextStopChecker, stop_after_mcq_lines
+
+
+def test_discrepancy_header_does_not_stop():
+    check = TextStopChecker([STOP_SUMMARY])
+    text = "## 🚨 TruthShield Clinical Alert — HIGH\n**Discrepancies Detected**: 2 (1 Critical, 1 High)\n"
+    assert check(text) is None
+    assert check(text + "2 discrepancies detected in the notes below.\n") is None
+
+
+def test_summary_line_stops_once_complete():
+    check = TextStopChecker([STOP_SUMMARY])
+    text = "**Discrepancies Detected**: 2\n1. **Category**: Substance use\n"
+    assert check(text + "Summary: 2 discrepancies detected (1 critical, 1 high, 0 moderate).") is None
+    assert check(text + "Summary: 2 discrepancies detected (1 critical, 1 high, 0 moderate).\n") == STOP_SUMMARY
+    assert check(text + "**Summary**: 2 discrepancies detected.\n") == STOP_SUMMARY
+
+
+def test_mcq_lines_and_repeat_loop():
+    check = TextStopChecker([stop_after_mcq_lines(2), STOP_REPEAT])
+    assert check("1. How is your sleep? | Good, Poor, Variable\n") is None
+    assert check("1. How is your sleep? | Good, Poor\n2. Do you feel safe? | Yes, No\n") == "mcq_lines:2"
+    looping = "The patient reports pain.\nThe patient reports pain.\n"
+    assert check(looping) == STOP_REPEAT